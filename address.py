@@ -0,0 +1,123 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+
+"""
+This module normalizes IP addresses with memoization.
+
+:copyright: (c) 2015 by the KUSM Admin Team
+:license: MIT, see LICENSE for more details.
+"""
+
+from functools import lru_cache
+from ipaddr import convert_ip_int2str
+try:
+    import ipaddress
+except ImportError:
+    import ipaddr as ipaddress
+
+
+# 覚えておくアドレスの最大数
+# 同じアドレスは解析、ネットワークへの追加、並べかえと続けて引かれることが
+# 多いので、最近のものだけを覚えておけば十分で、大きくするとプロセスが
+# 終わるまでメモリを使いつづける
+ADDRESS_CACHE_SIZE = 1 << 12
+
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def parse_address(ip_address: str) -> (int, int):
+    """
+    IP アドレスの文字列を (バージョン, 整数) に変換する
+
+    最近解析した文字列は覚えておく。IP アドレスでなければ ValueError をだす
+
+    >>> parse_address("192.168.0.1")
+    (4, 3232235521)
+    """
+    address = ipaddress.ip_address(ip_address)
+    return address.version, int(address)
+
+
+def to_address_string(
+    version: int,
+    address: int
+) -> str:
+    """
+    parse_address の逆で、(バージョン, 整数) を IP アドレスの文字列にする
+
+    アドレスごとに一度しか変換しないことがほとんどなので結果は覚えない
+
+    >>> to_address_string(4, 3232235521)
+    '192.168.0.1'
+    """
+    if version == 4:
+        return convert_ip_int2str(address)
+    return str(ipaddress.IPv6Address(address))
+
+
+def _is_canonical_ipv4(ip_address: str) -> bool:
+    """
+    IPv4 アドレスの文字列のオクテットに先頭の 0 がないかチェックする
+    """
+    return all(
+        octet == "0" or octet[0] != "0" for octet in ip_address.split(".")
+    )
+
+
+def normalize_address(ip_address: str) -> str:
+    """
+    IP アドレスの文字列を正規化する
+
+    IPv4 アドレスがすでに正規化されていれば、同じ文字列をそのまま返す
+
+    >>> normalize_address("2001:DB8:0:0::1")
+    '2001:db8::1'
+    """
+    version, address = parse_address(ip_address)
+    if version == 4 and _is_canonical_ipv4(ip_address):
+        return ip_address
+    return to_address_string(version, address)
+
+
+def is_ip_address(name: str) -> bool:
+    """
+    name が IP アドレスかどうかチェックする
+    """
+    try:
+        parse_address(name)
+        return True
+    except ValueError:
+        return False
+
+
+def get_cache_stats() -> {str: dict}:
+    """
+    parse_address のキャッシュのヒット数などを返す
+    """
+    stats = {}
+    for function in [parse_address]:
+        info = function.cache_info()
+        calls = info.hits + info.misses
+        stats[function.__name__] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "hit_rate": info.hits / calls if calls else 0.0,
+        }
+    return stats
+
+
+def test_address():
+    for ip_address, answer in [
+            ("192.168.0.1", (4, 3232235521)),
+            ("10.0.0.0", (4, 167772160)),
+            ("::1", (6, 1)),
+    ]:
+        assert parse_address(ip_address) == answer
+        assert to_address_string(*answer) == ip_address
+    assert normalize_address("2001:DB8:0:0::1") == "2001:db8::1"
+    ip_address = "".join(["192.168.", "0.1"])
+    assert normalize_address(ip_address) is ip_address
+    assert is_ip_address("192.168.0.1")
+    assert not is_ip_address("host1")
+    assert not is_ip_address("192.168.0.256")
@@ -0,0 +1,498 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+
+"""
+This module transfers zones from an authoritative server by AXFR.
+
+:copyright: (c) 2015 by the KUSM Admin Team
+:license: MIT, see LICENSE for more details.
+"""
+
+import asyncio
+import random
+import socket
+import struct
+from logging import getLogger
+import instrument
+from network import Network, NetworkRangeError, NetworkRouter, make_network
+from parser import RecordParser, RecordParserError, PTRNetworkContext
+from zonefile import ResourceRecord
+
+
+logger = getLogger(__name__)
+
+
+# リソースレコードのタイプとクラスの値と名前
+TYPES = {1: "A", 2: "NS", 5: "CNAME", 6: "SOA", 12: "PTR", 28: "AAAA"}
+TYPE_CODES = {name: code for code, name in TYPES.items()}
+TYPE_AXFR = 252
+CLASSES = {1: "IN", 3: "CH", 4: "HS"}
+
+# rdata がひとつのドメイン名であるタイプ
+_NAME_TYPES = {"NS", "CNAME", "PTR"}
+
+_header = struct.Struct("!HHHHHH")
+_rr_header = struct.Struct("!HHIH")
+_length = struct.Struct("!H")
+
+
+class AXFRError(Exception):
+    """
+    ゾーン転送に失敗したとき、または応答を解釈できないときに発生させる例外
+    """
+    pass
+
+
+def encode_name(name: str) -> bytes:
+    """
+    ドメイン名を圧縮せずにワイヤ形式にする
+
+    >>> encode_name("example.jp.")
+    b'\\x07example\\x02jp\\x00'
+    """
+    labels = [label for label in name.split(".") if label]
+    return b"".join(
+        bytes([len(label)]) + label.encode("ascii") for label in labels
+    ) + b"\x00"
+
+
+def make_query(
+    zone: str,
+    query_id: int
+) -> bytes:
+    """
+    zone の AXFR の問い合わせのメッセージを作る
+    """
+    return _header.pack(query_id, 0, 1, 0, 0, 0) + \
+        encode_name(zone) + struct.pack("!HH", TYPE_AXFR, 1)
+
+
+def _decode_name(
+    message: bytes,
+    offset: int
+) -> (str, int):
+    """
+    message の offset からドメイン名を読み、(絶対名, 次の位置) を返す
+
+    圧縮されたドメイン名のポインタもたどる
+    """
+    labels = []
+    end = None
+    # ポインタがループしていても止まるように、たどる回数を制限する
+    for _ in range(len(message)):
+        if offset >= len(message):
+            raise AXFRError("name is truncated")
+        length = message[offset]
+        if length >= 0xc0:
+            if offset + 1 >= len(message):
+                raise AXFRError("name is truncated")
+            if end is None:
+                end = offset + 2
+            offset = (length & 0x3f) << 8 | message[offset + 1]
+        elif length:
+            if offset + 1 + length > len(message):
+                raise AXFRError("name is truncated")
+            labels.append(
+                message[offset + 1:offset + 1 + length].decode(
+                    "ascii", "replace"
+                )
+            )
+            offset += 1 + length
+        else:
+            return ".".join(labels) + ".", offset + 1 if end is None else end
+    raise AXFRError("name has a pointer loop")
+
+
+def _decode_rdata(
+    message: bytes,
+    offset: int,
+    length: int,
+    type_: str
+) -> [str]:
+    """
+    rdata をゾーンファイルに書くときと同じトークンのリストにする
+    """
+    if type_ == "A" or type_ == "AAAA":
+        family = socket.AF_INET if type_ == "A" else socket.AF_INET6
+        try:
+            return [socket.inet_ntop(
+                family, message[offset:offset + length]
+            )]
+        except ValueError:
+            raise AXFRError("bad {} rdata".format(type_))
+    if type_ in _NAME_TYPES:
+        return [_decode_name(message, offset)[0]]
+    if type_ == "SOA":
+        mname, position = _decode_name(message, offset)
+        rname, position = _decode_name(message, position)
+        if position + 20 > offset + length:
+            raise AXFRError("bad SOA rdata")
+        return [mname, rname] + [
+            str(value) for value in
+            struct.unpack("!IIIII", message[position:position + 20])
+        ]
+    # 知らないタイプは RFC 3597 の形式にする
+    return ["\\#", str(length), message[offset:offset + length].hex()]
+
+
+def decode_message(
+    message: bytes,
+    query_id: int
+) -> [ResourceRecord]:
+    """
+    AXFR の応答のメッセージの answer セクションの
+    リソースレコードのリストを返す
+    """
+    if len(message) < _header.size:
+        raise AXFRError("message is truncated")
+    id_, flags, qdcount, ancount, _, _ = _header.unpack_from(message)
+    if id_ != query_id or not flags & 0x8000:
+        raise AXFRError("unexpected message {}".format(id_))
+    if flags & 0xf:
+        raise AXFRError("server returned rcode {}".format(flags & 0xf))
+
+    offset = _header.size
+    for _ in range(qdcount):
+        _, offset = _decode_name(message, offset)
+        offset += 4
+
+    resource_records = []
+    for _ in range(ancount):
+        owner, offset = _decode_name(message, offset)
+        if offset + _rr_header.size > len(message):
+            raise AXFRError("record is truncated")
+        type_, rclass, ttl, length = _rr_header.unpack_from(message, offset)
+        offset += _rr_header.size
+        if offset + length > len(message):
+            raise AXFRError("rdata is truncated")
+        type_ = TYPES.get(type_, "TYPE{}".format(type_))
+        resource_records.append(ResourceRecord(
+            owner,
+            ttl,
+            CLASSES.get(rclass, "CLASS{}".format(rclass)),
+            type_,
+            _decode_rdata(message, offset, length, type_)
+        ))
+        offset += length
+    return resource_records
+
+
+async def iter_zone(
+    host: str,
+    port: int,
+    zone: str,
+    timeout: float=30.0
+):
+    """
+    host の zone を AXFR で転送し、リソースレコードを受けとったそばから
+    順に生成する非同期ジェネレータ
+
+    最初と最後の SOA レコードも生成する。timeout 秒のあいだ
+    何も受けとれなければ asyncio.TimeoutError をだす
+    """
+    query_id = random.randrange(1 << 16)
+    query = make_query(zone, query_id)
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(host, port), timeout
+    )
+    try:
+        writer.write(_length.pack(len(query)) + query)
+        await writer.drain()
+        soa_count = 0
+        while soa_count < 2:
+            try:
+                length, = _length.unpack(
+                    await asyncio.wait_for(reader.readexactly(2), timeout)
+                )
+                message = await asyncio.wait_for(
+                    reader.readexactly(length), timeout
+                )
+            except asyncio.IncompleteReadError:
+                raise AXFRError("{} is closed before the end of {}".format(
+                    host, zone
+                ))
+            for resource_record in decode_message(message, query_id):
+                if resource_record.type == "SOA":
+                    soa_count += 1
+                elif soa_count == 0:
+                    raise AXFRError("{} does not start with SOA".format(zone))
+                yield resource_record
+                if soa_count == 2:
+                    break
+    finally:
+        writer.close()
+
+
+class AXFRClient:
+    """
+    権威サーバからゾーンを AXFR で転送して Network に追加するクラス
+
+    ゾーンは一つずつの TCP 接続で、最大 concurrency 個を同時に転送する。
+    リソースレコードは受けとったそばから RecordParser と同じ方法で
+    レコードにして Network に追加するので、ゾーンファイルは作らない
+
+    >>> client = AXFRClient("ns.example.jp", concurrency=8)
+    >>> ip_network = client.make_ip_network(
+    ...     ["example.jp."],
+    ...     [("0.168.192.in-addr.arpa.", "192.168.0.0/24")]
+    ... )
+    """
+    def __init__(
+        self,
+        host: str,
+        port: int=53,
+        concurrency: int=8,
+        timeout: float=30.0
+    ):
+        self.host = host
+        self.port = port
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    async def _transfer(
+        self,
+        semaphore: asyncio.Semaphore,
+        zone: str,
+        record_types: {str},
+        add_record
+    ) -> int:
+        """
+        zone を転送し、タイプが record_types にはいっている
+        リソースレコードを add_record に渡す。渡した数を返す
+
+        転送に失敗したときは、ゾーンとサーバを示す AXFRError をだす
+        """
+        added, transferred = 0, 0
+        async with semaphore:
+            logger.debug("transferring {} from {}".format(zone, self.host))
+            try:
+                async for resource_record in iter_zone(
+                        self.host, self.port, zone, self.timeout
+                ):
+                    transferred += 1
+                    if resource_record.type in record_types and \
+                            add_record(resource_record):
+                        added += 1
+            except (AXFRError, OSError, asyncio.TimeoutError) as error:
+                raise AXFRError(
+                    "failed to transfer {} from {}:{}: {}".format(
+                        zone, self.host, self.port,
+                        error or type(error).__name__
+                    )
+                ) from error
+        instrument.count("records transferred", transferred)
+        logger.debug("{} records of {} are transferred".format(
+            transferred, zone
+        ))
+        return added
+
+    async def _transfer_all(
+        self,
+        zone_adders: [(str, {str}, object)]
+    ) -> [int]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*[
+            self._transfer(semaphore, zone, record_types, add_record)
+            for zone, record_types, add_record in zone_adders
+        ])
+
+    def transfer(
+        self,
+        zone_adders: [(str, {str}, object)]
+    ) -> [int]:
+        """
+        (ゾーン, タイプの集合, 関数) のリストの全てのゾーンを転送し、
+        タイプがその集合にはいっているリソースレコードを関数に渡す
+
+        関数はリソースレコードを受けとり、追加したら True を返すもので、
+        ゾーンごとの追加した数のリストを返す
+        """
+        with instrument.stage("transfer"):
+            return asyncio.run(self._transfer_all(zone_adders))
+
+    def make_ip_network(
+        self,
+        a_record_zones: [str],
+        ptr_record_zone_networks: [(str, str)],
+        network_class: type=Network
+    ) -> {str: Network}:
+        """
+        dnschecker.make_ip_network と同じように、A レコードのゾーンと
+        PTR レコードの (ゾーン, ネットワークアドレス) のリストから
+        ネットワークアドレスをキーとする Network の辞書を作る
+
+        どのネットワークにもはいらない A レコードと、ネットワークに
+        はいらない PTR レコードは追加しない
+        """
+        network = {}
+        for _, network_address in ptr_record_zone_networks:
+            network[network_address] = make_network(
+                network_address, network_class
+            )
+        router = NetworkRouter(network.values())
+        parser = RecordParser()
+
+        def a_record_adder():
+            def add_record(resource_record):
+                try:
+                    return router.add_record(
+                        parser.make_a_record(resource_record)
+                    )
+                except RecordParserError:
+                    return False
+            return add_record
+
+        def ptr_record_adder(network_address):
+            context = PTRNetworkContext(network_address)
+
+            def add_record(resource_record):
+                try:
+                    network[network_address].add_record(
+                        parser.make_ptr_record(resource_record, context)
+                    )
+                except (RecordParserError, NetworkRangeError):
+                    return False
+                return True
+            return add_record
+
+        zone_adders = [
+            (zone, {"A", "AAAA"}, a_record_adder())
+            for zone in a_record_zones
+        ]
+        zone_adders.extend(
+            (zone, {"PTR"}, ptr_record_adder(network_address))
+            for zone, network_address in ptr_record_zone_networks
+        )
+        routed = sum(self.transfer(zone_adders))
+        instrument.count("records routed", routed)
+        return network
+
+
+def test_axfr_client():
+    import os
+    from zonefile import ZoneReader
+
+    zone_dir = os.path.join(os.path.dirname(__file__), "testzones")
+    zones = {
+        "example.jp.": "example.jp.zone",
+        "0.168.192.in-addr.arpa.": "192.168.0.rev",
+    }
+
+    def encode_owner(owner, zone):
+        # ゾーンの中の名前は問い合わせのゾーン名 (オフセット 12) への
+        # ポインタで圧縮する
+        if owner.endswith("." + zone):
+            return encode_name(owner[:-len(zone)])[:-1] + b"\xc0\x0c"
+        return encode_name(owner)
+
+    def encode_record(resource_record, zone):
+        if resource_record.type == "A":
+            rdata = socket.inet_pton(socket.AF_INET, resource_record.rdata[0])
+        elif resource_record.type == "PTR":
+            rdata = encode_name(resource_record.rdata[0] + "." + zone)
+        else:
+            rdata = encode_name("ns." + zone) + encode_name("root." + zone) \
+                + struct.pack("!IIIII", 1, 3600, 600, 86400, 300)
+        return encode_owner(resource_record.owner, zone) + _rr_header.pack(
+            TYPE_CODES[resource_record.type], 1, 300, len(rdata)
+        ) + rdata
+
+    async def handle(reader, writer):
+        # testzones/ のゾーンを二つずつのレコードのメッセージに分けて返す
+        length, = _length.unpack(await reader.readexactly(2))
+        query = await reader.readexactly(length)
+        query_id, = struct.unpack_from("!H", query)
+        zone, offset = _decode_name(query, _header.size)
+        question = query[_header.size:offset + 4]
+        soa = ResourceRecord(zone, 300, "IN", "SOA", [])
+        resource_records = [soa] + list(ZoneReader(zone).read_file(
+            os.path.join(zone_dir, zones[zone])
+        )) + [soa]
+        for i in range(0, len(resource_records), 2):
+            records = resource_records[i:i + 2]
+            message = _header.pack(query_id, 0x8400, 1, len(records), 0, 0) \
+                + question + b"".join(
+                    encode_record(record, zone) for record in records
+                )
+            writer.write(_length.pack(len(message)) + message)
+        await writer.drain()
+        writer.close()
+
+    async def transfer_zones(concurrency):
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        client = AXFRClient("127.0.0.1", port, concurrency, timeout=5.0)
+        semaphore = asyncio.Semaphore(1)
+        resource_records = []
+        await client._transfer(
+            semaphore, "example.jp.", {"A"}, resource_records.append
+        )
+        ip_network = await asyncio.get_running_loop().run_in_executor(
+            None, client.make_ip_network,
+            ["example.jp."],
+            [("0.168.192.in-addr.arpa.", "192.168.0.0/24")]
+        )
+        server.close()
+        await server.wait_closed()
+        return resource_records, ip_network
+
+    parser = RecordParser()
+    answer = Network("192.168.0.0/24")
+    for record in parser.parse_a_record_file(
+            os.path.join(zone_dir, "example.jp.zone")
+    ):
+        answer.add_record(record)
+    for record in parser.parse_ptr_record_file(
+            os.path.join(zone_dir, "192.168.0.rev"), "192.168.0.0/24"
+    ):
+        answer.add_record(record)
+
+    for concurrency in [1, 2]:
+        resource_records, ip_network = asyncio.run(
+            transfer_zones(concurrency)
+        )
+        assert resource_records[0] == ResourceRecord(
+            "chiya.example.jp.", 300, "IN", "A", ["192.168.0.1"]
+        )
+        assert len(resource_records) == 4
+        network = ip_network["192.168.0.0/24"]
+        assert network.a_record == answer.a_record
+        assert network.ptr_record == answer.ptr_record
+
+    # 接続できなかったゾーンとサーバを示す
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    try:
+        AXFRClient("127.0.0.1", port, timeout=5.0).transfer(
+            [("example.jp.", {"A"}, lambda resource_record: True)]
+        )
+        assert False
+    except AXFRError as error:
+        assert "example.jp. from 127.0.0.1:{}".format(port) in str(error)
+
+    # 圧縮されたドメイン名と SOA の rdata
+    message = _header.pack(1, 0x8400, 0, 1, 0, 0) + encode_name("jp.") + \
+        _rr_header.pack(6, 1, 0, 0)
+    soa_rdata = b"\x02ns\xc0\x0c" + b"\x04root\xc0\x0c" + \
+        struct.pack("!IIIII", 2015, 1, 2, 3, 4)
+    message = message[:-2] + _length.pack(len(soa_rdata)) + soa_rdata
+    assert decode_message(message, 1) == [ResourceRecord(
+        "jp.", 0, "IN", "SOA",
+        ["ns.jp.", "root.jp.", "2015", "1", "2", "3", "4"]
+    )]
+    # 名前のあとの数値が 20 バイトに足りない SOA
+    short_soa_rdata = soa_rdata[:-4]
+    short_soa = message[:-len(soa_rdata) - 2] + \
+        _length.pack(len(short_soa_rdata)) + short_soa_rdata + \
+        encode_name("jp.") + _rr_header.pack(1, 1, 0, 4) + bytes(4)
+    for bad_message in [message[:20], message[:-20], short_soa,
+                        _header.pack(1, 0x8400, 0, 1, 0, 0) + b"\x05jp",
+                        _header.pack(1, 0x8405, 0, 0, 0, 0),
+                        _header.pack(2, 0x8400, 0, 0, 0, 0)]:
+        try:
+            decode_message(bad_message, 1)
+            assert False
+        except AXFRError:
+            pass
@@ -0,0 +1,702 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+
+"""
+This module measures performance of dnschecker.
+
+:copyright: (c) 2015 by the KUSM Admin Team
+:license: MIT, see LICENSE for more details.
+"""
+
+import contextlib
+import io
+import ipaddress
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from parser import (
+    RecordParser, RecordInfoParser, RecordParserError, PTRNetworkContext
+)
+import ipaddr
+from network import Network
+from record import ARecord, PTRRecord, RecordInfo
+
+
+def generate_reverse_zone(
+    filename: str,
+    lines: int,
+    domain: str="example.jp"
+) -> None:
+    """
+    /24 の逆引きゾーンファイルを lines 行生成する
+
+    ホスト部は 1 から 254 をくりかえす
+    """
+    with open(filename, "w") as f:
+        for i in range(lines):
+            f.write("{}\tPTR\thost{}.{}.\n".format(i % 254 + 1, i, domain))
+
+
+def bench_ptr_parse(
+    lines: int,
+    network_address: str="192.168.0.0/24"
+) -> {str: float}:
+    """
+    逆引きゾーンファイルの解析速度 (行/秒) を測る
+
+    "per_line" は行ごとにネットワークアドレスの文字列を渡した場合、
+    "context" は PTRNetworkContext を一度だけ生成した場合、
+    "zone" は iter_ptr_records でゾーンファイルとして解析した場合の速度
+    """
+    parser = RecordParser()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "bench.rev")
+        generate_reverse_zone(filename, lines)
+
+        for name, network in [
+                ("per_line", network_address),
+                ("context", PTRNetworkContext(network_address)),
+        ]:
+            start = time.perf_counter()
+            with open(filename) as f:
+                for record in f:
+                    try:
+                        parser.parse_ptr_record(record, network)
+                    except RecordParserError:
+                        pass
+            results[name] = lines / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with open(filename) as f:
+            for _ in parser.iter_ptr_records(
+                    f, PTRNetworkContext(network_address)
+            ):
+                pass
+        results["zone"] = lines / (time.perf_counter() - start)
+    return results
+
+
+def generate_forward_zone(
+    filename: str,
+    lines: int,
+    network_address: str="10.0.0.0/8"
+) -> None:
+    """
+    network_address のアドレスを先頭から順に使う正引きゾーンファイルを
+    lines 行生成する
+    """
+    context = PTRNetworkContext(network_address)
+    with open(filename, "w") as f:
+        for i in range(lines):
+            f.write("host{}\tA\t{}\n".format(
+                i, context.get_ip_address(i % (context.num_addresses - 2) + 1)
+            ))
+
+
+def bench_parse_memory(
+    lines: int
+) -> {str: int}:
+    """
+    正引きゾーンファイルを解析したときのメモリ使用量の最大値 (バイト) を測る
+
+    "list" は parse_a_record_file でリストを作った場合、
+    "stream" は iter_a_record_file でレコードを一つずつ捨てた場合
+    """
+    parser = RecordParser()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "bench.zone")
+        generate_forward_zone(filename, lines)
+
+        for name, parse in [
+                ("list", parser.parse_a_record_file),
+                ("stream", parser.iter_a_record_file),
+        ]:
+            tracemalloc.start()
+            for _ in parse(filename):
+                pass
+            results[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return results
+
+
+def bench_zone_parse(
+    lines: int
+) -> {str: float}:
+    """
+    正引きゾーンファイルの解析速度 (行/秒) を測る
+
+    "regex" は行ごとに parse_a_record の正規表現で解析した場合、
+    "lexer" は iter_a_records で zonefile.ZoneReader を使って
+    ゾーンファイルとして解析した場合の速度
+    """
+    parser = RecordParser()
+
+    def parse_regex(f):
+        for line in f:
+            try:
+                parser.parse_a_record(line)
+            except RecordParserError:
+                pass
+
+    def parse_lexer(f):
+        for _ in parser.iter_a_records(f):
+            pass
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "bench.zone")
+        generate_forward_zone(filename, lines)
+
+        for name, parse in [
+                ("regex", parse_regex),
+                ("lexer", parse_lexer),
+        ]:
+            start = time.perf_counter()
+            with open(filename) as f:
+                parse(f)
+            results[name] = lines / (time.perf_counter() - start)
+    return results
+
+
+def bench_ipaddr(
+    addresses: int,
+    network_address: str="10.0.0.0/8"
+) -> {str: {str: float}}:
+    """
+    ipaddr のまとめて変換する関数と標準の ipaddress の速度
+    (アドレス/秒) を比べる
+
+    "stdlib" は network.py と同じようにアドレスごとに ipaddress を
+    使った場合、"bulk" は ipaddr の convert_ip_str2int_array などで
+    まとめて処理した場合の速度
+    """
+    stdlib_network = ipaddress.ip_network(network_address)
+    network = ipaddr.ip_network(network_address)
+    int_ip_addresses = [
+        network.int_network_address + i % network.num_addresses
+        for i in range(addresses)
+    ]
+    ip_addresses = ipaddr.convert_ip_int2str_list(int_ip_addresses)
+
+    cases = {
+        "str2int": (
+            lambda: [int(ipaddress.ip_address(ip_address))
+                     for ip_address in ip_addresses],
+            lambda: ipaddr.convert_ip_str2int_array(ip_addresses),
+        ),
+        "int2str": (
+            lambda: [str(ipaddress.IPv4Address(address))
+                     for address in int_ip_addresses],
+            lambda: ipaddr.convert_ip_int2str_list(int_ip_addresses),
+        ),
+        "contains": (
+            lambda: [ipaddress.ip_address(ip_address) in stdlib_network
+                     for ip_address in ip_addresses],
+            lambda: network.contains_int_addresses(int_ip_addresses),
+        ),
+        "hosts": (
+            lambda: [str(host) for host in itertools.islice(
+                stdlib_network.hosts(), addresses
+            )],
+            lambda: list(network.hosts()[:addresses]),
+        ),
+    }
+    results = {}
+    for name, (stdlib, bulk) in cases.items():
+        results[name] = {}
+        for method, function in [("stdlib", stdlib), ("bulk", bulk)]:
+            start = time.perf_counter()
+            function()
+            results[name][method] = addresses / (time.perf_counter() - start)
+    return results
+
+
+def bench_shared_address(
+    aliases: int,
+    addresses: int=4
+) -> {str: float}:
+    """
+    NAT ゲートウェイや VIP のように、ひとつのアドレスを aliases 個の
+    ホスト名が共有するネットワークの iter_rows の速度を測る
+
+    ホスト名ごとにレコード情報があり、さらに aliases // 10 個の
+    ホスト名のないレコード情報がアドレスごとにある
+    """
+    network = Network("10.0.0.0/24")
+    rows = 0
+    for i in range(addresses):
+        ip_address = "10.0.0.{}".format(i + 1)
+        for j in range(aliases):
+            hostname = "vip{}-alias{}".format(i, j)
+            network.add_record(ARecord(hostname, ip_address))
+            network.add_record(PTRRecord(hostname, ip_address))
+            network.add_record_info(
+                RecordInfo(ip_address, hostname, "VIP", None, None)
+            )
+        for j in range(aliases // 10):
+            network.add_record_info(RecordInfo(
+                ip_address, None, None, None, "shared {}".format(j)
+            ))
+        rows += aliases + aliases // 10
+
+    start = time.perf_counter()
+    for _ in network.iter_rows(collapse_unused=True):
+        pass
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "rows_per_sec": rows / seconds}
+
+
+def generate_site(
+    directory: str,
+    hosts: int,
+    duplicate_rate: float=0.01,
+    orphan_rate: float=0.01,
+    mismatch_rate: float=0.01,
+    domain: str="example.jp",
+    seed: int=0
+) -> ([str], [(str, str)], [str]):
+    """
+    hosts 台のホストがある組織のゾーンファイルとレコード情報ファイルを
+    directory に生成する
+
+    ホストには 10.0.0.0/8 の /24 を先頭から順に 254 台ずつ割りあて、
+    /24 ごとに逆引きゾーンファイルとレコード情報ファイルを作る。
+    それぞれの割合のホストは
+
+    duplicate
+        別のホストのアドレスを指す A レコードがもうひとつある
+    orphan
+        A レコードか PTR レコードの片方しかない
+    mismatch
+        PTR レコードのホスト名が A レコードと異なる
+
+    になる。返り値は config と同じ形の
+
+        (A レコードのファイル名のリスト,
+         (PTR レコードのファイル名, ネットワークアドレス) のリスト,
+         レコード情報のファイル名のリスト)
+    """
+    rand = random.Random(seed)
+    subnets = (hosts + 253) // 254
+
+    def get_ip_address(i):
+        subnet, host = divmod(i, 254)
+        return "10.{}.{}.{}".format(subnet >> 8, subnet & 0xff, host + 1)
+
+    a_record_filename = os.path.join(directory, "{}.zone".format(domain))
+    ptr_record_filename_networks = []
+    record_info_filenames = []
+    with contextlib.ExitStack() as stack:
+        a_file = stack.enter_context(open(a_record_filename, "w"))
+        a_file.write("; synthetic zone for benchmark\n")
+        for subnet in range(subnets):
+            network_address = "10.{}.{}.0/24".format(
+                subnet >> 8, subnet & 0xff
+            )
+            prefix = network_address[:-len(".0/24")]
+            ptr_filename = os.path.join(directory, "{}.rev".format(prefix))
+            info_filename = os.path.join(directory, "{}.info".format(prefix))
+            ptr_record_filename_networks.append(
+                (ptr_filename, network_address)
+            )
+            record_info_filenames.append(info_filename)
+
+            with open(ptr_filename, "w") as ptr_file, \
+                    open(info_filename, "w") as info_file:
+                for i in range(subnet * 254, min(hosts, (subnet + 1) * 254)):
+                    hostname = "host{}".format(i)
+                    ip_address = get_ip_address(i)
+                    host = ip_address.rsplit(".", 1)[1]
+                    has_a, has_ptr = True, True
+                    ptr_hostname = hostname
+                    r = rand.random()
+                    if r < duplicate_rate:
+                        a_file.write("{}\tA\t{}\n".format(
+                            hostname, get_ip_address(rand.randrange(hosts))
+                        ))
+                    elif r < duplicate_rate + orphan_rate:
+                        if rand.random() < 0.5:
+                            has_ptr = False
+                        else:
+                            has_a = False
+                    elif r < duplicate_rate + orphan_rate + mismatch_rate:
+                        ptr_hostname = "other{}".format(i)
+
+                    if has_a:
+                        a_file.write("{}\tA\t{}\n".format(
+                            hostname, ip_address
+                        ))
+                    if has_ptr:
+                        ptr_file.write("{}\tPTR\t{}.{}.\n".format(
+                            host, ptr_hostname, domain
+                        ))
+                    info_file.write("{}|{}|PC|{}|\n".format(
+                        ip_address, hostname, 100 + subnet
+                    ))
+    return (
+        [a_record_filename],
+        ptr_record_filename_networks,
+        record_info_filenames
+    )
+
+
+def _get_commit() -> str:
+    """
+    このファイルがある git リポジトリの HEAD のコミットを返す
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _count_records(ip_network) -> int:
+    """
+    ネットワークにある A レコードと PTR レコードの数を返す
+    """
+    return sum(
+        sum(len(records) for records in network.a_record.values()) +
+        sum(len(records) for records in network.ptr_record.values())
+        for network in ip_network.values()
+    )
+
+
+def _run_stages(
+    stages: [(str, object)],
+    trace_memory: bool
+) -> {str: dict}:
+    """
+    stages の関数を順に呼び、段階ごとの時間と処理した数を返す
+
+    各関数は前の段階の返り値を受けとり、(処理した数, 返り値) を返す。
+    trace_memory が True のときはメモリ使用量の最大値も測る
+    """
+    results = {}
+    value = None
+    for name, stage in stages:
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        items, value = stage(value)
+        seconds = time.perf_counter() - start
+        results[name] = {
+            "seconds": seconds,
+            "items": items,
+            "items_per_sec": items / seconds if seconds else None,
+        }
+        if trace_memory:
+            results[name]["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return results
+
+
+def bench_suite(
+    hosts: int,
+    duplicate_rate: float=0.01,
+    orphan_rate: float=0.01,
+    mismatch_rate: float=0.01,
+    seed: int=0,
+    trace_memory: bool=True
+) -> dict:
+    """
+    生成したゾーンファイルに対して
+
+        parse, make_ip_network, checker, iter_rows, html
+
+    の段階ごとの時間、スループット (items/秒) を測る。
+    trace_memory が True のときは、もう一度同じ処理を tracemalloc を
+    有効にして実行し、段階ごとのメモリ使用量の最大値も測る
+    """
+    from checker import Checker
+    from dnschecker import make_ip_network
+    from genhtml import HTMLBuilder
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        zone_dir = os.path.join(tmpdir, "zones")
+        html_dir = os.path.join(tmpdir, "html")
+        os.mkdir(zone_dir)
+        os.mkdir(html_dir)
+        a_record_filenames, ptr_record_filename_networks, \
+            record_info_filenames = generate_site(
+                zone_dir, hosts, duplicate_rate, orphan_rate, mismatch_rate,
+                seed=seed
+            )
+
+        def parse(_):
+            parser = RecordParser()
+            info_parser = RecordInfoParser()
+            records = 0
+            for filename in a_record_filenames:
+                records += len(parser.parse_a_record_file(filename))
+            for filename, network_address in ptr_record_filename_networks:
+                records += len(parser.parse_ptr_record_file(
+                    filename, network_address
+                ))
+            for filename in record_info_filenames:
+                records += len(info_parser.parse_file(filename))
+            return records, None
+
+        def build_network(_):
+            ip_network = make_ip_network(
+                a_record_filenames,
+                ptr_record_filename_networks,
+                record_info_filenames
+            )
+            return _count_records(ip_network), ip_network
+
+        def check(ip_network):
+            for network in ip_network.values():
+                Checker(network).check()
+            return _count_records(ip_network), ip_network
+
+        def iter_rows(ip_network):
+            rows = sum(
+                sum(1 for _ in network) for network in ip_network.values()
+            )
+            return rows, ip_network
+
+        def render(ip_network):
+            # 生成したファイルの一覧は表示しない
+            with contextlib.redirect_stdout(io.StringIO()):
+                HTMLBuilder().render(ip_network, html_dir)
+            return len(ip_network) + 1, None
+
+        stages = [
+            ("parse", parse),
+            ("make_ip_network", build_network),
+            ("checker", check),
+            ("iter_rows", iter_rows),
+            ("html", render),
+        ]
+        results = _run_stages(stages, trace_memory=False)
+        if trace_memory:
+            # manifest があると html を生成しないので消しておく
+            shutil.rmtree(html_dir)
+            os.mkdir(html_dir)
+            for name, stage_result in _run_stages(
+                    stages, trace_memory=True
+            ).items():
+                results[name]["peak_bytes"] = stage_result["peak_bytes"]
+
+    return {
+        "commit": _get_commit(),
+        "python": platform.python_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "parameters": {
+            "hosts": hosts,
+            "duplicate_rate": duplicate_rate,
+            "orphan_rate": orphan_rate,
+            "mismatch_rate": mismatch_rate,
+            "seed": seed,
+        },
+        "stages": results,
+    }
+
+
+def test_generate_site():
+    from checker import Checker
+    from dnschecker import make_ip_network
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        a_record_filenames, ptr_record_filename_networks, \
+            record_info_filenames = generate_site(
+                tmpdir, 300, duplicate_rate=0.1, orphan_rate=0.1,
+                mismatch_rate=0.1
+            )
+        assert [network_address for _, network_address in
+                ptr_record_filename_networks] == ["10.0.0.0/24", "10.0.1.0/24"]
+        ip_network = make_ip_network(
+            a_record_filenames,
+            ptr_record_filename_networks,
+            record_info_filenames
+        )
+        results = [
+            Checker(network).check() for network in ip_network.values()
+        ]
+        for name in ["a_duplicated", "a_not_found", "a_cor_error",
+                     "ptr_not_found", "ptr_cor_error"]:
+            assert any(getattr(result, name) for result in results), name
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    ptr_parse_parser = subparsers.add_parser(
+        "ptr-parse",
+        help="measure PTR record parsing speed"
+    )
+    ptr_parse_parser.add_argument(
+        "-n", "--lines",
+        type=int,
+        default=1000000,
+        help="number of lines of the generated reverse zone"
+    )
+
+    parse_memory_parser = subparsers.add_parser(
+        "parse-memory",
+        help="measure peak memory of A record parsing"
+    )
+    parse_memory_parser.add_argument(
+        "-n", "--lines",
+        type=int,
+        default=1000000,
+        help="number of lines of the generated forward zone"
+    )
+
+    zone_parse_parser = subparsers.add_parser(
+        "zone-parse",
+        help="compare regex-per-line and zone file lexer parsing speed"
+    )
+    zone_parse_parser.add_argument(
+        "-n", "--lines",
+        type=int,
+        default=1000000,
+        help="number of lines of the generated forward zone"
+    )
+
+    ipaddr_parser = subparsers.add_parser(
+        "ipaddr",
+        help="compare bulk ipaddr conversion with the stdlib ipaddress"
+    )
+    ipaddr_parser.add_argument(
+        "-n", "--addresses",
+        type=int,
+        default=1000000,
+        help="number of addresses to convert"
+    )
+
+    shared_address_parser = subparsers.add_parser(
+        "shared-address",
+        help="measure iter_rows on addresses shared by many hostnames"
+    )
+    shared_address_parser.add_argument(
+        "-n", "--aliases",
+        type=int,
+        default=10000,
+        help="number of hostnames sharing each address"
+    )
+
+    suite_parser = subparsers.add_parser(
+        "suite",
+        help="measure each stage on a generated site and write JSON"
+    )
+    suite_parser.add_argument(
+        "-n", "--hosts",
+        type=int,
+        default=100000,
+        help="number of hosts of the generated site"
+    )
+    for name in ["duplicate", "orphan", "mismatch"]:
+        suite_parser.add_argument(
+            "--{}-rate".format(name),
+            type=float,
+            default=0.01,
+            help="ratio of hosts with {} records".format(name)
+        )
+    suite_parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="random seed of the generated site"
+    )
+    suite_parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="do not measure peak memory (runs the stages only once)"
+    )
+    suite_parser.add_argument(
+        "-o", "--output",
+        type=str,
+        default="benchmark.json",
+        help="JSON file to write the results to"
+    )
+
+    generate_parser = subparsers.add_parser(
+        "generate",
+        help="generate zone files and record info files of a site"
+    )
+    generate_parser.add_argument(
+        "directory",
+        type=str,
+        help="directory to write the files to"
+    )
+    generate_parser.add_argument(
+        "-n", "--hosts",
+        type=int,
+        default=100000,
+        help="number of hosts of the generated site"
+    )
+    args = parser.parse_args()
+
+    if args.command == "ptr-parse":
+        for name, lines_per_sec in bench_ptr_parse(args.lines).items():
+            print("{}: {:.0f} lines/sec".format(name, lines_per_sec))
+    elif args.command == "parse-memory":
+        for name, peak in bench_parse_memory(args.lines).items():
+            print("{}: {:.1f} MiB".format(name, peak / (1 << 20)))
+    elif args.command == "zone-parse":
+        for name, lines_per_sec in bench_zone_parse(args.lines).items():
+            print("{}: {:.0f} lines/sec".format(name, lines_per_sec))
+    elif args.command == "ipaddr":
+        for name, rates in bench_ipaddr(args.addresses).items():
+            print("{}: {:.0f} addresses/sec (stdlib {:.0f}, {:.1f}x)".format(
+                name, rates["bulk"], rates["stdlib"],
+                rates["bulk"] / rates["stdlib"]
+            ))
+    elif args.command == "shared-address":
+        result = bench_shared_address(args.aliases)
+        print("{:.3f} sec, {:.0f} rows/sec".format(
+            result["seconds"], result["rows_per_sec"]
+        ))
+    elif args.command == "suite":
+        results = bench_suite(
+            args.hosts,
+            args.duplicate_rate,
+            args.orphan_rate,
+            args.mismatch_rate,
+            seed=args.seed,
+            trace_memory=not args.no_memory
+        )
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        for name, stage in results["stages"].items():
+            print("{}: {:.3f} sec, {:.0f} items/sec{}".format(
+                name,
+                stage["seconds"],
+                stage["items_per_sec"] or 0,
+                ", {:.1f} MiB".format(stage["peak_bytes"] / (1 << 20))
+                if "peak_bytes" in stage else ""
+            ))
+    elif args.command == "generate":
+        os.makedirs(args.directory, exist_ok=True)
+        a_record_filenames, ptr_record_filename_networks, \
+            record_info_filenames = generate_site(args.directory, args.hosts)
+        print("a_record_filenames = {!r}".format(
+            [os.path.basename(filename) for filename in a_record_filenames]
+        ))
+        print("ptr_record_filename_networks = {!r}".format(
+            [(os.path.basename(filename), network_address)
+             for filename, network_address in ptr_record_filename_networks]
+        ))
+        print("record_info_filenames = {!r}".format(
+            [os.path.basename(filename) for filename in record_info_filenames]
+        ))
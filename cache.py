@@ -0,0 +1,330 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+
+"""
+This module caches parsed records of zone files.
+
+:copyright: (c) 2015 by the KUSM Admin Team
+:license: MIT, see LICENSE for more details.
+"""
+
+import hashlib
+import json
+import marshal
+import os
+import sqlite3
+import zlib
+from record import ARecord, PTRRecord, RecordInfo
+from zonefile import find_includes
+
+
+# 解析結果の形式やパーサの動作が変わったときに増やす
+# 値が異なるキャッシュは捨てられる
+CACHE_VERSION = 5
+
+# レコードの種類ごとの (クラス, タプルに変換する関数)
+RECORD_TYPES = {
+    "A": (
+        ARecord,
+        lambda record: (record.hostname, record.ip_address, record.used)
+    ),
+    "PTR": (
+        PTRRecord,
+        lambda record: (record.hostname, record.ip_address, record.used)
+    ),
+    "INFO": (
+        RecordInfo,
+        lambda record_info: (
+            record_info.ip_address,
+            record_info.hostname,
+            record_info.classname,
+            record_info.room,
+            record_info.comment
+        )
+    ),
+}
+
+
+def get_file_digest(filename: str) -> str:
+    """
+    ファイルの内容の SHA-1 を返す
+    """
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """
+    ファイルごとの解析結果を SQLite のファイルに保存しておくクラス
+
+    キャッシュはファイルのパスとレコードの種類 (と PTR レコードなら
+    ネットワークアドレス) ごとに持ち、ファイルのサイズと更新時刻が
+    保存したときと同じならそのまま使う。更新時刻だけが変わった
+    場合は内容の SHA-1 を比べ、同じならやはりそのまま使う。
+    $INCLUDE しているファイルはサイズと更新時刻が変わっていれば
+    キャッシュを使わない
+
+    >>> cache = ParseCache(".cache")
+    >>> cache.parse_files(
+    ...     "A",
+    ...     ["zones/example.com.zone"],
+    ...     lambda filenames: (parser.iter_a_record_file(filename)
+    ...                        for filename in filenames)
+    ... )
+    [[<record.ARecord object at ...>, ...]]
+    """
+    def __init__(self, cache_dir: str):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.connection = sqlite3.connect(
+            os.path.join(cache_dir, "parse_cache.sqlite3")
+        )
+        if self.connection.execute(
+                "PRAGMA user_version"
+        ).fetchone()[0] != CACHE_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS parsed_file")
+            self.connection.execute(
+                "PRAGMA user_version = {:d}".format(CACHE_VERSION)
+            )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS parsed_file ("
+            "  path TEXT NOT NULL,"
+            "  kind TEXT NOT NULL,"
+            "  network_address TEXT NOT NULL,"
+            "  size INTEGER NOT NULL,"
+            "  mtime_ns INTEGER NOT NULL,"
+            "  digest TEXT NOT NULL,"
+            "  includes TEXT NOT NULL,"
+            "  records BLOB NOT NULL,"
+            "  PRIMARY KEY (path, kind, network_address)"
+            ")"
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.connection.close()
+
+    def _get_key(
+        self,
+        kind: str,
+        source
+    ) -> (str, str, str):
+        """
+        source はファイル名か、PTR レコードの場合は
+        (ファイル名, ネットワークアドレス) の組
+        """
+        if isinstance(source, str):
+            return os.path.abspath(source), kind, ""
+        filename, network_address = source
+        return os.path.abspath(filename), kind, network_address
+
+    def load(
+        self,
+        kind: str,
+        source
+    ) -> list:
+        """
+        source の解析結果をキャッシュから読む。なければ None を返す
+        """
+        key = self._get_key(kind, source)
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, digest, includes, records "
+            "FROM parsed_file "
+            "WHERE path = ? AND kind = ? AND network_address = ?",
+            key
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        size, mtime_ns, digest, includes, records = row
+
+        # $INCLUDE するファイルが増えるときは $INCLUDE を書いたファイルも
+        # 変わるので、保存したときのファイルだけを調べればよい
+        includes = json.loads(includes)
+        if includes != self._get_include_stats(
+                [include for include, _, _ in includes]
+        ):
+            self.misses += 1
+            return None
+
+        stat = os.stat(key[0])
+        if stat.st_size != size:
+            self.misses += 1
+            return None
+        if stat.st_mtime_ns != mtime_ns:
+            if get_file_digest(key[0]) != digest:
+                self.misses += 1
+                return None
+            # 内容が同じなら更新時刻だけを更新する
+            self.connection.execute(
+                "UPDATE parsed_file SET mtime_ns = ? "
+                "WHERE path = ? AND kind = ? AND network_address = ?",
+                (stat.st_mtime_ns,) + key
+            )
+
+        self.hits += 1
+        record_class, _ = RECORD_TYPES[kind]
+        return [
+            record_class(*values)
+            for values in marshal.loads(zlib.decompress(records))
+        ]
+
+    def _get_include_stats(self, includes: [str]) -> [[str, int, int]]:
+        """
+        includes のファイルの [パス, サイズ, 更新時刻] のリストを返す
+        """
+        stats = []
+        for include in includes:
+            try:
+                stat = os.stat(include)
+                stats.append([include, stat.st_size, stat.st_mtime_ns])
+            except OSError:
+                stats.append([include, None, None])
+        return stats
+
+    def store(
+        self,
+        kind: str,
+        source,
+        records: list,
+        stat: os.stat_result,
+        digest: str,
+        include_stats: [[str, int, int]]
+    ) -> None:
+        """
+        source の解析結果をキャッシュに保存する
+
+        stat, digest, include_stats には解析する前のファイルの
+        os.stat の結果、内容の SHA-1、$INCLUDE しているファイルの
+        _get_include_stats の結果を渡す。解析している間にファイルが
+        書きかえられても、古い内容の解析結果が新しい内容のものとして
+        保存されることはない
+        """
+        key = self._get_key(kind, source)
+        _, to_values = RECORD_TYPES[kind]
+        self.connection.execute(
+            "INSERT OR REPLACE INTO parsed_file "
+            "(path, kind, network_address, size, mtime_ns, digest, "
+            "includes, records) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            key + (
+                stat.st_size,
+                stat.st_mtime_ns,
+                digest,
+                json.dumps(include_stats),
+                zlib.compress(marshal.dumps(
+                    [to_values(record) for record in records]
+                ))
+            )
+        )
+
+    def parse_files(
+        self,
+        kind: str,
+        sources: list,
+        parse
+    ) -> [list]:
+        """
+        sources のうちキャッシュにないものだけを parse(sources) で解析し、
+        ソースごとのレコードのリストを sources の順に返す
+
+        parse はソースのリストを受けとり、ソースごとのレコードの
+        イテレータを順に返す関数
+        """
+        results = [self.load(kind, source) for source in sources]
+        missing = [i for i, records in enumerate(results) if records is None]
+        if missing:
+            # ファイルの状態は全て解析する前にとる
+            states = []
+            for i in missing:
+                path = self._get_key(kind, sources[i])[0]
+                states.append((
+                    os.stat(path),
+                    get_file_digest(path),
+                    self._get_include_stats(find_includes(path))
+                ))
+            for i, (stat, digest, include_stats), records in zip(
+                    missing, states, parse([sources[i] for i in missing])
+            ):
+                results[i] = list(records)
+                self.store(
+                    kind, sources[i], results[i], stat, digest, include_stats
+                )
+        self.connection.commit()
+        return results
+
+
+def test_parse_cache():
+    import tempfile
+    from parser import RecordParser
+
+    parser = RecordParser()
+
+    def parse(filenames):
+        return (parser.iter_a_record_file(filename) for filename in filenames)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "example.jp.zone")
+        with open(filename, "w") as f:
+            f.write("host1 A 192.168.0.1\nhost2 A 192.168.0.2\n")
+        answer = [parser.parse_a_record_file(filename)]
+
+        cache = ParseCache(os.path.join(tmpdir, "cache"))
+        assert cache.parse_files("A", [filename], parse) == answer
+        assert (cache.hits, cache.misses) == (0, 1)
+        assert cache.parse_files("A", [filename], parse) == answer
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # 更新時刻だけが変わった場合
+        os.utime(filename, ns=(0, 0))
+        assert cache.parse_files("A", [filename], parse) == answer
+        assert (cache.hits, cache.misses) == (2, 1)
+
+        # 内容が変わった場合
+        with open(filename, "a") as f:
+            f.write("host3 A 192.168.0.3\n")
+        answer = [parser.parse_a_record_file(filename)]
+        assert cache.parse_files("A", [filename], parse) == answer
+        assert (cache.hits, cache.misses) == (2, 2)
+
+        # $INCLUDE しているファイルが変わった場合
+        include_filename = os.path.join(tmpdir, "include.zone")
+        with open(include_filename, "w") as f:
+            f.write("host4 A 192.168.0.4\n")
+        with open(filename, "a") as f:
+            f.write("$INCLUDE include.zone\n")
+        answer = [parser.parse_a_record_file(filename)]
+        assert cache.parse_files("A", [filename], parse) == answer
+        assert cache.parse_files("A", [filename], parse) == answer
+        assert (cache.hits, cache.misses) == (3, 3)
+        with open(include_filename, "a") as f:
+            f.write("host5 A 192.168.0.5\n")
+        answer = [parser.parse_a_record_file(filename)]
+        assert len(answer[0]) == 5
+        assert cache.parse_files("A", [filename], parse) == answer
+        assert (cache.hits, cache.misses) == (3, 4)
+
+        # 解析している間にサイズを変えずに書きかえられたら、
+        # 次は解析しなおす
+        def editing_parse(filenames):
+            records = [parser.parse_a_record_file(filenames[0])]
+            with open(filenames[0]) as f:
+                content = f.read()
+            with open(filenames[0], "w") as f:
+                f.write(content.replace("host1 ", "hostX "))
+            os.utime(filenames[0], ns=(1, 1))
+            return records
+        with open(filename, "a") as f:
+            f.write("host6 A 192.168.0.6\n")
+        os.utime(filename, ns=(0, 0))
+        cache.parse_files("A", [filename], editing_parse)
+        answer = [parser.parse_a_record_file(filename)]
+        assert answer[0][0].hostname == "hostX"
+        assert cache.parse_files("A", [filename], parse) == answer
+        assert (cache.hits, cache.misses) == (3, 6)
+        cache.close()
@@ -10,10 +10,168 @@ This module checks record consistency of a Network instance.
 """
 
 
-from network import Network
+import os
+import pickle
+import sqlite3
+from logging import getLogger
+from network import Network, NetworkRouter
+import instrument
+from parser import RecordParser
 from record import DNSRecord, ARecord, PTRRecord
 
 
+logger = getLogger(__name__)
+
+
+class CheckResult:
+    """
+    Checker.check の結果
+
+    a_duplicated
+        重複する A レコードの辞書で
+            {"host1": {record1, record2}}
+        のようにホスト名をキー、レコードの集合を値とする
+    a_not_found
+        対応する PTR レコードが見つからない A レコードのリスト
+    a_cor_error
+        正引き逆引きしたときに一致しない A レコードの辞書で
+            {record1: {ptr_record1, ptr_record2}}
+        のように A レコードをキー、対応する PTR レコードの集合を値とする
+
+    ptr_duplicated, ptr_not_found, ptr_cor_error は PTR レコードについて
+    同様に逆引き正引きした結果で、ptr_duplicated のキーは IP アドレス
+    """
+    def __init__(self):
+        self.a_duplicated = {}
+        self.a_not_found = []
+        self.a_cor_error = {}
+        self.ptr_duplicated = {}
+        self.ptr_not_found = []
+        self.ptr_cor_error = {}
+
+    @property
+    def a2ptr(self) -> (dict, list, dict):
+        return self.a_duplicated, self.a_not_found, self.a_cor_error
+
+    @property
+    def ptr2a(self) -> (dict, list, dict):
+        return self.ptr_duplicated, self.ptr_not_found, self.ptr_cor_error
+
+    def merge(
+        self,
+        other,
+        hostnames: {str},
+        ip_addresses: {str}
+    ):
+        """
+        この結果から hostnames の A レコードと ip_addresses の PTR レコードに
+        関する結果を除き、それらだけをチェックしなおした other を加えた
+        CheckResult を返す
+        """
+        result = CheckResult()
+        for attr, keys, key_attr in [
+                ("a", hostnames, "hostname"),
+                ("ptr", ip_addresses, "ip_address")
+        ]:
+            duplicated = {
+                key: records
+                for key, records in getattr(self, attr + "_duplicated").items()
+                if key not in keys
+            }
+            duplicated.update(getattr(other, attr + "_duplicated"))
+            not_found = [
+                record for record in getattr(self, attr + "_not_found")
+                if getattr(record, key_attr) not in keys
+            ]
+            not_found.extend(getattr(other, attr + "_not_found"))
+            cor_error = {
+                record: cor_records
+                for record, cor_records
+                in getattr(self, attr + "_cor_error").items()
+                if getattr(record, key_attr) not in keys
+            }
+            cor_error.update(getattr(other, attr + "_cor_error"))
+            setattr(result, attr + "_duplicated", duplicated)
+            setattr(result, attr + "_not_found", not_found)
+            setattr(result, attr + "_cor_error", cor_error)
+        return result
+
+
+def _check_records(
+    a_record: {str: {ARecord}},
+    ptr_record: {str: {PTRRecord}},
+    hostnames: {str},
+    ip_addresses: {str},
+    result: CheckResult
+) -> CheckResult:
+    """
+    ホスト名をキーとする A レコードの辞書と IP アドレスをキーとする
+    PTR レコードの辞書をチェックし、結果を result に追加して返す
+
+    hostnames, ip_addresses は Checker.check と同じ
+    """
+    # 結果が前と同じ順になるように、A レコードはホスト名の、PTR レコードは
+    # IP アドレスの辞書の順 (ゾーンファイルに書かれた順) に調べる。
+    # A レコードと同じアドレスにある同じホスト名の PTR レコードは、
+    # 正引きした結果も A レコードを調べたときに決まるので、
+    # PTR レコードをキー、対応の誤りなら A レコードの集合、
+    # 正しければ None を値として覚えておき、PTR レコードを調べるときに使う
+    ptr_verdict = {}
+    if hostnames is None:
+        a_items = a_record.items()
+    else:
+        a_items = (
+            (hostname, a_record[hostname]) for hostname in hostnames
+            if hostname in a_record
+        )
+    for hostname, records in a_items:
+        # A レコードが重複定義されているか、対応する PTR レコードが
+        # 存在し、逆引きするとホスト名が一致するかチェックする
+        if len(records) >= 2:
+            result.a_duplicated[hostname] = records
+        verdict = records if len(records) != 1 else None
+        for record in records:
+            ptr_records = ptr_record.get(record.ip_address)
+            if not ptr_records:
+                result.a_not_found.append(record)
+                continue
+            cor_error = len(ptr_records) != 1
+            for ptr in ptr_records:
+                if ptr.hostname == hostname:
+                    ptr_verdict[ptr] = verdict
+                else:
+                    cor_error = True
+            if cor_error:
+                result.a_cor_error[record] = ptr_records
+
+    if ip_addresses is None:
+        ptr_items = ptr_record.items()
+    else:
+        ptr_items = (
+            (ip_address, ptr_record[ip_address])
+            for ip_address in ip_addresses if ip_address in ptr_record
+        )
+    for ip_address, records in ptr_items:
+        # PTR レコードが重複定義されているか、対応する A レコードが
+        # 存在し、正引きすると IP アドレスが一致するかチェックする
+        if len(records) >= 2:
+            result.ptr_duplicated[ip_address] = records
+        for record in records:
+            if record in ptr_verdict:
+                a_records = ptr_verdict[record]
+                if a_records is not None:
+                    result.ptr_cor_error[record] = a_records
+                continue
+            a_records = a_record.get(record.hostname)
+            if not a_records:
+                result.ptr_not_found.append(record)
+            elif len(a_records) != 1 or \
+                    not all(a.ip_address == record.ip_address
+                            for a in a_records):
+                result.ptr_cor_error[record] = a_records
+    return result
+
+
 class Checker:
     """
     Network のレコードの整合性をチェックするクラス
@@ -21,89 +179,64 @@ class Checker:
     def __init__(self, network: Network):
         self.network = network
 
-    def _check_records(
+    def check(
         self,
-        source_attr: str,
-        target_attr: str,
-        source_record: {str: [DNSRecord]},
-        target_record: {str: [DNSRecord]}
-    ):
-        # 重複するレコードの辞書
-        #    {"host1": {host1, host2}}
-        duplicated_record = {}
-        # 対応するレコード (A ならば PTR) が見つからないレコードのリスト
-        not_found_records = []
-        # 正引き逆引き、もしくは逆引き正引きしたときに
-        # 一致しないレコードの辞書
-        #    {host1: {host1, host2},
-        #     host2: {host1, host2}}
-        # のようにレコードをキー, レコードの集合を値とする
-        cor_error_records = {}
-
-        for key, records in source_record.items():
-            # 重複定義されているかチェックする
-            if len(records) >= 2:
-                duplicated_record[key] = records
-
-            for record in records:
-                target_key = getattr(record, target_attr)
-
-                # 対応するレコード (A ならば PTR, PTR ならば A)
-                # が存在するかチェックする
-                if target_key not in target_record:
-                    not_found_records.append(record)
-                else:
-                    cor_records = target_record[target_key]
-                    if len(cor_records) != 1 or \
-                            not all(
-                                getattr(cor_record, source_attr) ==
-                                getattr(record, source_attr)
-                                for cor_record in cor_records
-                            ):
+        hostnames: {str}=None,
+        ip_addresses: {str}=None
+    ) -> CheckResult:
+        """
+        正引きのあと逆引き、逆引きのあと正引きをしてレコードをチェックし、
+        重複するレコードとあわせて CheckResult として返す
 
-                        cor_error_records[record] = cor_records
-        return duplicated_record, not_found_records, cor_error_records
+        A レコードと PTR レコードをゾーンファイルに書かれた順に調べ、
+        同じアドレスで対応した組の結果は両方向で一度だけ求める。
+        hostnames を指定するとそのホスト名の A レコードだけを、
+        ip_addresses を指定するとその IP アドレスの PTR レコードだけを
+        チェックする
+        """
+        with instrument.stage("check"):
+            return self._check(hostnames, ip_addresses)
+
+    def _check(
+        self,
+        hostnames: {str},
+        ip_addresses: {str}
+    ) -> CheckResult:
+        a_record = self.network.a_record
+        ptr_record = self.network.ptr_record
+        if not isinstance(a_record, dict):
+            # CompactNetwork などは読むたびにレコードを生成するので
+            # 一度だけ辞書にする
+            a_record = dict(a_record.items())
+            ptr_record = dict(ptr_record.items())
+        return _check_records(
+            a_record, ptr_record, hostnames, ip_addresses, CheckResult()
+        )
 
     def check_a2ptr(self):
         """
         正引きのあと逆引きをしてレコードをチェックする
         """
-        return self._check_records(
-            "hostname",
-            "ip_address",
-            self.network.a_record,
-            self.network.ptr_record,
-        )
+        return self.check(ip_addresses=set()).a2ptr
 
     def check_ptr2a(self):
         """
         逆引きのあと正引きしてレコードをチェックする
         """
-        return self._check_records(
-            "ip_address",
-            "hostname",
-            self.network.ptr_record,
-            self.network.a_record,
-        )
+        return self.check(hostnames=set()).ptr2a
 
     def _show_result(
         self,
         source_attr: str,
         target_attr: str,
-        source_record: {"key": [DNSRecord]},
-        target_record: {"key": [DNSRecord]},
         source_name: str,
-        target_name: str
+        target_name: str,
+        result: (dict, list, dict)
     ):
         """
-        self._check_records の結果を表示する
+        CheckResult.a2ptr, CheckResult.ptr2a を表示する
         """
-        duplicated, not_found, cor_error = self._check_records(
-            source_attr,
-            target_attr,
-            source_record,
-            target_record
-        )
+        duplicated, not_found, cor_error = result
         for key, records in duplicated.items():
             print("duplicated definition:\n\t{} -> {}".format(
                 key,
@@ -124,26 +257,443 @@ class Checker:
                 ", ".join(getattr(_, source_attr) for _ in cor_records)
             ))
 
-    def show_a2ptr_checker_result(self):
+    def show_a2ptr_checker_result(self, result: CheckResult=None):
+        if result is None:
+            result = self.check(ip_addresses=set())
         self._show_result(
             "hostname",
             "ip_address",
-            self.network.a_record,
-            self.network.ptr_record,
             "A",
-            "PTR"
+            "PTR",
+            result.a2ptr
         )
 
-    def show_ptr2a_checker_result(self):
+    def show_ptr2a_checker_result(self, result: CheckResult=None):
+        if result is None:
+            result = self.check(hostnames=set())
         self._show_result(
             "ip_address",
             "hostname",
-            self.network.ptr_record,
-            self.network.a_record,
             "PTR",
             "A",
+            result.ptr2a
         )
 
+    def show_checker_result(self, result: CheckResult=None):
+        """
+        self.check の結果を表示する
+
+        result を指定したときはチェックせずにその結果を表示する
+        """
+        if result is None:
+            result = self.check()
+        self.show_a2ptr_checker_result(result)
+        self.show_ptr2a_checker_result(result)
+
+
+def recheck(
+    network: Network,
+    result: CheckResult,
+    hostnames: {str},
+    ip_addresses: {str}
+) -> CheckResult:
+    """
+    前回の結果 result のうち、増減した A レコードのホスト名 hostnames と
+    PTR レコードの IP アドレス ip_addresses に関係するところだけを
+    チェックしなおした結果を返す
+
+    A レコードのホスト名か、その IP アドレスの PTR レコードが
+    変わったホスト名をチェックしなおす (PTR レコードも同様)
+    """
+    a2ptr_keys = set(hostnames)
+    a2ptr_keys.update(
+        hostname
+        for hostname, records in network.a_record.items()
+        if any(record.ip_address in ip_addresses for record in records)
+    )
+    ptr2a_keys = set(ip_addresses)
+    ptr2a_keys.update(
+        ip_address
+        for ip_address, records in network.ptr_record.items()
+        if any(record.hostname in hostnames for record in records)
+    )
+    logger.debug(
+        "checking {} hostnames and {} IP addresses of {}".format(
+            len(a2ptr_keys), len(ptr2a_keys), network.network_address
+        )
+    )
+    return result.merge(
+        Checker(network).check(a2ptr_keys, ptr2a_keys),
+        a2ptr_keys,
+        ptr2a_keys
+    )
+
+
+class GlobalCheckResult(CheckResult):
+    """
+    GlobalChecker.check の結果
+
+    CheckResult と同じ属性に加えて、レコードをキー、そのレコードを持つ
+    ネットワークアドレスのリストを値とする辞書 networks を持つ
+    """
+    def __init__(self):
+        super().__init__()
+        self.networks = {}
+
+    def is_cross_network(self, records: [DNSRecord]) -> bool:
+        """
+        records の全てを持つネットワークがない、つまりネットワークごとに
+        チェックしたのでは見つからない組み合わせかを返す
+        """
+        common = None
+        for record in records:
+            networks = self.networks.get(record, [])
+            if common is None:
+                common = set(networks)
+            else:
+                common.intersection_update(networks)
+            if not common:
+                return True
+        return False
+
+    def cross_network(self) -> CheckResult:
+        """
+        重複と対応の誤りのうち、複数のネットワークにまたがるものだけの
+        CheckResult を返す
+
+        対応するレコードが見つからないものはどのネットワークでも
+        見つからないので含めない
+        """
+        result = CheckResult()
+        for attr in ["a", "ptr"]:
+            setattr(result, attr + "_duplicated", {
+                key: records
+                for key, records in getattr(self, attr + "_duplicated").items()
+                if self.is_cross_network(records)
+            })
+            setattr(result, attr + "_cor_error", {
+                record: cor_records
+                for record, cor_records
+                in getattr(self, attr + "_cor_error").items()
+                if self.is_cross_network([record] + list(cor_records))
+            })
+        return result
+
+
+class GlobalChecker:
+    """
+    全てのネットワークのレコードをまとめてチェックするクラス
+
+    全てのネットワークの A レコードをホスト名で、PTR レコードを
+    IP アドレスで引く索引を一つずつ作り、Checker と同じ方法で一度に
+    チェックする。あるネットワークの PTR レコードが別のネットワークの
+    A レコードを指している場合や、同じホスト名が複数のネットワークで
+    定義されている場合も見つかる
+
+    >>> checker = GlobalChecker(ip_network)
+    >>> checker.show_checker_result()
+    """
+    def __init__(self, ip_network: {str: Network}):
+        self.ip_network = ip_network
+
+    def check(self) -> GlobalCheckResult:
+        """
+        全てのネットワークのレコードをチェックして GlobalCheckResult を返す
+        """
+        with instrument.stage("global check"):
+            result = GlobalCheckResult()
+            a_record = {}
+            ptr_record = {}
+            for network_address, network in self.ip_network.items():
+                for records_by_key, index in [
+                        (network.a_record, a_record),
+                        (network.ptr_record, ptr_record)
+                ]:
+                    for key, records in records_by_key.items():
+                        if key in index:
+                            index[key].update(records)
+                        else:
+                            index[key] = set(records)
+                        for record in records:
+                            if record in result.networks:
+                                result.networks[record].append(
+                                    network_address
+                                )
+                            else:
+                                result.networks[record] = [network_address]
+            return _check_records(a_record, ptr_record, None, None, result)
+
+    def _format_records(
+        self,
+        result: GlobalCheckResult,
+        records: [DNSRecord],
+        attr: str
+    ) -> str:
+        """
+        records を "値 (ネットワークアドレス)" をカンマで区切った文字列にする
+        """
+        return ", ".join(
+            "{} ({})".format(
+                getattr(record, attr),
+                ", ".join(result.networks.get(record, []))
+            )
+            for record in sorted(records, key=lambda _: getattr(_, attr))
+        )
+
+    def show_checker_result(self, result: GlobalCheckResult=None):
+        """
+        複数のネットワークにまたがる重複と対応の誤りを、
+        それぞれのレコードがあるネットワークとともに表示する
+        """
+        if result is None:
+            result = self.check()
+        cross_network = result.cross_network()
+        for duplicated, target_attr in [
+                (cross_network.a_duplicated, "ip_address"),
+                (cross_network.ptr_duplicated, "hostname")
+        ]:
+            for key, records in duplicated.items():
+                print("duplicated definition across networks:\n\t{} -> {}"
+                      .format(key, self._format_records(
+                          result, records, target_attr
+                      )))
+        for cor_error, source_attr, target_attr in [
+                (cross_network.a_cor_error, "hostname", "ip_address"),
+                (cross_network.ptr_cor_error, "ip_address", "hostname")
+        ]:
+            for record, cor_records in cor_error.items():
+                print("correspondence error across networks\n\t{} -> {}"
+                      " -> {}".format(
+                          getattr(record, source_attr),
+                          self._format_records(result, [record], target_attr),
+                          self._format_records(
+                              result, cor_records, source_attr
+                          )
+                      ))
+
+
+class IncrementalChecker:
+    """
+    前回のチェック結果とファイルごとのレコードを SQLite のファイルに
+    保存しておき、変更されたレコードに関係するところだけをチェックしなおす
+    クラス
+
+    ホスト名 h の A レコードのチェック結果は h の A レコードと、
+    その IP アドレスの PTR レコードだけで決まる (PTR レコードも同様) ので、
+    前回から増減した A レコードのホスト名と PTR レコードの IP アドレスから
+    チェックしなおすべきネットワークとキーを求める。
+    サイズと更新時刻が前回と同じファイルは読まない
+
+    >>> checker = IncrementalChecker(".cache/check_state.sqlite3")
+    >>> results = checker.check_all(
+    ...     network,
+    ...     a_record_filenames,
+    ...     ptr_record_filename_networks
+    ... )
+    >>> checker.save()
+    """
+    # 保存する形式やチェックの方法が変わったときに増やす
+    STATE_VERSION = 5
+
+    def __init__(
+        self,
+        state_filename: str,
+        parse_cache=None
+    ):
+        """
+        parse_cache に ParseCache を渡すと、変更されたファイルの
+        レコードをキャッシュから読む
+        """
+        directory = os.path.dirname(os.path.abspath(state_filename))
+        os.makedirs(directory, exist_ok=True)
+        self.parse_cache = parse_cache
+        self.connection = sqlite3.connect(state_filename)
+        if self.connection.execute(
+                "PRAGMA user_version"
+        ).fetchone()[0] != self.STATE_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS file_records")
+            self.connection.execute("DROP TABLE IF EXISTS check_result")
+            self.connection.execute(
+                "PRAGMA user_version = {:d}".format(self.STATE_VERSION)
+            )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS file_records ("
+            "  path TEXT NOT NULL,"
+            "  kind TEXT NOT NULL,"
+            "  network_address TEXT NOT NULL,"
+            "  size INTEGER NOT NULL,"
+            "  mtime_ns INTEGER NOT NULL,"
+            "  records BLOB NOT NULL,"
+            "  PRIMARY KEY (path, kind, network_address)"
+            ")"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS check_result ("
+            "  network_address TEXT PRIMARY KEY,"
+            "  result BLOB NOT NULL"
+            ")"
+        )
+        self.connection.commit()
+
+    def _parse(self, kind: str, source) -> set:
+        parser = RecordParser()
+        if kind == "A":
+            parse = parser.iter_a_record_files
+        else:
+            parse = parser.iter_ptr_record_files
+        if self.parse_cache is not None:
+            records = self.parse_cache.parse_files(kind, [source], parse)[0]
+        else:
+            records = next(iter(parse([source])))
+        return set(records)
+
+    def _get_changed_records(
+        self,
+        kind: str,
+        sources: list
+    ) -> {DNSRecord}:
+        """
+        前回から増えたか減ったレコードの集合を返し、
+        ファイルごとのレコードを更新する
+
+        sources はファイル名か (ファイル名, ネットワークアドレス) のリスト
+        """
+        changed_records = set()
+        keys = set()
+        for source in sources:
+            if isinstance(source, str):
+                filename, network_address = source, ""
+            else:
+                filename, network_address = source
+            key = (os.path.abspath(filename), kind, network_address)
+            keys.add(key)
+            stat = os.stat(key[0])
+            row = self.connection.execute(
+                "SELECT size, mtime_ns, records FROM file_records "
+                "WHERE path = ? AND kind = ? AND network_address = ?",
+                key
+            ).fetchone()
+            if row is not None and \
+                    row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                continue
+
+            records = self._parse(kind, source)
+            if row is not None:
+                changed_records.update(
+                    records.symmetric_difference(pickle.loads(row[2]))
+                )
+            else:
+                changed_records.update(records)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO file_records "
+                "(path, kind, network_address, size, mtime_ns, records) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                key + (stat.st_size, stat.st_mtime_ns,
+                       pickle.dumps(records, pickle.HIGHEST_PROTOCOL))
+            )
+
+        # 前回はあったが今回はないファイルのレコードは全て減ったとみなす
+        for path, network_address, records in self.connection.execute(
+                "SELECT path, network_address, records FROM file_records "
+                "WHERE kind = ?",
+                (kind,)
+        ).fetchall():
+            if (path, kind, network_address) not in keys:
+                changed_records.update(pickle.loads(records))
+                self.connection.execute(
+                    "DELETE FROM file_records "
+                    "WHERE path = ? AND kind = ? AND network_address = ?",
+                    (path, kind, network_address)
+                )
+        return changed_records
+
+    def check_all(
+        self,
+        ip_network: {str: Network},
+        a_record_filenames: [str],
+        ptr_record_filename_networks: [(str, str)]
+    ) -> {str: CheckResult}:
+        """
+        全てのネットワークをチェックして、ネットワークアドレスをキー、
+        CheckResult を値とする辞書を返す
+
+        ip_network は a_record_filenames, ptr_record_filename_networks から
+        make_ip_network で作ったもの
+        """
+        changed_a_records = self._get_changed_records(
+            "A", a_record_filenames
+        )
+        changed_ptr_records = self._get_changed_records(
+            "PTR", ptr_record_filename_networks
+        )
+
+        # ネットワークごとに、増減したレコードのホスト名と IP アドレスを集める
+        router = NetworkRouter(ip_network.values())
+        changed_hostnames = {}
+        changed_ip_addresses = {}
+        for record in changed_a_records:
+            for network in router.lookup(record.ip_address):
+                changed_hostnames.setdefault(
+                    network, set()
+                ).add(record.hostname)
+        for record in changed_ptr_records:
+            for network in router.lookup(record.ip_address):
+                changed_ip_addresses.setdefault(
+                    network, set()
+                ).add(record.ip_address)
+
+        results = {}
+        for network_address, network in ip_network.items():
+            row = self.connection.execute(
+                "SELECT result FROM check_result WHERE network_address = ?",
+                (network_address,)
+            ).fetchone()
+            hostnames = changed_hostnames.get(network, set())
+            ip_addresses = changed_ip_addresses.get(network, set())
+            if row is not None and not hostnames and not ip_addresses:
+                results[network_address] = pickle.loads(row[0])
+                continue
+
+            if row is None:
+                logger.debug(
+                    "checking all records of {}".format(network_address)
+                )
+                result = Checker(network).check()
+            else:
+                result = recheck(
+                    network,
+                    pickle.loads(row[0]),
+                    hostnames,
+                    ip_addresses
+                )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO check_result "
+                "(network_address, result) VALUES (?, ?)",
+                (network_address,
+                 pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+            )
+            results[network_address] = result
+
+        # 今回はないネットワークの結果を消す
+        for network_address, in self.connection.execute(
+                "SELECT network_address FROM check_result"
+        ).fetchall():
+            if network_address not in ip_network:
+                self.connection.execute(
+                    "DELETE FROM check_result WHERE network_address = ?",
+                    (network_address,)
+                )
+        return results
+
+    def save(self):
+        """
+        今回のファイルごとのレコードとチェック結果を保存する
+        """
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
 
 def test_network():
     # テストレコード
@@ -190,4 +740,133 @@ def test_network():
     checker = Checker(nt)
     assert checker.check_a2ptr() == a2ptr_answer
     assert checker.check_ptr2a() == ptr2a_answer
+    result = checker.check()
+    assert result.a2ptr == a2ptr_answer
+    assert result.ptr2a == ptr2a_answer
     return list(nt)
+
+
+def test_incremental_checker():
+    import tempfile
+
+    a_zone = [
+        "chiya A 192.168.0.1",
+        "syaro A 192.168.0.3",
+        "syaro A 192.168.0.4",
+        "rize A 192.168.0.4",
+    ]
+    ptr_zone = [
+        "2 PTR chino",
+        "3 PTR syaro",
+        "4 PTR syaro",
+        "4 PTR rize",
+    ]
+    changes = [
+        ([], []),
+        ([], ["1 PTR chiya"]),
+        (["chino A 192.168.0.2", "cocoa A 192.168.0.5"], []),
+        ([], []),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        a_filename = os.path.join(tmpdir, "example.jp.zone")
+        ptr_filename = os.path.join(tmpdir, "192.168.0.rev")
+        state_filename = os.path.join(tmpdir, "check_state.sqlite3")
+        for i, (a_change, ptr_change) in enumerate(changes):
+            a_zone.extend(a_change)
+            ptr_zone.extend(ptr_change)
+            for filename, lines in [(a_filename, a_zone),
+                                    (ptr_filename, ptr_zone)]:
+                with open(filename, "w") as f:
+                    f.write("\n".join(lines))
+                os.utime(filename, ns=(i, i))
+
+            parser = RecordParser()
+            nt = Network("192.168.0.0/24")
+            for record in parser.parse_a_record_file(a_filename):
+                nt.add_record(record)
+            for record in parser.parse_ptr_record_file(
+                    ptr_filename, "192.168.0.0/24"
+            ):
+                nt.add_record(record)
+
+            checker = IncrementalChecker(state_filename)
+            result = checker.check_all(
+                {"192.168.0.0/24": nt},
+                [a_filename],
+                [(ptr_filename, "192.168.0.0/24")]
+            )["192.168.0.0/24"]
+            checker.save()
+            checker.close()
+
+            full_result = Checker(nt).check()
+            for result, answer in [(result.a2ptr, full_result.a2ptr),
+                                   (result.ptr2a, full_result.ptr2a)]:
+                duplicated, not_found, cor_error = result
+                answer_duplicated, answer_not_found, answer_cor_error = answer
+                assert duplicated == answer_duplicated
+                assert set(not_found) == set(answer_not_found)
+                assert cor_error == answer_cor_error
+
+
+def test_global_checker():
+    # テストレコード
+    #
+    # 192.168.0.0/24                    192.168.1.0/24
+    # A レコード    PTR レコード        A レコード    PTR レコード
+    # chiya .0.1    .0.1 chiya
+    #               .0.2 chino          chino .1.2
+    # syaro .0.3    .0.3 syaro          syaro .1.3    .1.3 syaro
+    #                                   rize  .1.4    .1.4 rize
+    a_chiya = ARecord("chiya", "192.168.0.1")
+    a_syaro0 = ARecord("syaro", "192.168.0.3")
+    a_chino = ARecord("chino", "192.168.1.2")
+    a_syaro1 = ARecord("syaro", "192.168.1.3")
+    a_rize = ARecord("rize", "192.168.1.4")
+    ptr_chiya = PTRRecord("chiya", "192.168.0.1")
+    ptr_chino = PTRRecord("chino", "192.168.0.2")
+    ptr_syaro0 = PTRRecord("syaro", "192.168.0.3")
+    ptr_syaro1 = PTRRecord("syaro", "192.168.1.3")
+    ptr_rize = PTRRecord("rize", "192.168.1.4")
+
+    ip_network = {
+        "192.168.0.0/24": Network("192.168.0.0/24"),
+        "192.168.1.0/24": Network("192.168.1.0/24"),
+        # 192.168.1.0/24 と重なるネットワーク
+        "192.168.1.0/25": Network("192.168.1.0/25"),
+    }
+    router = NetworkRouter(ip_network.values())
+    for record in [a_chiya, a_syaro0, a_chino, a_syaro1, a_rize]:
+        router.add_record(record)
+    for record in [ptr_chiya, ptr_chino, ptr_syaro0]:
+        ip_network["192.168.0.0/24"].add_record(record)
+    for record in [ptr_syaro1, ptr_rize]:
+        ip_network["192.168.1.0/24"].add_record(record)
+
+    # ネットワークごとにチェックすると chino の PTR レコードに対応する
+    # A レコードは見つからず、syaro の重複も見つからない
+    result = Checker(ip_network["192.168.0.0/24"]).check()
+    assert result.ptr_not_found == [ptr_chino]
+    assert result.a_duplicated == {}
+
+    checker = GlobalChecker(ip_network)
+    result = checker.check()
+    assert result.networks[a_rize] == ["192.168.1.0/24", "192.168.1.0/25"]
+    assert result.networks[ptr_rize] == ["192.168.1.0/24"]
+    assert result.a_duplicated == {"syaro": {a_syaro0, a_syaro1}}
+    assert result.ptr_not_found == []
+    assert result.ptr_cor_error == {
+        ptr_chino: {a_chino},
+        ptr_syaro0: {a_syaro0, a_syaro1},
+        ptr_syaro1: {a_syaro0, a_syaro1},
+    }
+    assert result.a_not_found == [a_chino]
+
+    # rize の A レコードは 192.168.1.0/25 にもあるが、PTR レコードと
+    # 同じ 192.168.1.0/24 にあるのでネットワークをまたがない
+    assert not result.is_cross_network([a_rize, ptr_rize])
+    cross_network = result.cross_network()
+    assert cross_network.a_duplicated == result.a_duplicated
+    assert cross_network.ptr_cor_error == result.ptr_cor_error
+    assert cross_network.a_cor_error == {}
+    assert cross_network.a_not_found == []
@@ -0,0 +1,425 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+
+"""
+This module provides CompactNetwork class, a memory efficient Network.
+
+:copyright: (c) 2015 by the KUSM Admin Team
+:license: MIT, see LICENSE for more details.
+"""
+
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping
+from heapq import merge
+from address import parse_address, to_address_string
+from network import Network, NetworkRangeError
+import instrument
+from record import DNSRecord, ARecord, PTRRecord, RecordInfo
+
+
+class NameTable:
+    """
+    ホスト名などの文字列に通し番号をつけて一度だけ保持する
+
+    番号 0 は None をあらわす
+
+    >>> names = NameTable()
+    >>> names.intern("host1")
+    1
+    >>> names[1]
+    'host1'
+    """
+    def __init__(self):
+        self._names = [None]
+        self._ids = {None: 0}
+
+    def intern(self, name: str) -> int:
+        """
+        name の番号を返す。はじめての文字列なら番号をつける
+        """
+        name_id = self._ids.get(name)
+        if name_id is None:
+            name_id = len(self._names)
+            self._ids[name] = name_id
+            self._names.append(name)
+        return name_id
+
+    def lookup(self, name: str):
+        """
+        name の番号を返す。登録されていなければ None を返す
+        """
+        return self._ids.get(name)
+
+    def __getitem__(self, name_id: int) -> str:
+        return self._names[name_id]
+
+    def __len__(self):
+        return len(self._names) - 1
+
+
+class RecordColumns:
+    """
+    レコードをアドレス順に並べた array の列として持つ
+
+    addresses はネットワークの先頭アドレスからのオフセット、
+    fields はそれぞれ NameTable の番号などの整数の列で、
+    同じ位置の値がひとつのレコードをあらわす。
+    追加したときには並べ替えず、はじめて読むときにまとめて
+    並べ替えて重複を除く
+    """
+    def __init__(
+        self,
+        address_typecode: str,
+        number_of_fields: int
+    ):
+        self.addresses = array(address_typecode)
+        self.fields = [array("I") for _ in range(number_of_fields)]
+        self._sorted = True
+        # fields[0] の順に並べた位置とその値 (fields[0] で引くときに使う)
+        self._key_order = None
+        self._keys = None
+
+    def __len__(self):
+        self._sort()
+        return len(self.addresses)
+
+    def append(
+        self,
+        address: int,
+        values: (int,)
+    ):
+        if self.addresses and address <= self.addresses[-1]:
+            self._sorted = False
+        self.addresses.append(address)
+        for field, value in zip(self.fields, values):
+            field.append(value)
+        self._key_order = None
+        self._keys = None
+
+    def _sort(self):
+        if self._sorted:
+            return
+        rows = sorted(set(zip(self.addresses, *self.fields)))
+        self.addresses = array(
+            self.addresses.typecode, (row[0] for row in rows)
+        )
+        self.fields = [
+            array("I", (row[i] for row in rows))
+            for i in range(1, len(self.fields) + 1)
+        ]
+        self._sorted = True
+
+    def span(
+        self,
+        first: int,
+        last: int
+    ) -> range:
+        """
+        アドレスが first 以上 last 以下のレコードの位置を返す
+        """
+        self._sort()
+        return range(
+            bisect_left(self.addresses, first),
+            bisect_right(self.addresses, last)
+        )
+
+    def distinct_addresses(self):
+        """
+        レコードのあるアドレスを重複なく昇順に生成する
+        """
+        self._sort()
+        previous = None
+        for address in self.addresses:
+            if address != previous:
+                yield address
+                previous = address
+
+    def _build_key_index(self):
+        self._sort()
+        if self._key_order is None:
+            key = self.fields[0]
+            # sorted は安定なので同じキーの中ではアドレス順になる
+            self._key_order = array(
+                "I", sorted(range(len(key)), key=key.__getitem__)
+            )
+            self._keys = array("I", (key[i] for i in self._key_order))
+
+    def key_positions(self, key: int):
+        """
+        fields[0] が key であるレコードの位置を返す
+        """
+        self._build_key_index()
+        return self._key_order[
+            bisect_left(self._keys, key):bisect_right(self._keys, key)
+        ]
+
+    def distinct_keys(self):
+        """
+        fields[0] の値を重複なく昇順に生成する
+        """
+        self._build_key_index()
+        previous = None
+        for key in self._keys:
+            if key != previous:
+                yield key
+                previous = key
+
+
+class _HostnameView(Mapping):
+    """
+    ホスト名をキーとする列を Network.a_record と同じ
+    {"host1": {record1, record2}, ...} の辞書として見せる
+    """
+    def __init__(self, network, columns, make_record):
+        self._network = network
+        self._columns = columns
+        self._make_record = make_record
+
+    def __getitem__(self, hostname: str):
+        name_id = self._network.names.lookup(hostname)
+        positions = self._columns.key_positions(name_id) \
+            if name_id is not None else []
+        if not positions:
+            raise KeyError(hostname)
+        return set(self._make_record(i) for i in positions)
+
+    def __contains__(self, hostname: str):
+        name_id = self._network.names.lookup(hostname)
+        return name_id is not None and \
+            len(self._columns.key_positions(name_id)) > 0
+
+    def __iter__(self):
+        names = self._network.names
+        return (names[name_id] for name_id in self._columns.distinct_keys())
+
+    def __len__(self):
+        return sum(1 for _ in self._columns.distinct_keys())
+
+
+class _AddressView(Mapping):
+    """
+    IP アドレスをキーとする列を Network.ptr_record と同じ
+    {"192.168.0.1": {record1, record2}, ...} の辞書として見せる
+    """
+    def __init__(self, network, columns, make_record):
+        self._network = network
+        self._columns = columns
+        self._make_record = make_record
+
+    def _span(self, ip_address: str):
+        try:
+            offset = self._network.get_offset(ip_address)
+        except (ValueError, NetworkRangeError):
+            return range(0)
+        return self._columns.span(offset, offset)
+
+    def __getitem__(self, ip_address: str):
+        positions = self._span(ip_address)
+        if not positions:
+            raise KeyError(ip_address)
+        return set(self._make_record(i) for i in positions)
+
+    def __contains__(self, ip_address: str):
+        return len(self._span(ip_address)) > 0
+
+    def __iter__(self):
+        get_ip_address = self._network.get_ip_address
+        return (
+            get_ip_address(offset)
+            for offset in self._columns.distinct_addresses()
+        )
+
+    def __len__(self):
+        return sum(1 for _ in self._columns.distinct_addresses())
+
+
+class CompactNetwork(Network):
+    """
+    Network と同じように使えるが、レコードを array の列で持つ
+
+    アドレスはネットワークの先頭からのオフセットの整数として、
+    ホスト名などの文字列は NameTable の番号として持つので、
+    レコードひとつあたりのメモリは数十バイトですむ。
+    a_record, ptr_record, record_info は Network と同じ形の
+    辞書として読めるが、値の集合は読むたびに生成される
+
+    >>> network = CompactNetwork("192.168.0.0/24")
+    >>> network.add_record(ARecord("host1", "192.168.0.1"))
+    >>> network.a_record["host1"]
+    {<record.ARecord object at ...>}
+    """
+    def __init__(
+        self,
+        network_address: str
+    ):
+        self._init_network_address(network_address)
+        number_of_addresses = self.network_address.num_addresses
+        if number_of_addresses <= 1 << 32:
+            typecode = "I"
+        elif number_of_addresses <= 1 << 64:
+            typecode = "Q"
+        else:
+            raise ValueError(
+                "{} is too large for CompactNetwork".format(network_address)
+            )
+
+        self.names = NameTable()
+        # (アドレス, ホスト名, used)
+        self._a_columns = RecordColumns(typecode, 2)
+        self._ptr_columns = RecordColumns(typecode, 2)
+        # (アドレス, ホスト名, クラス, 部屋, コメント)
+        self._info_columns = RecordColumns(typecode, 4)
+
+    @property
+    def a_record(self):
+        return _HostnameView(self, self._a_columns, self._make_a_record)
+
+    @property
+    def ptr_record(self):
+        return _AddressView(self, self._ptr_columns, self._make_ptr_record)
+
+    @property
+    def record_info(self):
+        return _AddressView(self, self._info_columns, self._make_record_info)
+
+    def get_offset(
+        self,
+        ip_address: str,
+        check_range: bool=True
+    ) -> int:
+        """
+        ip_address のネットワークの先頭アドレスからのオフセットを返す
+        """
+        version, address = parse_address(ip_address)
+        if check_range and (
+                version != self.version or
+                not self.first_address <= address <= self.last_address
+        ):
+            instrument.count("network range errors")
+            raise NetworkRangeError("{} not in {}".format(
+                ip_address, self.network_address
+            ))
+        return address - self.first_address
+
+    def get_ip_address(self, offset: int) -> str:
+        return to_address_string(
+            self.version, self.first_address + offset
+        )
+
+    def _make_dns_record(self, record_class, columns, i):
+        return record_class(
+            self.names[columns.fields[0][i]],
+            self.get_ip_address(columns.addresses[i]),
+            bool(columns.fields[1][i])
+        )
+
+    def _make_a_record(self, i: int) -> ARecord:
+        return self._make_dns_record(ARecord, self._a_columns, i)
+
+    def _make_ptr_record(self, i: int) -> PTRRecord:
+        return self._make_dns_record(PTRRecord, self._ptr_columns, i)
+
+    def _make_record_info(self, i: int) -> RecordInfo:
+        columns = self._info_columns
+        return RecordInfo(
+            self.get_ip_address(columns.addresses[i]),
+            *[self.names[field[i]] for field in columns.fields]
+        )
+
+    def add_record(
+        self,
+        record: DNSRecord,
+        check_range: bool=True
+    ):
+        if isinstance(record, ARecord):
+            columns = self._a_columns
+        elif isinstance(record, PTRRecord):
+            columns = self._ptr_columns
+        else:
+            # どちらでもない場合は ValueError をだす
+            raise ValueError("record type is {}".format(type(record)))
+        columns.append(
+            self.get_offset(record.ip_address, check_range),
+            (self.names.intern(record.hostname), int(record.used))
+        )
+
+    def add_record_info(
+        self,
+        record_info: RecordInfo,
+        check_range: bool=True
+    ):
+        self._info_columns.append(
+            self.get_offset(record_info.ip_address, check_range),
+            (self.names.intern(record_info.hostname),
+             self.names.intern(record_info.classname),
+             self.names.intern(record_info.room),
+             self.names.intern(record_info.comment))
+        )
+
+    def _address_records(self):
+        names = self.names
+        a_columns = self._a_columns
+        ptr_columns = self._ptr_columns
+        info_columns = self._info_columns
+
+        previous = None
+        for offset in merge(
+                a_columns.distinct_addresses(),
+                ptr_columns.distinct_addresses(),
+                info_columns.distinct_addresses()
+        ):
+            if offset == previous:
+                continue
+            previous = offset
+            yield (
+                self.get_ip_address(offset),
+                set(names[a_columns.fields[0][i]]
+                    for i in a_columns.span(offset, offset)),
+                set(names[ptr_columns.fields[0][i]]
+                    for i in ptr_columns.span(offset, offset)),
+                set(self._make_record_info(i)
+                    for i in info_columns.span(offset, offset))
+            )
+
+
+def test_compact_network():
+    records = [
+        ARecord("chiya", "192.168.0.1"),
+        ARecord("syaro", "192.168.0.3"),
+        ARecord("syaro", "192.168.0.4"),
+        ARecord("rize", "192.168.0.4"),
+        ARecord("rize", "192.168.0.4"),
+        PTRRecord("chino", "192.168.0.2"),
+        PTRRecord("syaro", "192.168.0.3"),
+        PTRRecord("syaro", "192.168.0.4"),
+        PTRRecord("rize", "192.168.0.4"),
+    ]
+    record_infos = [
+        RecordInfo("192.168.0.2", "chino", None, None, "PC"),
+        RecordInfo("192.168.0.5", None, "HOST", "100", None),
+    ]
+    network = Network("192.168.0.0/24")
+    compact_network = CompactNetwork("192.168.0.0/24")
+    for nt in [network, compact_network]:
+        for record in reversed(records):
+            nt.add_record(record)
+        for record_info in record_infos:
+            nt.add_record_info(record_info)
+
+    assert dict(compact_network.a_record) == network.a_record
+    assert dict(compact_network.ptr_record) == network.ptr_record
+    assert dict(compact_network.record_info) == network.record_info
+    assert "syaro" in compact_network.a_record
+    assert "chino" not in compact_network.a_record
+    assert "192.168.0.2" in compact_network.ptr_record
+    assert "10.0.0.1" not in compact_network.ptr_record
+    assert list(compact_network) == list(network)
+
+    try:
+        compact_network.add_record(ARecord("cocoa", "192.168.1.1"))
+        assert False
+    except NetworkRangeError:
+        pass
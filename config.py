@@ -12,6 +12,9 @@ html_dir = "build"
 # レコードに関する情報をおいているディレクトリ
 record_info_dir = "testzones"
 
+# 解析したレコードのキャッシュをおくディレクトリ
+cache_dir = ".cache"
+
 # A レコードのゾーンファイル名
 a_record_filenames = [
     "example.jp.zone",
@@ -21,6 +24,15 @@ ptr_record_filename_networks = [
     ('192.168.0.rev', '192.168.0.0/24'),
 ]
 
+# --axfr で転送するときの A レコードのゾーン名
+axfr_a_record_zones = [
+    "example.jp.",
+]
+# --axfr で転送するときの PTR レコードのゾーン名とそのネットワーク
+axfr_ptr_record_zone_networks = [
+    ("0.168.192.in-addr.arpa.", "192.168.0.0/24"),
+]
+
 # レコード情報を納めたファイル
 record_info_filenames = [
     '192.168.0.info',
@@ -9,20 +9,45 @@ DNS Checker
 :license: MIT, see LICENSE for more details.
 """
 
-from network import Network, NetworkRangeError
-from checker import Checker
+from logging import getLogger
+from address import get_cache_stats
+import instrument
+try:
+    import resource
+except ImportError:
+    resource = None
+from network import Network, NetworkRangeError, NetworkRouter, make_network
+from axfr import AXFRClient, AXFRError
+from cache import ParseCache
+from checker import Checker, CheckResult, GlobalChecker, IncrementalChecker
+from compact import CompactNetwork
 from genhtml import HTMLBuilder
-from parser import RecordParser, RecordInfoParser
+from parser import RecordParser, RecordInfoParser, ParallelRecordParser
+from server import QueryServer
+from watcher import ZoneWatcher
+
+
+logger = getLogger(__name__)
 
 
 def make_ip_network(
     a_record_filenames: [str],
     ptr_record_filename_networks: [str],
-    record_info_filenames: [str]
+    record_info_filenames: [str],
+    network_class: type=Network,
+    jobs: int=1,
+    cache: ParseCache=None
 ) -> {str: Network}:
     """
     ゾーンファイルから Network インスタンスを生成する
 
+    network_class に CompactNetwork を指定すると、レコードを
+    省メモリな形式で持つ。IPv6 のネットワークは network_class によらず
+    SparseNetwork になる。
+    jobs が 2 以上のときは、ファイルを jobs 個のプロセスで並列に解析する。
+    cache に ParseCache を指定すると、変更されていないファイルは
+    解析せずにキャッシュから読む
+
     返り値は
 
         {"192.168.0.0/24": mynetwork1,
@@ -34,56 +59,251 @@ def make_ip_network(
     network = {}
     for network_address in [network_address for _, network_address in
                             ptr_record_filename_networks]:
-        network[network_address] = Network(network_address)
+        network[network_address] = make_network(
+            network_address, network_class
+        )
 
-    # ゾーンファイルを解析する
-    parser = RecordParser()
-    for filename in a_record_filenames:
-        for a_record in parser.parse_a_record_file(filename):
-            for nt in network.values():
-                try:
-                    nt.add_record(a_record)
-                except NetworkRangeError:
-                    pass
+    # レコードをそれを含むネットワークに振り分けるためのインデックス
+    router = NetworkRouter(network.values())
 
-    for filename, network_address in ptr_record_filename_networks:
-        for ptr_record in parser.parse_ptr_record_file(
-                filename, network_address
+    # ゾーンファイルとレコード情報ファイルを解析する関数で、
+    # ファイル (PTR レコードなら (ファイル, ネットワークアドレス)) の
+    # リストを受けとり、ファイルごとのレコードのイテレータを返す
+    if jobs > 1:
+        parallel_parser = ParallelRecordParser(jobs)
+        parse_a_record_files = parallel_parser.parse_a_record_files
+        parse_ptr_record_files = parallel_parser.parse_ptr_record_files
+        parse_record_info_files = parallel_parser.parse_record_info_files
+    else:
+        # レコードは解析したそばからネットワークに追加するので、
+        # ファイル全体のレコードのリストは作らない
+        parser = RecordParser()
+        parse_a_record_files = parser.iter_a_record_files
+        parse_ptr_record_files = parser.iter_ptr_record_files
+        parse_record_info_files = RecordInfoParser().iter_files
+
+    # 並列に解析する場合とキャッシュを使う場合はここでまとめて解析する
+    with instrument.stage("parse"):
+        if cache is not None:
+            # 変更されていないファイルはキャッシュから読む
+            a_record_lists = cache.parse_files(
+                "A", a_record_filenames, parse_a_record_files
+            )
+            ptr_record_lists = cache.parse_files(
+                "PTR", ptr_record_filename_networks, parse_ptr_record_files
+            )
+            record_info_lists = cache.parse_files(
+                "INFO", record_info_filenames, parse_record_info_files
+            )
+            logger.debug("parse cache: {} hits, {} misses".format(
+                cache.hits, cache.misses
+            ))
+        else:
+            a_record_lists = parse_a_record_files(a_record_filenames)
+            ptr_record_lists = parse_ptr_record_files(
+                ptr_record_filename_networks
+            )
+            record_info_lists = parse_record_info_files(
+                record_info_filenames
+            )
+
+    # 一つずつ解析しながら追加する場合は、レコードをとりだす時間を
+    # parse として route から除く
+    routed = 0
+    with instrument.stage("route"):
+        unrouted_a_records = []
+        for a_records in a_record_lists:
+            for a_record in instrument.timed_iter(
+                    "parse", a_records
+            ):
+                if router.add_record(a_record):
+                    routed += 1
+                else:
+                    unrouted_a_records.append(a_record)
+
+        for (_, network_address), ptr_records in zip(
+                ptr_record_filename_networks, ptr_record_lists
         ):
-            try:
-                network[network_address].add_record(ptr_record)
-            except NetworkRangeError:
-                pass
-
-    # レコード情報を解析する
-    record_info_parser = RecordInfoParser()
-    for filename in record_info_filenames:
-        for record_info in record_info_parser.parse_file(filename):
-            for nt in network.values():
+            for ptr_record in instrument.timed_iter(
+                    "parse", ptr_records
+            ):
                 try:
-                    nt.add_record_info(record_info)
+                    network[network_address].add_record(ptr_record)
+                    routed += 1
                 except NetworkRangeError:
                     pass
 
+        unrouted_record_infos = []
+        for record_infos in record_info_lists:
+            for record_info in instrument.timed_iter(
+                    "parse", record_infos
+            ):
+                if router.add_record_info(record_info):
+                    routed += 1
+                else:
+                    unrouted_record_infos.append(record_info)
+    instrument.count("records routed", routed)
+    instrument.count(
+        "records unrouted",
+        len(unrouted_a_records) + len(unrouted_record_infos)
+    )
+
+    # どのネットワークにもはいらなかったレコードをまとめて報告する
+    _report_unrouted("A records", unrouted_a_records)
+    _report_unrouted("record infos", unrouted_record_infos)
+    _report_peak_memory()
+    for name, stats in get_cache_stats().items():
+        logger.debug(
+            "{} cache: {} hits, {} misses ({:.1%} hit rate)".format(
+                name, stats["hits"], stats["misses"], stats["hit_rate"]
+            )
+        )
+
+    return network
+
+
+def make_ip_network_by_axfr(
+    client: AXFRClient,
+    a_record_zones: [str],
+    ptr_record_zone_networks: [(str, str)],
+    record_info_filenames: [str],
+    network_class: type=Network
+) -> {str: Network}:
+    """
+    make_ip_network と同じ辞書を、ゾーンファイルを読むかわりに
+    client で権威サーバからゾーンを転送して作る
+
+    レコード情報はファイルから読む
+    """
+    network = client.make_ip_network(
+        a_record_zones,
+        ptr_record_zone_networks,
+        network_class
+    )
+    router = NetworkRouter(network.values())
+    unrouted_record_infos = []
+    with instrument.stage("route"):
+        for record_infos in RecordInfoParser().iter_files(
+                record_info_filenames
+        ):
+            for record_info in record_infos:
+                if not router.add_record_info(record_info):
+                    unrouted_record_infos.append(record_info)
+    _report_unrouted("record infos", unrouted_record_infos)
+    _report_peak_memory()
     return network
 
 
+def _report_peak_memory() -> None:
+    """
+    プロセスの最大常駐メモリをログにだす
+    """
+    if resource is None:
+        return
+    # Linux では KiB 単位
+    logger.debug("peak RSS: {} KiB".format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ))
+
+
+def _report_unrouted(
+    name: str,
+    records: list
+) -> None:
+    """
+    どのネットワークにもはいらなかったレコードをログにだす
+    """
+    if not records:
+        return
+    logger.info("{} {} are not in any network".format(len(records), name))
+    for record in records:
+        logger.debug("\t{} -> {}".format(record.ip_address, record.hostname))
+
+
 def check_records(
-    ip_network: {str: Network}
+    ip_network: {str: Network},
+    results: {str: CheckResult}=None
 ) -> None:
     """
     Network インスタンスの A レコードと PTR レコードが
     正しく対応しているかチェックする
+
+    results にネットワークアドレスをキー、CheckResult を値とする辞書を
+    渡すと、チェックせずにその結果を表示する
     """
     for network_address, network in ip_network.items():
         print("cheking {} network".format(network_address))
         checker = Checker(network)
-        checker.show_a2ptr_checker_result()
-        checker.show_ptr2a_checker_result()
+        checker.show_checker_result(
+            results[network_address] if results else None
+        )
+
+
+def check_records_globally(ip_network: {str: Network}) -> None:
+    """
+    全てのネットワークのレコードをまとめてチェックし、
+    複数のネットワークにまたがる重複と対応の誤りを表示する
+    """
+    print("checking across {} networks".format(len(ip_network)))
+    GlobalChecker(ip_network).show_checker_result()
+
+
+def watch_records(
+    watcher: ZoneWatcher,
+    interval: float=1.0,
+    builder: HTMLBuilder=None,
+    html_dir: str=None
+) -> None:
+    """
+    watcher でファイルを監視し、変更があるたびにチェックしなおした
+    ネットワークの結果を表示する。builder を渡すと HTML を生成しなおす
+
+    Ctrl-C で終了する
+    """
+    def show(network_addresses):
+        if builder is not None:
+            builder.render(watcher.ip_network, html_dir, watcher.results)
+        else:
+            check_records(
+                {network_address: network
+                 for network_address, network in watcher.ip_network.items()
+                 if network_address in network_addresses},
+                watcher.results
+            )
+
+    show(set(watcher.load()))
+    logger.info("watching {} files".format(len(watcher.sources)))
+    try:
+        for network_addresses in watcher.watch(interval):
+            show(network_addresses)
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_records(
+    watcher: ZoneWatcher,
+    server_address: (str, int),
+    interval: float=1.0
+) -> None:
+    """
+    watcher で読んだネットワークを引く HTTP サーバを動かす
+
+    ファイルはバックグラウンドで監視する。Ctrl-C で終了する
+    """
+    server = QueryServer(server_address, watcher)
+    server.start_watching(interval)
+    logger.info("serving on http://{}:{}/".format(*server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
 
 if __name__ == "__main__":
     from logging import getLogger, basicConfig, INFO, DEBUG
+    from contextlib import ExitStack
     import argparse
     import config
     import os
@@ -126,12 +346,126 @@ if __name__ == "__main__":
         ),
         help="record info directory"
     )
+    parser.add_argument(
+        "-c", "--cache-dir",
+        type=str,
+        nargs="?",
+        default=os.path.join(
+            os.path.abspath(os.path.dirname(__file__)),
+            config.cache_dir
+        ),
+        help="parse cache directory"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="parse all files without the parse cache"
+    )
+    parser.add_argument(
+        "-i", "--incremental",
+        action="store_true",
+        help="recheck only records changed since the last run"
+    )
     parser.add_argument(
         "--html",
         action="store_true",
         help="generate html"
     )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="store records in a memory efficient form"
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=None,
+        help="split each network page into pages of this many rows"
+    )
+    parser.add_argument(
+        "--collapse-unused",
+        action="store_true",
+        help="show consecutive unused addresses as one row in html"
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="number of processes to parse zone files and generate html"
+    )
+    parser.add_argument(
+        "--axfr",
+        type=str,
+        default=None,
+        metavar="SERVER",
+        help="transfer zones from SERVER by AXFR instead of reading files"
+    )
+    parser.add_argument(
+        "--axfr-port",
+        type=int,
+        default=53,
+        help="port of the --axfr server"
+    )
+    parser.add_argument(
+        "--axfr-concurrency",
+        type=int,
+        default=8,
+        help="number of zones transferred at once by --axfr"
+    )
+    parser.add_argument(
+        "--global",
+        dest="global_check",
+        action="store_true",
+        help="also check records across all networks"
+    )
+    parser.add_argument(
+        "-w", "--watch",
+        action="store_true",
+        help="keep running and recheck files whenever they change"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="seconds between checks for changed files in --watch mode"
+    )
+    parser.add_argument(
+        "--serve",
+        type=int,
+        default=None,
+        metavar="PORT",
+        help="serve records and check results as JSON over HTTP on PORT"
+    )
+    parser.add_argument(
+        "--bind",
+        type=str,
+        default="127.0.0.1",
+        help="address to bind the --serve HTTP server to"
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="write time and counters of each stage to this file"
+    )
+    parser.add_argument(
+        "--profile-format",
+        choices=["text", "json"],
+        default="text",
+        help="format of the --profile file"
+    )
+    parser.add_argument(
+        "--cprofile",
+        type=str,
+        default=None,
+        help="write cProfile statistics for pstats to this file"
+    )
     args = parser.parse_args()
+    if args.axfr and \
+            (args.incremental or args.watch or args.serve is not None):
+        parser.error(
+            "--axfr cannot be used with --incremental, --watch or --serve"
+        )
     # logger
     basicConfig(
         level=DEBUG if args.verbose else INFO,
@@ -141,6 +475,15 @@ if __name__ == "__main__":
     zone_dir = os.path.abspath(args.zone_dir)
     html_dir = os.path.abspath(args.html_dir)
     record_info_dir = os.path.abspath(args.record_info_dir)
+    cache = None if args.no_cache else ParseCache(args.cache_dir)
+
+    # 計測する場合は最後に閉じる
+    profile_stack = ExitStack()
+    if args.cprofile:
+        profile_stack.enter_context(instrument.profile(args.cprofile))
+    if args.profile:
+        instrument.set_enabled(True)
+        profile_stack.enter_context(instrument.stage("total"))
 
     # ゾーンファイルのパスを求める
     a_record_filenames = [
@@ -156,21 +499,88 @@ if __name__ == "__main__":
         for filename in config.record_info_filenames
     ]
 
-    # ネットワークを定義する
-    network = make_ip_network(
-        a_record_filenames,
-        ptr_record_filename_networks,
-        record_info_filenames
-    )
+    network_class = CompactNetwork if args.compact else Network
+    builder = HTMLBuilder(
+        jobs=args.jobs,
+        page_size=args.page_size,
+        collapse_unused=args.collapse_unused
+    ) if args.html else None
 
-    if args.html:
-        # --html オプションが有効のとき
-        # HTML を生成する
-        builder = HTMLBuilder()
-        builder.render(network, html_dir)
-    else:
-        # --html オプションが無効のとき
-        # ゾーンファイルをチェックして結果を標準出力にだす
-        check_records(
-            network
+    if args.watch or args.serve is not None:
+        # 解析したレコードをメモリにおいたまま、変更されたファイルだけを
+        # 解析しなおしてチェックしなおす
+        watcher = ZoneWatcher(
+            a_record_filenames,
+            ptr_record_filename_networks,
+            record_info_filenames,
+            network_class=network_class,
+            cache=cache
         )
+        if args.serve is not None:
+            serve_records(watcher, (args.bind, args.serve), args.interval)
+        else:
+            watch_records(watcher, args.interval, builder, html_dir)
+    else:
+        # ネットワークを定義する
+        if args.axfr:
+            # ゾーンファイルのかわりに権威サーバからゾーンを転送する
+            try:
+                network = make_ip_network_by_axfr(
+                    AXFRClient(
+                        args.axfr,
+                        args.axfr_port,
+                        concurrency=args.axfr_concurrency
+                    ),
+                    config.axfr_a_record_zones,
+                    config.axfr_ptr_record_zone_networks,
+                    record_info_filenames,
+                    network_class=network_class
+                )
+            except AXFRError as error:
+                logger.error(error)
+                parser.exit(1)
+        else:
+            network = make_ip_network(
+                a_record_filenames,
+                ptr_record_filename_networks,
+                record_info_filenames,
+                network_class=network_class,
+                jobs=args.jobs,
+                cache=cache
+            )
+
+        if args.incremental:
+            # 前回の結果を使い、変更されたレコードだけをチェックしなおす
+            incremental_checker = IncrementalChecker(
+                os.path.join(args.cache_dir, "check_state.sqlite3"),
+                cache
+            )
+            results = incremental_checker.check_all(
+                network,
+                a_record_filenames,
+                ptr_record_filename_networks
+            )
+            incremental_checker.save()
+            incremental_checker.close()
+        else:
+            results = None
+
+        if builder is not None:
+            # --html オプションが有効のとき
+            # HTML を生成する
+            builder.render(network, html_dir, results)
+        else:
+            # --html オプションが無効のとき
+            # ゾーンファイルをチェックして結果を標準出力にだす
+            check_records(
+                network,
+                results
+            )
+
+        if args.global_check:
+            # ネットワークをまたぐ重複と対応の誤りを標準出力にだす
+            check_records_globally(network)
+
+    profile_stack.close()
+    if args.profile:
+        instrument.write_report(args.profile, args.profile_format)
@@ -9,15 +9,181 @@ This module generates HTML.
 :license: MIT, see LICENSE for more details.
 """
 
-from network import Network
-from checker import Checker
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from network import Network, UnusedRange
+from checker import Checker, CheckResult
+import filecmp
+import hashlib
+import instrument
 import jinja2
+import json
 import os
 import shutil
 
 
+# 前回生成したページのフィンガープリントを保存するファイル
+MANIFEST_FILENAME = ".manifest.json"
+
+# ワーカープロセスごとの HTMLBuilder
+_worker_builder = None
+
+
+def _init_worker(
+    page_size: int,
+    collapse_unused: bool,
+    instrument_enabled: bool
+):
+    global _worker_builder
+    instrument.set_enabled(instrument_enabled)
+    _worker_builder = HTMLBuilder(
+        page_size=page_size,
+        collapse_unused=collapse_unused
+    )
+
+
+def _render_network_page(
+    network_address: str,
+    network: Network,
+    html_dir: str,
+    result: CheckResult,
+    render: bool
+) -> ([str], CheckResult, dict):
+    """
+    ワーカープロセスでネットワークのページを生成し、チェックする
+
+    result が None ならチェックしなおす。render が False なら
+    ページは生成しない。返り値は
+    (分けたページのファイル名のリストか None, チェック結果,
+     instrument の計測結果)
+    """
+    instrument.reset()
+    if result is None:
+        result = Checker(network).check()
+    pages = None
+    if render:
+        pages = _worker_builder.render_network_html(
+            network_address, network, html_dir
+        )
+    return pages, result, instrument.get_report()
+
+
+@contextmanager
+def open_atomic(
+    path: str,
+    buffering: int=-1
+):
+    """
+    書きこみ用に一時ファイルを開き、閉じたあとで path に rename する
+
+    途中で失敗しても path には前回の完全なファイルが残る
+    """
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp_path, 'w', buffering=buffering) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _link_or_copy(
+    source: str,
+    destination: str
+):
+    """
+    source を destination にハードリンクする。できなければ
+    更新時刻ごとコピーする
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+@contextmanager
+def staging_dir(html_dir: str):
+    """
+    html_dir の隣に html_dir の中身をハードリンクした作業用の
+    ディレクトリを作って返し、ブロックを抜けたら html_dir と入れかえる
+
+    途中で失敗したときは作業用のディレクトリを消し、html_dir は
+    前回の完全な内容のまま残る。変わらなかったファイルはハードリンク
+    なので、内容も更新時刻も前回のまま
+    """
+    html_dir = os.path.abspath(html_dir)
+    parent, name = os.path.split(html_dir)
+    staging = os.path.join(parent, ".{}.staging-{}".format(name, os.getpid()))
+    previous = os.path.join(parent, ".{}.previous-{}".format(
+        name, os.getpid()
+    ))
+    if os.path.isdir(html_dir):
+        shutil.copytree(html_dir, staging, copy_function=_link_or_copy)
+    else:
+        os.makedirs(staging)
+    try:
+        yield staging
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    # 入れかえは rename 二回だけで、その間だけ html_dir がない
+    if os.path.isdir(html_dir):
+        os.rename(html_dir, previous)
+    os.rename(staging, html_dir)
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def _iter_pages(
+    rows,
+    page_size: int
+):
+    """
+    rows を page_size 行ずつのリストに分け、
+
+        (行のリスト, 次のページがあるかどうか)
+
+    を生成する
+    """
+    rows = iter(rows)
+    page = list(islice(rows, page_size))
+    while page:
+        next_page = list(islice(rows, page_size))
+        yield page, bool(next_page)
+        page = next_page
+
+
 class HTMLBuilder:
-    def __init__(self):
+    """
+    jobs が 2 以上のときは、ネットワークごとのページの生成と
+    チェックを jobs 個のプロセスで並列に行う
+
+    ページは html_dir の隣の作業用のディレクトリに生成し、最後に
+    html_dir と入れかえるので、途中で失敗しても html_dir には前回の
+    完全な内容が残る
+
+    生成したページのフィンガープリントを html_dir の
+    MANIFEST_FILENAME に保存しておき、次回はフィンガープリントが
+    変わったページだけを生成しなおす。ネットワークのページを分けた
+    ページのファイル名も保存しておき、生成しなくなったページは消す
+
+    page_size を指定すると、ネットワークのページを page_size 行ずつの
+    192.168.0.0-1.html, 192.168.0.0-2.html, ... に分け、
+    192.168.0.0.html はそれらのページの一覧にする。
+    collapse_unused が True のときは、連続する使われていない
+    アドレスを一行にまとめる
+
+    >>> builder = HTMLBuilder(jobs=4, page_size=1000, collapse_unused=True)
+    >>> builder.render(ip_network, "html")
+    """
+    def __init__(
+        self,
+        jobs: int=1,
+        page_size: int=None,
+        collapse_unused: bool=False
+    ):
         self.template_dir = os.path.join(
             os.path.abspath(os.path.dirname(__file__)),
             "templates"
@@ -26,103 +192,542 @@ class HTMLBuilder:
         self.env = jinja2.Environment(
             loader=jinja2.FileSystemLoader(self.template_dir)
         )
+        # HTML を書くときのバッファの大きさ
+        self.buffer_size = 1 << 16
+        self.jobs = jobs
+        self.page_size = page_size
+        self.collapse_unused = collapse_unused
+        # ファイル名をキー、フィンガープリントを値とする辞書で、
+        # 前回の render のものと今回の render のもの
+        self.previous_manifest = {}
+        self.manifest = {}
+        # ネットワークのページのファイル名をキー、分けたページの
+        # ファイル名のリストを値とする辞書で、前回のものと今回のもの
+        self.previous_pages = {}
+        self.pages = {}
+        # 直前の render で生成したページと生成しなかったページの数
+        self.rebuilt = 0
+        self.skipped = 0
+        # 生成したページを表示するときのディレクトリ
+        self.output_dir = None
+
+    def write_template(
+        self,
+        path: str,
+        template_name: str,
+        **context
+    ):
+        """
+        テンプレートを jinja2 の generate で少しずつ生成しながら
+        バッファつきでファイルに書く
+        """
+        template = self.env.get_template(template_name)
+        with open_atomic(path, self.buffer_size) as f:
+            f.writelines(template.generate(**context))
+
+    def load_manifest(self, html_dir: str):
+        try:
+            with open(os.path.join(html_dir, MANIFEST_FILENAME)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        self.previous_manifest = manifest.get("fingerprints", {})
+        self.previous_pages = manifest.get("pages", {})
+        self.manifest = {}
+        self.pages = {}
+
+    def save_manifest(self, html_dir: str):
+        with open_atomic(os.path.join(html_dir, MANIFEST_FILENAME)) as f:
+            json.dump(
+                {"fingerprints": self.manifest, "pages": self.pages},
+                f,
+                indent=2,
+                sort_keys=True
+            )
+
+    def is_unchanged(
+        self,
+        path: str,
+        fingerprint: str
+    ) -> bool:
+        """
+        path が前回 fingerprint で生成したままかどうか
+        """
+        return self.previous_manifest.get(
+            os.path.basename(path)
+        ) == fingerprint \
+            and os.path.exists(path)
+
+    def _count_page(
+        self,
+        path: str,
+        fingerprint: str,
+        rebuilt: bool
+    ):
+        self.manifest[os.path.basename(path)] = fingerprint
+        if rebuilt:
+            self.rebuilt += 1
+            print("making {} ... done".format(os.path.join(
+                self.output_dir or os.path.dirname(path),
+                os.path.basename(path)
+            )))
+        else:
+            self.skipped += 1
+
+    def _update_pages(
+        self,
+        html_path: str,
+        html_dir: str,
+        pages: [str]=None
+    ):
+        """
+        ネットワークのページを分けたページのファイル名 pages を記録し、
+        前回は生成したが今回は生成しなかったページを消す
+
+        pages が None ならページを生成しなおしていないので、
+        前回のものをそのまま記録する
+        """
+        name = os.path.basename(html_path)
+        if pages is None:
+            pages = self.previous_pages.get(name, [])
+        else:
+            for page_name in set(
+                    self.previous_pages.get(name, [])
+            ).difference(pages):
+                page_path = os.path.join(html_dir, page_name)
+                if os.path.exists(page_path):
+                    os.remove(page_path)
+        if pages:
+            self.pages[name] = pages
+
+    def get_template_digest(self, template_name: str) -> str:
+        with open(os.path.join(self.template_dir, template_name), "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def get_network_fingerprint(self, network: Network) -> str:
+        """
+        ネットワークのページの内容を決めるテンプレートと行の
+        フィンガープリントを返す
+        """
+        return hashlib.sha1("{} {} {} {} {}".format(
+            self.get_template_digest('a_ptr_template.html'),
+            self.get_template_digest('a_ptr_pages_template.html'),
+            self.page_size,
+            self.collapse_unused,
+            network.get_fingerprint()
+        ).encode()).hexdigest()
+
+    def get_network_html_path(
+        self,
+        network_address: str,
+        html_dir: str
+    ) -> str:
+        ip_address = network_address.split("/")[0]
+        return os.path.join(html_dir, '{}.html'.format(ip_address))
 
     def render_index_html(
         self,
         ip_network: {str: Network},
-        html_dir: str
+        html_dir: str,
+        results: {str: CheckResult}=None
+    ):
+        """
+        results にネットワークアドレスをキー、CheckResult を値とする辞書を
+        渡すと、チェックせずにその結果を使う
+        """
+        with instrument.stage("render index"):
+            self._render_index_html(ip_network, html_dir, results)
+
+    def _render_index_html(
+        self,
+        ip_network: {str: Network},
+        html_dir: str,
+        results: {str: CheckResult}
     ):
 
         a_duplicated, a_not_found, a_cor_error = [], [], []
         ptr_duplicated, ptr_not_found, ptr_cor_error = [], [], []
 
         for network_address, network in ip_network.items():
-            checker = Checker(network)
+            if results:
+                result = results[network_address]
+            else:
+                result = Checker(network).check()
+
+            a_duplicated.extend(list(result.a_duplicated.items()))
+            a_not_found.extend(result.a_not_found)
+            a_cor_error.extend(list(result.a_cor_error.items()))
 
-            _a_duplicated, _a_not_found, _a_cor_error = checker.check_a2ptr()
-            a_duplicated.extend(list(_a_duplicated.items()))
-            a_not_found.extend(_a_not_found)
-            a_cor_error.extend(list(_a_cor_error.items()))
+            ptr_duplicated.extend(list(result.ptr_duplicated.items()))
+            ptr_not_found.extend(result.ptr_not_found)
+            ptr_cor_error.extend(list(result.ptr_cor_error.items()))
 
-            _ptr_duplicated, _ptr_not_found, _ptr_cor_error = \
-                checker.check_ptr2a()
-            ptr_duplicated.extend(list(_ptr_duplicated.items()))
-            ptr_not_found.extend(_ptr_not_found)
-            ptr_cor_error.extend(list(_ptr_cor_error.items()))
+        # 実行ごとに並び順が変わらないようにする
+        a_duplicated.sort(key=lambda item: item[0])
+        a_not_found.sort(key=lambda record: (record.hostname,
+                                             record.ip_address))
+        a_cor_error.sort(key=lambda item: (item[0].hostname,
+                                           item[0].ip_address))
+        ptr_duplicated.sort(key=lambda item: item[0])
+        ptr_not_found.sort(key=lambda record: (record.ip_address,
+                                               record.hostname))
+        ptr_cor_error.sort(key=lambda item: (item[0].ip_address,
+                                             item[0].hostname))
 
-        # index.html
+        # index.html は小さいので文字列として生成し、
+        # 内容のハッシュが前回と同じなら書かない
         index_path = os.path.join(html_dir, 'index.html')
-        with open(index_path, 'w') as f:
-            template = self.env.get_template(
-                'index_template.html'
+        content = self.env.get_template('index_template.html').render(
+            a_only=a_not_found,
+            ptr_only=ptr_not_found,
+            a_overlaped=[
+                (hostname, sorted(record.ip_address for record in records))
+                for (hostname, records) in a_duplicated
+            ],
+            ptr_overlaped=[
+                (ip_address, sorted(record.hostname for record in records))
+                for (ip_address, records) in ptr_duplicated
+            ],
+            a_ptr_not_same=[
+                (a_record.hostname,
+                 a_record.ip_address,
+                 sorted(ptr_record.hostname for ptr_record in ptr_records)
+                 )
+                for a_record, ptr_records in a_cor_error
+            ],
+            ptr_a_not_same=[
+                (ptr_record.ip_address,
+                 ptr_record.hostname,
+                 sorted(a_record.ip_address for a_record in a_records)
+                 )
+                for ptr_record, a_records in ptr_cor_error
+            ],
+            html_name_addresses=[
+                (network_address.split("/")[0], network_address)
+                for network_address in ip_network.keys()
+            ]
+        )
+        fingerprint = hashlib.sha1(content.encode()).hexdigest()
+        rebuilt = not self.is_unchanged(index_path, fingerprint)
+        if rebuilt:
+            with open_atomic(index_path) as f:
+                f.write(content)
+        self._count_page(index_path, fingerprint, rebuilt)
+
+    def render_network_html(
+        self,
+        network_address: str,
+        network: Network,
+        html_dir: str
+    ) -> [str]:
+        """
+        ネットワークのページを生成し、ページに分けたときは
+        分けたページのファイル名のリストを返す
+        """
+        with instrument.stage("render page"):
+            return self._render_network_html(
+                network_address, network, html_dir
+            )
+
+    def _render_network_html(
+        self,
+        network_address: str,
+        network: Network,
+        html_dir: str
+    ) -> [str]:
+        html_path = self.get_network_html_path(network_address, html_dir)
+
+        # 行を network から一行ずつ読み、生成した HTML もその場で
+        # ファイルに書くので、ネットワークの大きさによらず
+        # メモリを使わない
+        rows = instrument.count_iter(
+            "rows rendered",
+            network.iter_rows(collapse_unused=self.collapse_unused)
+        )
+        if not self.page_size:
+            self.write_template(
+                html_path,
+                'a_ptr_template.html',
+                records=rows
             )
-            html = template.render(
-                a_only=a_not_found,
-                ptr_only=ptr_not_found,
-                a_overlaped=[
-                    (hostname, [record.ip_address for record in records])
-                    for (hostname, records) in a_duplicated
-                ],
-                ptr_overlaped=[
-                    (ip_address, [record.hostname for record in records])
-                    for (ip_address, records) in ptr_duplicated
-                ],
-                a_ptr_not_same=[
-                    (a_record.hostname,
-                     a_record.ip_address,
-                     [ptr_record.hostname for ptr_record in ptr_records]
-                     )
-                    for a_record, ptr_records in a_cor_error
-                ],
-                ptr_a_not_same=[
-                    (ptr_record.ip_address,
-                     ptr_record.hostname,
-                     [a_record.ip_address for a_record in a_records]
-                     )
-                    for ptr_record, a_records in ptr_cor_error
-                ],
-                html_name_addresses=[
-                    (network_address.split("/")[0], network_address)
-                    for network_address in ip_network.keys()
-                ]
+            return []
+
+        # ページに分けるときは、一度に page_size 行の 2 ページ分だけを
+        # メモリに持つ
+        base_name = os.path.splitext(os.path.basename(html_path))[0]
+        index_name = os.path.basename(html_path)
+        pages = []
+        for page_rows, has_next in _iter_pages(rows, self.page_size):
+            number = len(pages) + 1
+            page_name = "{}-{}.html".format(base_name, number)
+            self.write_template(
+                os.path.join(html_dir, page_name),
+                'a_ptr_template.html',
+                records=page_rows,
+                page={
+                    "index": index_name,
+                    "previous": "{}-{}.html".format(base_name, number - 1)
+                    if number > 1 else None,
+                    "next": "{}-{}.html".format(base_name, number + 1)
+                    if has_next else None,
+                }
             )
-            f.write(html)
-            print("making {} ... done".format(index_path))
+            last_row = page_rows[-1]
+            pages.append((
+                page_name,
+                page_rows[0][0],
+                last_row.last if isinstance(last_row, UnusedRange)
+                else last_row[0]
+            ))
+
+        self.write_template(
+            html_path,
+            'a_ptr_pages_template.html',
+            network_address=network_address,
+            pages=pages
+        )
+        return [page_name for page_name, _, _ in pages]
 
     def render_ip_host_html(
         self,
         ip_network: {str: Network},
         html_dir: str
     ):
+        """
+        フィンガープリントが前回と同じページは生成しない
+        """
         for network_address, network in ip_network.items():
-            ip_address = network_address.split("/")[0]
-            html_path = os.path.join(html_dir, '{}.html'.format(ip_address))
+            html_path = self.get_network_html_path(network_address, html_dir)
+            fingerprint = self.get_network_fingerprint(network)
+            rebuilt = not self.is_unchanged(html_path, fingerprint)
+            pages = None
+            if rebuilt:
+                pages = self.render_network_html(
+                    network_address, network, html_dir
+                )
+            self._update_pages(html_path, html_dir, pages)
+            self._count_page(html_path, fingerprint, rebuilt)
+
+    def render_parallel(
+        self,
+        ip_network: {str: Network},
+        html_dir: str,
+        results: {str: CheckResult}=None
+    ) -> {str: CheckResult}:
+        """
+        ネットワークごとのページの生成とチェックをプロセスプールで
+        並列に行い、ネットワークアドレスをキーとする CheckResult の
+        辞書を返す
 
-            with open(html_path, 'w') as f:
-                template = self.env.get_template(
-                    'a_ptr_template.html'
+        results に結果があるネットワークはチェックせず、さらに
+        フィンガープリントが前回と同じならプロセスに渡さない
+        """
+        checked_results = {}
+        with ProcessPoolExecutor(
+                max_workers=self.jobs,
+                initializer=_init_worker,
+                initargs=(
+                    self.page_size,
+                    self.collapse_unused,
+                    instrument.enabled
                 )
-                html = template.render(
-                    records=list(network)
+        ) as executor:
+            futures = []
+            for network_address, network in ip_network.items():
+                html_path = self.get_network_html_path(
+                    network_address, html_dir
                 )
-                f.write(html)
-                print("making {} ... done".format(html_path))
+                fingerprint = self.get_network_fingerprint(network)
+                rebuilt = not self.is_unchanged(html_path, fingerprint)
+                result = results[network_address] if results else None
+                if rebuilt or result is None:
+                    futures.append((
+                        network_address, html_path, fingerprint, rebuilt,
+                        executor.submit(
+                            _render_network_page,
+                            network_address,
+                            network,
+                            html_dir,
+                            result,
+                            rebuilt
+                        )
+                    ))
+                else:
+                    checked_results[network_address] = result
+                    self._update_pages(html_path, html_dir)
+                    self._count_page(html_path, fingerprint, False)
+            for network_address, html_path, fingerprint, rebuilt, future \
+                    in futures:
+                pages, checked_results[network_address], report = \
+                    future.result()
+                instrument.merge(report)
+                self._update_pages(html_path, html_dir, pages)
+                self._count_page(html_path, fingerprint, rebuilt)
+        return checked_results
+
+    def copy_static(
+        self,
+        filename: str,
+        html_dir: str
+    ):
+        """
+        テンプレートの static 以下のファイルを、内容が異なるときだけ
+        html_dir にコピーする
+        """
+        source = os.path.join(self.template_dir, "static", filename)
+        destination = os.path.join(html_dir, filename)
+        if os.path.exists(destination) and \
+                filecmp.cmp(source, destination, shallow=False):
+            self.skipped += 1
+            return
+        shutil.copy(source, destination)
+        self.rebuilt += 1
 
     def render(
         self,
         ip_network,
-        html_dir: str
+        html_dir: str,
+        results: {str: CheckResult}=None
+    ):
+        """
+        html_dir に全てのページを生成する。html_dir は最後に一度に
+        入れかわる
+        """
+        self.output_dir = os.path.abspath(html_dir)
+        try:
+            with staging_dir(html_dir) as staging:
+                self._render(ip_network, staging, results)
+        finally:
+            self.output_dir = None
+        print("{} files rebuilt, {} files skipped".format(
+            self.rebuilt, self.skipped
+        ))
+
+    def _render(
+        self,
+        ip_network,
+        html_dir: str,
+        results: {str: CheckResult}
     ):
+        self.load_manifest(html_dir)
+        self.rebuilt = 0
+        self.skipped = 0
+
         # create HTML files
-        self.render_index_html(ip_network, html_dir)
-        self.render_ip_host_html(ip_network, html_dir)
+        if self.jobs > 1:
+            # ネットワークごとのページを並列に生成し、
+            # そのときのチェック結果で index.html を生成する
+            results = self.render_parallel(ip_network, html_dir, results)
+            self.render_index_html(ip_network, html_dir, results)
+        else:
+            self.render_index_html(ip_network, html_dir, results)
+            self.render_ip_host_html(ip_network, html_dir)
 
         # copy CSS files to html_dir
-        shutil.copy(
-            os.path.join(self.template_dir, "static/a_ptr.css"),
-            html_dir
+        self.copy_static("a_ptr.css", html_dir)
+        self.copy_static("index.css", html_dir)
+
+        self.save_manifest(html_dir)
+
+
+def test_html_builder():
+    import tempfile
+    from record import ARecord, PTRRecord
+
+    network = Network("192.168.0.0/28")
+    network.add_record(ARecord("chino", "192.168.0.1"))
+    network.add_record(ARecord("cocoa", "192.168.0.2"))
+    network.add_record(PTRRecord("chino", "192.168.0.1"))
+    network.add_record(PTRRecord("rize", "192.168.0.3"))
+    ip_network = {"192.168.0.0/28": network}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        serial_dir = os.path.join(tmpdir, "serial")
+        parallel_dir = os.path.join(tmpdir, "parallel")
+        for html_dir, jobs in [(serial_dir, 1), (parallel_dir, 2)]:
+            os.mkdir(html_dir)
+            HTMLBuilder(jobs=jobs).render(ip_network, html_dir)
+        for filename in ["index.html", "192.168.0.0.html"]:
+            assert filecmp.cmp(
+                os.path.join(serial_dir, filename),
+                os.path.join(parallel_dir, filename),
+                shallow=False
+            )
+        # 一時ファイルは残らない
+        assert sorted(os.listdir(parallel_dir)) == sorted(
+            os.listdir(serial_dir)
         )
-        shutil.copy(
-            os.path.join(self.template_dir, "static/index.css"),
-            html_dir
+
+        # 変更がなければ何も書かない
+        builder = HTMLBuilder()
+        builder.render(ip_network, serial_dir)
+        assert (builder.rebuilt, builder.skipped) == (0, 4)
+
+        network.add_record(PTRRecord("cocoa", "192.168.0.2"))
+        inode = os.stat(os.path.join(serial_dir, "a_ptr.css")).st_ino
+        with open(os.path.join(serial_dir, "index.html")) as f:
+            index = f.read()
+
+        # 途中で失敗したときは前回の内容が残り、作業用のディレクトリも
+        # 残らない
+        def fail(*args):
+            raise RuntimeError
+        builder.render_network_html = fail
+        try:
+            builder.render(ip_network, serial_dir)
+            assert False
+        except RuntimeError:
+            pass
+        with open(os.path.join(serial_dir, "index.html")) as f:
+            assert f.read() == index
+        assert sorted(os.listdir(tmpdir)) == ["parallel", "serial"]
+
+        builder = HTMLBuilder()
+        builder.render(ip_network, serial_dir)
+        assert (builder.rebuilt, builder.skipped) == (2, 2)
+        # 変わらなかったファイルは前回のファイルのまま
+        assert os.stat(os.path.join(serial_dir, "a_ptr.css")).st_ino == inode
+
+        # 5 行ずつのページに分ける
+        paged_dir = os.path.join(tmpdir, "paged")
+        os.mkdir(paged_dir)
+        HTMLBuilder(jobs=2, page_size=5).render(ip_network, paged_dir)
+        assert sorted(os.listdir(paged_dir)) == [
+            ".manifest.json",
+            "192.168.0.0-1.html",
+            "192.168.0.0-2.html",
+            "192.168.0.0-3.html",
+            "192.168.0.0.html",
+            "a_ptr.css",
+            "index.css",
+            "index.html",
+        ]
+        with open(os.path.join(paged_dir, "192.168.0.0-3.html")) as f:
+            page = f.read()
+        assert "192.168.0.14" in page and "192.168.0.0-2.html" in page
+        assert "192.168.0.0-4.html" not in page
+
+        # 使われていないアドレスをまとめると 1 ページになり、
+        # 余ったページは消える
+        HTMLBuilder(page_size=5, collapse_unused=True).render(
+            ip_network, paged_dir
         )
+        assert not os.path.exists(
+            os.path.join(paged_dir, "192.168.0.0-2.html")
+        )
+        with open(os.path.join(paged_dir, "192.168.0.0-1.html")) as f:
+            assert "192.168.0.4 – 192.168.0.14 unused (11)" in f.read()
+        with open(os.path.join(paged_dir, ".manifest.json")) as f:
+            assert json.load(f)["pages"] == {
+                "192.168.0.0.html": ["192.168.0.0-1.html"]
+            }
+
+        # ページに分けなくなると分けたページは全て消える
+        HTMLBuilder(jobs=2).render(ip_network, paged_dir)
+        assert sorted(os.listdir(paged_dir)) == [
+            ".manifest.json",
+            "192.168.0.0.html",
+            "a_ptr.css",
+            "index.css",
+            "index.html",
+        ]
@@ -0,0 +1,284 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+
+"""
+This module records time and counters of each stage of dnschecker.
+
+:copyright: (c) 2015 by the KUSM Admin Team
+:license: MIT, see LICENSE for more details.
+"""
+
+import cProfile
+import json
+import time
+from contextlib import contextmanager
+
+
+# 計測するかどうか。False のときは stage, count などは何もしない
+enabled = False
+
+# 段階の名前をキー、
+#    [呼ばれた回数, 経過時間, CPU 時間, 経過時間, CPU 時間]
+# を値とする辞書。後ろの二つは中で呼んだ段階の時間を除いたもの
+_stages = {}
+
+# カウンタの名前をキー、値を値とする辞書
+_counters = {}
+
+# 実行中の段階ごとの、中で呼んだ段階の [経過時間, CPU 時間]
+_stack = []
+
+
+def set_enabled(value: bool) -> None:
+    """
+    計測するかどうかを設定する
+
+    ProcessPoolExecutor の initializer にも使う
+    """
+    global enabled
+    enabled = value
+
+
+def reset() -> None:
+    """
+    これまでの計測結果を捨てる
+    """
+    _stages.clear()
+    _counters.clear()
+    del _stack[:]
+
+
+def _start() -> (float, float):
+    _stack.append([0.0, 0.0])
+    return time.perf_counter(), time.process_time()
+
+
+def _finish(
+    name: str,
+    start: (float, float)
+) -> None:
+    wall = time.perf_counter() - start[0]
+    cpu = time.process_time() - start[1]
+    child_wall, child_cpu = _stack.pop()
+    if _stack:
+        _stack[-1][0] += wall
+        _stack[-1][1] += cpu
+    values = _stages.setdefault(name, [0, 0.0, 0.0, 0.0, 0.0])
+    values[0] += 1
+    values[1] += wall
+    values[2] += cpu
+    values[3] += wall - child_wall
+    values[4] += cpu - child_cpu
+
+
+@contextmanager
+def stage(name: str):
+    """
+    with ブロックの経過時間と CPU 時間を name の段階として記録する
+
+    >>> with stage("check"):
+    ...     checker.check()
+    """
+    if not enabled:
+        yield
+        return
+    start = _start()
+    try:
+        yield
+    finally:
+        _finish(name, start)
+
+
+def timed_iter(
+    name: str,
+    iterable
+):
+    """
+    iterable から要素をとりだすのにかかった時間を name の段階として
+    記録するイテレータを返す
+
+    レコードを解析しながら追加するときに、解析の時間だけを
+    とりだすのに使う
+    """
+    if not enabled:
+        return iterable
+    return _timed_iter(name, iter(iterable))
+
+
+def _timed_iter(
+    name: str,
+    iterator
+):
+    while True:
+        start = _start()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            _finish(name, start)
+            return
+        _finish(name, start)
+        yield item
+
+
+def count(
+    name: str,
+    n: int=1
+) -> None:
+    """
+    name のカウンタを n 増やす
+    """
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def count_iter(
+    name: str,
+    iterable
+):
+    """
+    iterable の要素の数を name のカウンタに足すイテレータを返す
+    """
+    if not enabled:
+        return iterable
+    return _count_iter(name, iterable)
+
+
+def _count_iter(
+    name: str,
+    iterable
+):
+    n = 0
+    try:
+        for item in iterable:
+            n += 1
+            yield item
+    finally:
+        count(name, n)
+
+
+def get_report() -> dict:
+    """
+    計測結果を
+
+        {"stages": {"parse": {"calls": 3, "wall": 1.2, "cpu": 1.1,
+                              "self_wall": 1.2, "self_cpu": 1.1}, ...},
+         "counters": {"lines parsed": 10000, ...}}
+
+    の形で返す。self_wall, self_cpu は中で呼んだ段階の時間を除いたもの
+    """
+    return {
+        "stages": {
+            name: {
+                "calls": calls,
+                "wall": wall,
+                "cpu": cpu,
+                "self_wall": self_wall,
+                "self_cpu": self_cpu,
+            }
+            for name, (calls, wall, cpu, self_wall, self_cpu)
+            in _stages.items()
+        },
+        "counters": dict(_counters),
+    }
+
+
+def merge(report: dict) -> None:
+    """
+    ワーカープロセスの get_report() の結果を足しあわせる
+
+    ワーカーの時間は中で呼んだ段階として親の段階には足さない
+    """
+    for name, values in report["stages"].items():
+        total = _stages.setdefault(name, [0, 0.0, 0.0, 0.0, 0.0])
+        for i, key in enumerate(
+                ["calls", "wall", "cpu", "self_wall", "self_cpu"]
+        ):
+            total[i] += values[key]
+    for name, value in report["counters"].items():
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def format_report(report: dict) -> str:
+    """
+    get_report() の結果を表にする
+    """
+    lines = ["{:<32} {:>8} {:>10} {:>10} {:>10}".format(
+        "stage", "calls", "wall [s]", "cpu [s]", "self [s]"
+    )]
+    for name, values in sorted(
+            report["stages"].items(),
+            key=lambda item: -item[1]["wall"]
+    ):
+        lines.append("{:<32} {:>8} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            name, values["calls"], values["wall"], values["cpu"],
+            values["self_wall"]
+        ))
+    lines.append("")
+    lines.append("{:<32} {:>8}".format("counter", "value"))
+    for name, value in sorted(report["counters"].items()):
+        lines.append("{:<32} {:>8}".format(name, value))
+    return "\n".join(lines) + "\n"
+
+
+def write_report(
+    filename: str,
+    output_format: str="text"
+) -> None:
+    """
+    計測結果を filename に output_format ("json" か "text") の形で書く
+    """
+    report = get_report()
+    with open(filename, "w") as f:
+        if output_format == "json":
+            json.dump(report, f, indent=2, sort_keys=True)
+        else:
+            f.write(format_report(report))
+
+
+@contextmanager
+def profile(filename: str):
+    """
+    with ブロックを cProfile で計測し、pstats で読める形で filename に書く
+
+    >>> with profile("dnschecker.pstats"):
+    ...     main()
+    $ python -m pstats dnschecker.pstats
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filename)
+
+
+def test_instrument():
+    set_enabled(True)
+    reset()
+    try:
+        with stage("outer"):
+            with stage("inner"):
+                count("rows", 2)
+            assert list(timed_iter("items", range(3))) == [0, 1, 2]
+        assert list(count_iter("rows", "abc")) == ["a", "b", "c"]
+
+        report = get_report()
+        assert report["stages"]["outer"]["calls"] == 1
+        assert report["stages"]["inner"]["calls"] == 1
+        assert report["stages"]["items"]["calls"] == 4
+        outer = report["stages"]["outer"]
+        assert outer["self_wall"] <= outer["wall"]
+        assert report["counters"] == {"rows": 5}
+
+        merge(report)
+        assert get_report()["counters"] == {"rows": 10}
+        assert "outer" in format_report(get_report())
+    finally:
+        reset()
+        set_enabled(False)
+
+    with stage("disabled"):
+        count("disabled")
+    assert get_report() == {"stages": {}, "counters": {}}
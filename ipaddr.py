@@ -1,6 +1,18 @@
 #! /usr/bin/env python
 # coding:utf-8
 
+import socket
+import struct
+import sys
+from array import array
+from functools import partial
+
+
+# 32 ビットの符号なし整数の array の型コード
+_UINT32_TYPECODE = "I" if array("I").itemsize == 4 else "L"
+
+_inet_pton4 = partial(socket.inet_pton, socket.AF_INET)
+
 
 def convert_ip_str2int(
     ip_address: str
@@ -35,19 +47,128 @@ def test_convert_ip():
         )
 
 
+def convert_ip_str2int_array(
+    ip_addresses: [str]
+) -> array:
+    """
+    IP アドレスの文字列のリストをまとめて 32 ビットの整数の array にする
+
+    一つずつ convert_ip_str2int するよりも数倍速い。
+    IPv4 アドレスでない文字列があれば ValueError をだす
+
+    >>> convert_ip_str2int_array(["192.168.0.1", "10.0.0.1"])
+    array('I', [3232235521, 167772161])
+    """
+    int_ip_addresses = array(_UINT32_TYPECODE)
+    try:
+        int_ip_addresses.frombytes(b"".join(map(_inet_pton4, ip_addresses)))
+    except (OSError, TypeError):
+        for ip_address in ip_addresses:
+            try:
+                _inet_pton4(ip_address)
+            except (OSError, TypeError):
+                raise ValueError(
+                    "{} is not an IPv4 address".format(ip_address)
+                )
+        raise
+    # inet_pton はネットワークバイトオーダー (ビッグエンディアン)
+    if sys.byteorder == "little":
+        int_ip_addresses.byteswap()
+    return int_ip_addresses
+
+
+def convert_ip_int2str_list(
+    int_ip_addresses: [int]
+) -> [str]:
+    """
+    整数のリストか array をまとめて IP アドレスの文字列のリストにする
+
+    >>> convert_ip_int2str_list([3232235521, 167772161])
+    ['192.168.0.1', '10.0.0.1']
+    """
+    try:
+        packed = array(_UINT32_TYPECODE, int_ip_addresses)
+    except OverflowError:
+        raise ValueError("address is out of IPv4 range")
+    if sys.byteorder == "little":
+        packed.byteswap()
+    return [
+        socket.inet_ntoa(octets)
+        for octets, in struct.iter_unpack("4s", packed.tobytes())
+    ]
+
+
+class AddressRange:
+    """
+    連続する IP アドレスの文字列の列
+
+    range と同じように長さ、添字、スライス、in が使えるが、
+    要素は読むたびに文字列にするので、/8 のような大きな
+    ネットワークでもメモリを使わない
+
+    >>> hosts = AddressRange(range(3232235521, 3232235775))
+    >>> len(hosts), hosts[0], hosts[-1]
+    (254, '192.168.0.1', '192.168.0.254')
+    """
+    __slots__ = ("int_range",)
+
+    def __init__(self, int_range: range):
+        self.int_range = int_range
+
+    def __len__(self):
+        return len(self.int_range)
+
+    def __iter__(self):
+        return map(convert_ip_int2str, self.int_range)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return AddressRange(self.int_range[index])
+        return convert_ip_int2str(self.int_range[index])
+
+    def __contains__(self, ip_address: str):
+        try:
+            return convert_ip_str2int(ip_address) in self.int_range
+        except ValueError:
+            return False
+
+    def __eq__(self, other):
+        if isinstance(other, AddressRange):
+            return self.int_range == other.int_range
+        return list(self) == other
+
+    def __repr__(self):
+        return "AddressRange({!r})".format(self.int_range)
+
+
 class IPAddress:
+    version = 4
+
     def __init__(self, ip_address: str):
-        self.ip_address = ip_address
-        self.int_ip_address = convert_ip_str2int(ip_address)
+        if isinstance(ip_address, int):
+            # ipaddress.ip_address と同様に整数からも生成できるようにする
+            self.int_ip_address = ip_address
+            self.ip_address = convert_ip_int2str(ip_address)
+        else:
+            self.ip_address = ip_address
+            self.int_ip_address = convert_ip_str2int(ip_address)
+
+    def __int__(self):
+        return self.int_ip_address
 
     def __str__(self):
         return "{}".format(self.ip_address)
 
 
 class IPNetwork:
+    version = 4
+    max_prefixlen = 32
+
     def __init__(self, network_address: str):
         _ip_address, _cidr = network_address.split("/")
         self.cidr = int(_cidr)
+        self.prefixlen = self.cidr
+        self.num_addresses = 1 << (32 - self.cidr)
         self.shift_val = 32 - self.cidr
         self._ip_address = _ip_address
         self._int_ip_address = convert_ip_str2int(_ip_address)
@@ -77,13 +198,35 @@ class IPNetwork:
         )
 
     def get_number_of_hosts(self):
-        return sum(1 << i for i in range(self.shift_val))
+        return (1 << self.shift_val) - 1
 
     def hosts(self):
-        return [
-            convert_ip_int2str(int_host + self.int_network_address)
-            for int_host in range(self.get_number_of_hosts())
-        ][1:]
+        """
+        ネットワークアドレスとブロードキャストアドレスを除いたアドレスの
+        文字列の列を AddressRange として返す
+        """
+        return AddressRange(range(
+            self.int_network_address + 1,
+            self.int_network_address + self.get_number_of_hosts()
+        ))
+
+    def contains_int_addresses(
+        self,
+        int_ip_addresses: [int]
+    ) -> [bool]:
+        """
+        整数のリストか array の各アドレスがこのネットワークに
+        はいっているかを表す bool のリストを返す
+
+        IPAddress を作らずに整数の比較だけで調べる
+
+        >>> network = ip_network("192.168.0.0/24")
+        >>> network.contains_int_addresses([3232235521, 167772161])
+        [True, False]
+        """
+        first = self.int_network_address
+        last = first + self.num_addresses - 1
+        return [first <= address <= last for address in int_ip_addresses]
 
 
 def ip_network(
@@ -98,5 +241,59 @@ def ip_address(
     return IPAddress(ip_address)
 
 
+def test_bulk_convert_ip():
+    ip_addresses = [
+        "192.168.0.1",
+        "0.0.0.0",
+        "255.255.255.255",
+        "10.226.140.3",
+    ]
+    int_ip_addresses = convert_ip_str2int_array(ip_addresses)
+    assert list(int_ip_addresses) == [
+        convert_ip_str2int(ip_address) for ip_address in ip_addresses
+    ]
+    assert convert_ip_int2str_list(int_ip_addresses) == ip_addresses
+    assert convert_ip_int2str_list([]) == []
+    for invalid in [["192.168.0.256"], ["192.168.0.1", "host1"]]:
+        try:
+            convert_ip_str2int_array(invalid)
+            assert False
+        except ValueError:
+            pass
+    try:
+        convert_ip_int2str_list([1 << 32])
+        assert False
+    except ValueError:
+        pass
+
+
+def test_ip_network_hosts():
+    for network_address in ["192.168.0.0/24", "10.0.0.0/30",
+                            "10.0.0.0/31", "10.0.0.1/32"]:
+        network = ip_network(network_address)
+        hosts = [
+            convert_ip_int2str(int_host + network.int_network_address)
+            for int_host in range(network.get_number_of_hosts())
+        ][1:]
+        assert network.get_number_of_hosts() == \
+            sum(1 << i for i in range(network.shift_val))
+        assert network.hosts() == hosts
+        assert len(network.hosts()) == len(hosts)
+
+    hosts = ip_network("10.0.0.0/8").hosts()
+    assert len(hosts) == (1 << 24) - 2
+    assert hosts[0] == "10.0.0.1"
+    assert hosts[-1] == "10.255.255.254"
+    assert hosts[1:3] == ["10.0.0.2", "10.0.0.3"]
+    assert "10.1.2.3" in hosts
+    assert "10.0.0.0" not in hosts
+    assert "host1" not in hosts
+
+    network = ip_network("192.168.0.0/24")
+    assert network.contains_int_addresses(
+        convert_ip_str2int_array(["192.168.0.1", "192.168.1.0", "10.0.0.1"])
+    ) == [True, False, False]
+
+
 if __name__ == '__main__':
     pass
@@ -10,10 +10,15 @@ This module provides Network class.
 """
 
 
+from bisect import bisect_right, insort
+from collections import namedtuple
+import hashlib
 try:
     import ipaddress
 except ImportError:
     import ipaddr as ipaddress
+from address import parse_address, to_address_string, is_ip_address
+import instrument
 from record import DNSRecord, ARecord, PTRRecord, RecordInfo
 
 
@@ -21,6 +26,10 @@ class NetworkRangeError(Exception):
     pass
 
 
+# 連続する使われていないアドレスをまとめた行
+UnusedRange = namedtuple("UnusedRange", ["first", "last", "size"])
+
+
 class Network:
     """
     192.168.0.0/24 のような一つのネットワークをあらわす
@@ -29,7 +38,7 @@ class Network:
         self,
         network_address: str
     ):
-        self.network_address = ipaddress.ip_network(network_address)
+        self._init_network_address(network_address)
 
         # A レコード用のディクショナリで
         #    {"host1": {record1, record2}, "host2": {record3}, ...}
@@ -43,13 +52,29 @@ class Network:
 
         self.record_info = {}
 
+    def _init_network_address(
+        self,
+        network_address: str
+    ):
+        self.network_address = ipaddress.ip_network(network_address)
+
+        # ネットワークの先頭と末尾のアドレスを整数で持っておく
+        self.version = self.network_address.version
+        self.first_address = int(self.network_address[0])
+        self.last_address = \
+            self.first_address + self.network_address.num_addresses - 1
+
     def add_record(
         self,
-        record: DNSRecord
+        record: DNSRecord,
+        check_range: bool=True
     ):
         """
         レコードを追加する
 
+        check_range が False のときは、レコードがこのネットワークに
+        はいっているかのチェックを省略する (NetworkRouter から呼ぶ場合)
+
         >>> host1 = ARecord(
         ... ip_address='192.168.0.1',
         ...     hostname='host1'
@@ -62,7 +87,8 @@ class Network:
 
         # レコードの IP アドレスがこのネットワークにはいっていない場合
         # NetworkRangeError をだす
-        if ipaddress.ip_address(record.ip_address) not in self.network_address:
+        if check_range and not self.contains_address(ip_address):
+            instrument.count("network range errors")
             raise NetworkRangeError("{} not in {}".format(
                 ip_address, self.network_address
             ))
@@ -85,13 +111,14 @@ class Network:
 
     def add_record_info(
         self,
-        record_info: RecordInfo
+        record_info: RecordInfo,
+        check_range: bool=True
     ):
         ip_address = record_info.ip_address
         # レコードの IP アドレスがこのネットワークにはいっていない場合
         # NetworkRangeError をだす
-        if ipaddress.ip_address(record_info.ip_address) \
-                not in self.network_address:
+        if check_range and not self.contains_address(ip_address):
+            instrument.count("network range errors")
             raise NetworkRangeError("{} not in {}".format(
                 ip_address, self.network_address
             ))
@@ -101,39 +128,223 @@ class Network:
         else:
             self.record_info[ip_address] = {record_info}
 
+    def contains_address(self, ip_address: str) -> bool:
+        """
+        ip_address がこのネットワークにはいっているかチェックする
+        """
+        version, address = parse_address(ip_address)
+        return version == self.version and \
+            self.first_address <= address <= self.last_address
+
     def is_ipaddress(self, name: str):
         """
         name が IP アドレスかどうかチェックする
         """
-        try:
-            ipaddress.ip_address(name)
-            return True
-        except ValueError:
-            return False
+        return is_ip_address(name)
 
     def __getitem__(self, key: str):
+        """
+        key が IP アドレスならば PTR レコードの集合を、
+        ホスト名ならば A レコードの集合を返す
+        """
         if self.is_ipaddress(key):
             return self.ptr_record[key]
         else:
-            self.hostname_ip[key]
+            return self.a_record[key]
 
     def __contains__(self, key: str):
         if self.is_ipaddress(key):
-            return key in self.ip_hostname
+            return key in self.ptr_record
         else:
-            return key in self.hostname_ip
+            return key in self.a_record
 
-    def _pop_record_info(
+    def _index_record_infos(
         self,
-        record_infos: {RecordInfo},
-        hostname: str,
+        record_infos: {RecordInfo}
+    ) -> {str: [RecordInfo]}:
+        """
+        ホスト名をキー、そのホスト名のレコード情報のリストを値とする
+        索引を返す
+        """
+        index = {}
+        for record_info in record_infos:
+            if record_info.hostname in index:
+                index[record_info.hostname].append(record_info)
+            else:
+                index[record_info.hostname] = [record_info]
+        return index
+
+    def _host_range(self) -> (int, int):
+        """
+        self.network_address.hosts() が返すアドレスの範囲を
+        (先頭, 末尾) の整数の組で返す
+        """
+        if self.network_address.num_addresses <= 2:
+            # /31, /32 (IPv6 では /127, /128) は全てのアドレスがホスト
+            return self.first_address, self.last_address
+        elif self.version == 4:
+            # ネットワークアドレスとブロードキャストアドレスを除く
+            return self.first_address + 1, self.last_address - 1
+        else:
+            # IPv6 では Subnet-Router anycast アドレスだけを除く
+            return self.first_address + 1, self.last_address
+
+    def get_a_hostnames(self) -> {str: {str}}:
+        """
+        IP アドレスをキー、A レコードのホスト名の集合を値とする辞書を返す
+        """
+        a_ip_hostname = {}
+        for records in self.a_record.values():
+            for record in records:
+                if record.ip_address in a_ip_hostname:
+                    a_ip_hostname[record.ip_address].add(record.hostname)
+                else:
+                    a_ip_hostname[record.ip_address] = {record.hostname}
+        return a_ip_hostname
+
+    def _iter_ip_addresses(self, a_ip_hostname: {str: {str}}):
+        """
+        レコードがある IP アドレスをアドレス順に生成する
+        """
+        ip_addresses = set(a_ip_hostname)
+        ip_addresses.update(self.ptr_record)
+        ip_addresses.update(self.record_info)
+        return iter(sorted(ip_addresses, key=parse_address))
+
+    def _address_records(self):
+        """
+        レコードがあるアドレスについて
+
+            (ip_address, A レコードのホスト名の集合,
+             PTR レコードのホスト名の集合, レコード情報の集合)
+
+        をアドレス順に生成する
+        """
+        a_ip_hostname = self.get_a_hostnames()
+        for ip in self._iter_ip_addresses(a_ip_hostname):
+            yield (
+                ip,
+                a_ip_hostname.get(ip, set()),
+                set(record.hostname for record in self.ptr_record.get(ip, [])),
+                self.record_info.get(ip, set())
+            )
+
+    def _iter_unused(
+        self,
+        first: int,
+        last: int,
+        collapse_unused: bool
+    ):
+        """
+        first から last までの使われていないアドレスの行を生成する
+        """
+        if first > last:
+            return
+        if collapse_unused and first < last:
+            yield UnusedRange(
+                to_address_string(self.version, first),
+                to_address_string(self.version, last),
+                last - first + 1
+            )
+            return
+        for ip_address in range(first, last + 1):
+            yield (to_address_string(self.version, ip_address), None, None,
+                   None, None, None, None)
+
+    def _iter_address_rows(
+        self,
+        ip: str,
+        a_set: {str},
+        ptr_set: {str},
+        record_infos: {RecordInfo}
     ):
+        """
+        ひとつのアドレスの行を生成する
+
+        レコード情報はホスト名の索引を一度だけ作って対応させるので、
+        ひとつのアドレスに多くのホスト名やレコード情報があっても
+        時間はその数に比例する
+        """
+        a_and_ptr = a_set.intersection(ptr_set)
+        only_a = a_set - ptr_set
+        only_ptr = ptr_set - a_set
+
+        record_info_index = self._index_record_infos(record_infos)
+        # A, PTR レコードの行に対応させたレコード情報
+        joined = set()
+        for hostnames, has_a, has_ptr in [
+                (a_and_ptr, True, True),
+                (only_a, True, False),
+                (only_ptr, False, True),
+        ]:
+            for hostname in sorted(hostnames):
+                # ホスト名はアドレスごとに一度しかでてこないので、
+                # 同じホスト名のレコード情報は先頭のものだけを対応させる
+                record_info = record_info_index.get(hostname, [None])[0]
+                a_hostname = hostname if has_a else None
+                ptr_hostname = hostname if has_ptr else None
+                if record_info:
+                    joined.add(record_info)
+                    yield (ip, a_hostname, ptr_hostname,
+                           record_info.hostname,
+                           record_info.classname,
+                           record_info.room,
+                           record_info.comment
+                           )
+                else:
+                    yield (ip, a_hostname, ptr_hostname,
+                           None, None, None, None)
+
         for record_info in record_infos:
-            if record_info.hostname == hostname:
-                return record_info, record_infos - {record_info}
-        return None, record_infos
+            if record_info in joined:
+                continue
+            yield (ip, None, None,
+                   record_info.hostname,
+                   record_info.classname,
+                   record_info.room,
+                   record_info.comment
+                   )
+
+    def get_rows(
+        self,
+        ip_address: str,
+        a_ip_hostname: {str: {str}}=None
+    ) -> list:
+        """
+        iter_rows() が生成する行のうち ip_address の行のリストを返す
 
-    def __iter__(self):
+        a_ip_hostname に get_a_hostnames() の結果を渡しておくと、
+        A レコードを全て調べずにすむ
+
+        >>> network.get_rows("192.168.0.4")
+        [('192.168.0.4', 'rize', 'rize', None, None, None, None),
+         ('192.168.0.4', 'syaro', 'syaro', None, None, None, None)]
+        """
+        first_host, last_host = self._host_range()
+        _, address = parse_address(ip_address)
+        if not first_host <= address <= last_host:
+            # iter_rows と同じく hosts() にはいらないアドレスの行はない
+            return []
+
+        if a_ip_hostname is None:
+            a_ip_hostname = self.get_a_hostnames()
+        a_set = a_ip_hostname.get(ip_address, set())
+        ptr_set = set(
+            record.hostname for record in self.ptr_record.get(ip_address, [])
+        )
+        record_infos = self.record_info.get(ip_address, set())
+        if a_set or ptr_set or record_infos:
+            return list(self._iter_address_rows(
+                ip_address, a_set, ptr_set, record_infos
+            ))
+
+        # 使われていないアドレス
+        return [(ip_address, None, None, None, None, None, None)]
+
+    def iter_rows(
+        self,
+        collapse_unused: bool=False
+    ):
         """
         A レコードと PTR レコードとレコード情報から ip_address をキーとして
 
@@ -146,7 +357,15 @@ class Network:
              record_info.comment
              )
 
-        のリストを生成する
+        を self.network_address.hosts() のアドレスについてアドレス順に
+        生成する。IPv4 のネットワークアドレスとブロードキャストアドレスの
+        ように hosts() にはいらないアドレスは、レコードがあっても行にしない
+
+        レコードのあるアドレスだけを調べ、その間の使われていない
+        アドレスの行はその場で生成するので、ネットワークの大きさ
+        ではなくレコードの数に比例するメモリしか使わない。
+        collapse_unused が True のときは、連続する使われていない
+        アドレスを UnusedRange ひとつにまとめる。
 
         例えば
 
@@ -159,111 +378,374 @@ class Network:
 
         というレコードがこの network にはいっているとき、
 
-        >>> list(network)
+        >>> list(network.iter_rows())
         [('192.168.0.1', 'hoge', None, None, None, None, None),
          ('192.168.0.2', None, 'fuga', None, None, None, None),
          ('192.168.0.3', 'syaro', 'syaro', None, None, None, None),
-         ('192.168.0.4', 'syaro', 'syaro', None, None, None, None),
          ('192.168.0.4', 'rize', 'rize', None, None, None, None),
+         ('192.168.0.4', 'syaro', 'syaro', None, None, None, None),
          ('192.168.0.5', None, None, None, None, None, None),
          ('192.168.0.6', None, None, None, None, None, None),
           ...
         ]
+        >>> list(network.iter_rows(collapse_unused=True))
+        [('192.168.0.1', 'hoge', None, None, None, None, None),
+          ...
+         ('192.168.0.4', 'syaro', 'syaro', None, None, None, None),
+         UnusedRange(first='192.168.0.5', last='192.168.0.254', size=250)
+        ]
 
         となる。
         """
-        a_ip_hostname = {
-            str(ip_address): []
-            for ip_address in self.network_address.hosts()
-        }
-        for hostname, records in self.a_record.items():
-            for record in records:
-                a_ip_hostname[record.ip_address].append(record)
-
-        ip_a_ptr_hosts = []
-        for ip_address in self.network_address.hosts():
-            _ip_a_ptr_hosts = []
-            ip = str(ip_address)
-            a_set = set(record.hostname for record in a_ip_hostname[ip])
-            ptr_set = set(
-                record.hostname for record in self.ptr_record.get(ip, [])
+        first_host, last_host = self._host_range()
+        # 次に出力する使われていないアドレスの候補
+        next_unused = first_host
+        for ip, a_set, ptr_set, record_infos in self._address_records():
+            _, ip_address = parse_address(ip)
+            if not first_host <= ip_address <= last_host:
+                continue
+            yield from self._iter_unused(
+                next_unused,
+                ip_address - 1,
+                collapse_unused
+            )
+            yield from self._iter_address_rows(
+                ip, a_set, ptr_set, record_infos
             )
-            a_and_ptr = a_set.intersection(ptr_set)
-            only_a = a_set - ptr_set
-            only_ptr = ptr_set - a_set
+            next_unused = ip_address + 1
+        yield from self._iter_unused(next_unused, last_host, collapse_unused)
 
-            record_infos = self.record_info.get(ip, [])
+    def __iter__(self):
+        """
+        self.iter_rows() と同じ行を生成する
 
-            for hostname in a_and_ptr:
-                record_info, record_infos = self._pop_record_info(
-                    record_infos, hostname
-                )
-                if record_info:
-                    _ip_a_ptr_hosts.append(
-                        (ip, hostname, hostname,
-                         record_info.hostname,
-                         record_info.classname,
-                         record_info.room,
-                         record_info.comment
-                         )
-                    )
-                else:
-                    _ip_a_ptr_hosts.append(
-                        (ip, hostname, hostname,
-                         None, None, None, None)
-                    )
-            for hostname in only_a:
-                record_info, record_infos = self._pop_record_info(
-                    record_infos, hostname
-                )
-                if record_info:
-                    _ip_a_ptr_hosts.append(
-                        (ip, hostname, None,
-                         record_info.hostname,
-                         record_info.classname,
-                         record_info.room,
-                         record_info.comment
-                         )
-                    )
-                else:
-                    _ip_a_ptr_hosts.append(
-                        (ip, hostname, None,
-                         None, None, None, None)
-                    )
-            for hostname in only_ptr:
-                record_info, record_infos = self._pop_record_info(
-                    record_infos, hostname
-                )
-                if record_info:
-                    _ip_a_ptr_hosts.append(
-                        (ip, None, hostname,
-                         record_info.hostname,
-                         record_info.classname,
-                         record_info.room,
-                         record_info.comment
-                         )
-                    )
-                else:
-                    _ip_a_ptr_hosts.append(
-                        (ip, None, hostname,
-                         None, None, None, None)
-                    )
-
-            for record_info in record_infos:
-                _ip_a_ptr_hosts.append(
-                    (ip, None, None,
-                     record_info.hostname,
-                     record_info.classname,
-                     record_info.room,
-                     record_info.comment
-                     )
-                )
-
-            if _ip_a_ptr_hosts:
-                ip_a_ptr_hosts.extend(_ip_a_ptr_hosts)
-            else:
-                ip_a_ptr_hosts.append(
-                    (ip, None, None,
-                     None, None, None, None)
-                )
-        return iter(ip_a_ptr_hosts)
+        >>> list(network)
+        [('192.168.0.1', 'hoge', None, None, None, None, None),
+          ...
+        ]
+        """
+        return self.iter_rows()
+
+    def get_fingerprint(self) -> str:
+        """
+        iter_rows() が生成する行の内容から決まる SHA-1 を返す
+
+        使われていないアドレスの行はネットワークアドレスだけで決まるので、
+        レコードのあるアドレスの行だけを読む。時間はネットワークの
+        大きさではなくレコードの数に比例する
+        """
+        digest = hashlib.sha1(str(self.network_address).encode())
+        for ip, a_set, ptr_set, record_infos in self._address_records():
+            # 集合の順番によらないように、アドレスごとに行を並べる
+            rows = sorted(
+                self._iter_address_rows(ip, a_set, ptr_set, record_infos),
+                key=lambda row: ["" if value is None else value
+                                 for value in row]
+            )
+            digest.update(repr(rows).encode())
+        return digest.hexdigest()
+
+
+class SparseNetwork(Network):
+    """
+    レコードのあるアドレスだけを持ち、アドレス空間を数えあげない Network
+
+    2001:db8::/64 のような IPv6 のネットワークは使われていない
+    アドレスを一行ずつ生成することはできないので、レコードのある
+    アドレスを整数のソート済みのリストとして持ち、その間の
+    使われていないアドレスは collapse_unused によらず常に
+    UnusedRange ひとつにまとめる。行を生成する時間とメモリは
+    ネットワークの大きさではなくレコードの数に比例する
+
+    >>> network = SparseNetwork("2001:db8::/64")
+    >>> network.add_record(ARecord("host1", "2001:db8::1"))
+    >>> list(network)
+    [('2001:db8::1', 'host1', None, None, None, None, None),
+     UnusedRange(first='2001:db8::2', last='2001:db8::ffff:ffff:ffff:ffff',
+                 size=18446744073709551614)]
+    """
+    def __init__(
+        self,
+        network_address: str
+    ):
+        Network.__init__(self, network_address)
+        # レコードのあるアドレスの整数のソート済みのリストと、
+        # その整数をキー、IP アドレスの文字列を値とする辞書
+        self._addresses = []
+        self._ip_addresses = {}
+
+    def _add_address(self, ip_address: str):
+        _, address = parse_address(ip_address)
+        if address in self._ip_addresses:
+            return
+        self._ip_addresses[address] = ip_address
+        # ゾーンファイルはたいていアドレス順なので末尾に追加すればよい
+        if not self._addresses or self._addresses[-1] < address:
+            self._addresses.append(address)
+        else:
+            insort(self._addresses, address)
+
+    def add_record(
+        self,
+        record: DNSRecord,
+        check_range: bool=True
+    ):
+        Network.add_record(self, record, check_range)
+        self._add_address(record.ip_address)
+
+    def add_record_info(
+        self,
+        record_info: RecordInfo,
+        check_range: bool=True
+    ):
+        Network.add_record_info(self, record_info, check_range)
+        self._add_address(record_info.ip_address)
+
+    def _iter_ip_addresses(self, a_ip_hostname: {str: {str}}):
+        return (self._ip_addresses[address] for address in self._addresses)
+
+    def _iter_unused(
+        self,
+        first: int,
+        last: int,
+        collapse_unused: bool
+    ):
+        return Network._iter_unused(self, first, last, True)
+
+
+def make_network(
+    network_address: str,
+    network_class: type=Network
+) -> Network:
+    """
+    network_address の Network を生成する
+
+    IPv6 のネットワークはアドレス空間を数えあげられないので
+    network_class によらず SparseNetwork にする
+    """
+    if ipaddress.ip_network(network_address).version == 6:
+        return SparseNetwork(network_address)
+    return network_class(network_address)
+
+
+class NetworkRouter:
+    """
+    IP アドレスからそれを含む Network を引くためのインデックス
+
+    各 Network の範囲の端点で数直線を区間に分割し、区間ごとに
+    その区間を含む Network のリストを持っておく。
+    レコードを追加するときは二分探索で区間を求めるので、
+    全ての Network に add_record して NetworkRangeError を
+    捕まえるよりもずっと速い
+
+    >>> router = NetworkRouter(network.values())
+    >>> router.add_record(ARecord("host1", "192.168.0.1"))
+    True
+    """
+    def __init__(self, networks: [Network]):
+        networks = list(networks)
+        # IPv4 と IPv6 で整数の範囲が重なるので、バージョンごとに
+        #    {4: ([区間の先頭, ...], [[Network, ...], ...]), 6: ...}
+        # のように分けて持つ
+        self._intervals = {}
+        for version in set(network.version for network in networks):
+            _networks = [
+                network for network in networks
+                if network.version == version
+            ]
+            starts = sorted(
+                set(network.first_address for network in _networks) |
+                set(network.last_address + 1 for network in _networks)
+            )
+            self._intervals[version] = (
+                starts,
+                [[network for network in _networks
+                  if network.first_address <= start <= network.last_address]
+                 for start in starts]
+            )
+
+    def lookup(
+        self,
+        ip_address: str
+    ) -> [Network]:
+        """
+        ip_address を含む Network のリストを返す
+
+        >>> router.lookup("192.168.0.1")
+        [<network.Network object at ...>]
+        """
+        version, address = parse_address(ip_address)
+        if version not in self._intervals:
+            return []
+        starts, networks = self._intervals[version]
+        index = bisect_right(starts, address) - 1
+        if index < 0:
+            return []
+        return networks[index]
+
+    def add_record(
+        self,
+        record: DNSRecord
+    ) -> bool:
+        """
+        record をそれを含む全ての Network に追加する
+
+        どの Network にもはいらなかったときは False を返す
+        """
+        networks = self.lookup(record.ip_address)
+        for network in networks:
+            network.add_record(record, check_range=False)
+        return bool(networks)
+
+    def add_record_info(
+        self,
+        record_info: RecordInfo
+    ) -> bool:
+        """
+        record_info をそれを含む全ての Network に追加する
+
+        どの Network にもはいらなかったときは False を返す
+        """
+        networks = self.lookup(record_info.ip_address)
+        for network in networks:
+            network.add_record_info(record_info, check_range=False)
+        return bool(networks)
+
+
+def test_network_router():
+    networks = [
+        Network("192.168.0.0/24"),
+        Network("192.168.0.0/25"),
+        Network("192.168.1.0/24"),
+    ]
+    router = NetworkRouter(networks)
+
+    assert router.lookup("192.168.0.1") == networks[:2]
+    assert router.lookup("192.168.0.200") == networks[:1]
+    assert router.lookup("192.168.1.255") == networks[2:]
+    assert router.lookup("192.168.2.0") == []
+    assert router.lookup("10.0.0.1") == []
+
+    assert router.add_record(ARecord("host1", "192.168.0.1"))
+    assert not router.add_record(ARecord("host2", "192.168.2.1"))
+    assert "host1" in networks[0].a_record
+    assert "host1" in networks[1].a_record
+    assert "host1" not in networks[2].a_record
+
+
+def test_network_iter_rows():
+    nt = Network("192.168.0.0/29")
+    for record in [
+            ARecord("hoge", "192.168.0.1"),
+            PTRRecord("fuga", "192.168.0.2"),
+            ARecord("rize", "192.168.0.4"),
+            PTRRecord("rize", "192.168.0.4"),
+    ]:
+        nt.add_record(record)
+    nt.add_record_info(RecordInfo("192.168.0.2", "fuga", None, None, "PC"))
+
+    assert list(nt) == [
+        ('192.168.0.1', 'hoge', None, None, None, None, None),
+        ('192.168.0.2', None, 'fuga', 'fuga', None, None, 'PC'),
+        ('192.168.0.3', None, None, None, None, None, None),
+        ('192.168.0.4', 'rize', 'rize', None, None, None, None),
+        ('192.168.0.5', None, None, None, None, None, None),
+        ('192.168.0.6', None, None, None, None, None, None),
+    ]
+    assert list(nt.iter_rows(collapse_unused=True)) == [
+        ('192.168.0.1', 'hoge', None, None, None, None, None),
+        ('192.168.0.2', None, 'fuga', 'fuga', None, None, 'PC'),
+        ('192.168.0.3', None, None, None, None, None, None),
+        ('192.168.0.4', 'rize', 'rize', None, None, None, None),
+        UnusedRange('192.168.0.5', '192.168.0.6', 2),
+    ]
+
+    for row in list(nt):
+        assert row in nt.get_rows(row[0])
+    assert nt.get_rows("192.168.0.7") == []
+
+    # ネットワークアドレスとブロードキャストアドレスのレコードは行にしない
+    edge = Network("192.168.0.0/29")
+    for record in nt.ptr_record["192.168.0.4"] | nt.a_record["rize"] | {
+            ARecord("net", "192.168.0.0"),
+            PTRRecord("broadcast", "192.168.0.7"),
+    }:
+        edge.add_record(record)
+    edge.add_record_info(RecordInfo("192.168.0.7", None, None, None, "x"))
+    assert [row[0] for row in edge.iter_rows(collapse_unused=True)] == [
+        "192.168.0.1", "192.168.0.4", "192.168.0.5"
+    ]
+    assert edge.get_rows("192.168.0.0") == []
+    assert edge.get_rows("192.168.0.7") == []
+
+    # ひとつのアドレスに多くのホスト名とレコード情報がある場合
+    vip = Network("192.168.1.0/30")
+    for i in range(5):
+        vip.add_record(ARecord("alias{}".format(i), "192.168.1.1"))
+        vip.add_record(PTRRecord("alias{}".format(i), "192.168.1.1"))
+    vip.add_record(ARecord("only-a", "192.168.1.1"))
+    for hostname, comment in [("alias1", "web"), ("alias3", "mail"),
+                              ("alias3", "backup"), (None, "gateway"),
+                              ("other", None), ("only-a", "a")]:
+        vip.add_record_info(
+            RecordInfo("192.168.1.1", hostname, None, None, comment)
+        )
+    rows = vip.get_rows("192.168.1.1")
+    assert [row[1:4] for row in rows[:6]] == [
+        ("alias0", "alias0", None),
+        ("alias1", "alias1", "alias1"),
+        ("alias2", "alias2", None),
+        ("alias3", "alias3", "alias3"),
+        ("alias4", "alias4", None),
+        ("only-a", None, "only-a"),
+    ]
+    assert rows[1][6] == "web"
+    # 対応しなかったレコード情報はレコード情報だけの行になる
+    assert sorted((row[3] or "", row[6]) for row in rows[6:]) == sorted([
+        ("", "gateway"),
+        ("other", None),
+        ("alias3", {"mail", "backup"}.difference({rows[3][6]}).pop()),
+    ])
+    assert all(row[1:3] == (None, None) for row in rows[6:])
+
+    fingerprint = nt.get_fingerprint()
+    nt.add_record(ARecord("rize", "192.168.0.4"))
+    assert nt.get_fingerprint() == fingerprint
+    nt.add_record(ARecord("chino", "192.168.0.5"))
+    assert nt.get_fingerprint() != fingerprint
+
+
+def test_sparse_network():
+    nt = SparseNetwork("2001:db8::/64")
+    for record in [
+            ARecord("rize", "2001:db8::4"),
+            PTRRecord("rize", "2001:db8::4"),
+            ARecord("hoge", "2001:db8::1"),
+            PTRRecord("fuga", "2001:db8::2"),
+    ]:
+        nt.add_record(record)
+    nt.add_record_info(RecordInfo("2001:db8::2", "fuga", None, None, "PC"))
+
+    # 使われていないアドレスは常にまとめる
+    rows = [
+        ('2001:db8::1', 'hoge', None, None, None, None, None),
+        ('2001:db8::2', None, 'fuga', 'fuga', None, None, 'PC'),
+        ('2001:db8::3', None, None, None, None, None, None),
+        ('2001:db8::4', 'rize', 'rize', None, None, None, None),
+        UnusedRange('2001:db8::5', '2001:db8::ffff:ffff:ffff:ffff',
+                    (1 << 64) - 5),
+    ]
+    assert list(nt) == rows
+    assert list(nt.iter_rows(collapse_unused=True)) == rows
+
+    # Network と同じ行を生成する
+    v4 = Network("192.168.0.0/29")
+    sparse_v4 = SparseNetwork("192.168.0.0/29")
+    for network in [v4, sparse_v4]:
+        network.add_record(ARecord("chino", "192.168.0.5"))
+        network.add_record(PTRRecord("chino", "192.168.0.2"))
+    assert list(sparse_v4) == list(v4.iter_rows(collapse_unused=True))
+    assert sparse_v4.get_fingerprint() == v4.get_fingerprint()
+
+    assert isinstance(make_network("2001:db8::/64"), SparseNetwork)
+    assert type(make_network("192.168.0.0/24")) is Network
@@ -9,14 +9,30 @@ This module parses zones files which include A and PTR records.
 :license: MIT, see LICENSE for more details.
 """
 
+import io
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+import instrument
 from record import ARecord, PTRRecord, RecordInfo
+from address import normalize_address, parse_address, to_address_string
+from zonefile import ZoneReader
 try:
     import ipaddress
 except ImportError:
     import ipaddr as ipaddress
 
 
+# 逆引きの名前の末尾
+IN_ADDR_ARPA = ".in-addr.arpa."
+IP6_ARPA = ".ip6.arpa."
+
+# A, AAAA レコードのアドレスのバージョン
+ADDRESS_VERSIONS = {"A": 4, "AAAA": 6}
+
+_HEX_DIGITS = set("0123456789abcdefABCDEF")
+
+
 class RecordParserError(Exception):
     """
     文字列がレコードの正規表現にマッチしないとき
@@ -25,9 +41,123 @@ class RecordParserError(Exception):
     pass
 
 
+class PTRNetworkContext:
+    """
+    逆引きゾーンファイルのネットワークの情報を一度だけ計算しておくクラス
+
+    PTR レコードのオーナー名からアドレスを整数の演算だけで求める。
+    IPv4 ではオクテット、IPv6 ではニブル (16 進数一桁) がひとつのラベルで、
+    $ORIGIN のない相対名は、ネットワークアドレスの先頭の
+    プレフィックス長 // (ラベルのビット数) 個のラベルを $ORIGIN とみなす
+
+    >>> context = PTRNetworkContext("192.168.0.0/16")
+    >>> context.get_ip_address(1)
+    '192.168.0.1'
+    >>> context.get_ip_address_from_name("1.2")
+    '192.168.2.1'
+    >>> PTRNetworkContext("2001:db8::/120").get_ip_address_from_name("1.0")
+    '2001:db8::1'
+    """
+    __slots__ = (
+        "network_address", "version", "first_address", "num_addresses",
+        "suffix", "label_bits", "num_labels", "implied_labels"
+    )
+
+    def __init__(
+        self,
+        network_address: str
+    ):
+        network = ipaddress.ip_network(network_address)
+        self.network_address = network_address
+        self.version = network.version
+        self.first_address = int(network[0])
+        self.num_addresses = network.num_addresses
+        if self.version == 4:
+            self.suffix = IN_ADDR_ARPA
+            self.label_bits = 8
+        else:
+            self.suffix = IP6_ARPA
+            self.label_bits = 4
+        # 絶対名のラベルの数と、相対名の $ORIGIN とみなすラベルの数
+        self.num_labels = network.max_prefixlen // self.label_bits
+        self.implied_labels = network.prefixlen // self.label_bits
+
+    def get_ip_address(
+        self,
+        host: int
+    ) -> str:
+        """
+        ネットワークの先頭から host 番目のアドレスを返す
+        """
+        if not 0 <= host < self.num_addresses:
+            raise RecordParserError("{} is out of {}".format(
+                host, self.network_address
+            ))
+        return to_address_string(self.version, self.first_address + host)
+
+    def get_ip_address_from_name(
+        self,
+        name: str
+    ) -> str:
+        """
+        逆引きのオーナー名から in-addr.arpa. (ip6.arpa.) を除いた
+        "1.0.168.192" や "1.0" のような名前 (ホスト部が先頭) から
+        アドレスを求める
+
+        num_labels 個のラベルがあれば絶対名として、
+        num_labels - implied_labels 個ならネットワークアドレスの
+        先頭のラベルからの相対名として扱う。RFC 2317 の
+        "0/26", "0-63" のような "/" や "-" を含むラベルは無視する
+        """
+        labels = name.split(".")
+        if "/" in name or "-" in name:
+            # ホスト部が RFC 2317 のラベルなら、委譲のための CNAME などの名前
+            if "/" in labels[0] or "-" in labels[0]:
+                raise RecordParserError(
+                    "{} is not a host name".format(name)
+                )
+            labels = [label for label in labels
+                      if "/" not in label and "-" not in label]
+
+        address = 0
+        label_bits = self.label_bits
+        for label in reversed(labels):
+            if self.version == 4:
+                value = int(label) if label.isdigit() else 256
+            elif len(label) == 1 and label in _HEX_DIGITS:
+                value = int(label, 16)
+            else:
+                value = 16
+            if value >> label_bits:
+                raise RecordParserError("{} is not a label of {}".format(
+                    label, self.suffix
+                ))
+            address = address << label_bits | value
+
+        if len(labels) == self.num_labels - self.implied_labels:
+            shift = label_bits * len(labels)
+            address |= self.first_address >> shift << shift
+        elif len(labels) != self.num_labels:
+            raise RecordParserError(
+                "{} has {} labels".format(name, len(labels))
+            )
+
+        if not 0 <= address - self.first_address < self.num_addresses:
+            raise RecordParserError("{} is out of {}".format(
+                to_address_string(self.version, address),
+                self.network_address
+            ))
+        return to_address_string(self.version, address)
+
+
 class RecordParser:
     """
     A, PTR レコードを解析するクラス
+
+    parse_a_record, parse_ptr_record は一行だけを正規表現で解析する。
+    ファイルや行のイテレータは zonefile.ZoneReader でゾーンファイルとして
+    解析するので、$ORIGIN, $INCLUDE, 複数行のレコード、
+    オーナー名の引き継ぎなども扱える
     """
     def __init__(self):
         # A レコードの正規表現
@@ -35,14 +165,15 @@ class RecordParser:
             # r'^(?:(?P<comment>;+)\s*)?'  # コメント
             r'^(?:(?P<hostname>[\w.-]+)\s+)?'  # ホスト名
             r'(?:IN\s+)?'
-            r'(?:(?P<type>A)\s+)?'  # レコードタイプ
-            r'(?:(?P<ip>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})\s*)?$'  # IPv4
+            r'(?:(?P<type>AAAA|A)\s+)?'  # レコードタイプ
+            r'(?:(?P<ip>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}'  # IPv4
+            r'|[\dA-Fa-f.]*:[\dA-Fa-f:.]*)\s*)?$'  # IPv6
         )
         # PTR レコードの正規表現
         self.ptr_regex = re.compile(
             # r'^(?:(?P<comment>;+)\s*)?'  # コメント
             # r'(?:\d{1,3}\.\d{1,3}\.\d{1,3}\.)?'  # ネットワークアドレス /24
-            r'^(?:(?P<ip>\d{1,3})\s+)?'  # IPv4 /24
+            r'^(?:(?P<ip>\d{1,3}|[\dA-Fa-f])\s+)?'  # IPv4 /24, IPv6 /124
             # r'(:?\.in-addr\.arpa\.\s+)?'
             r'(?:IN\s+)?'
             r'(?:(?P<type>PTR)\s+)?'
@@ -81,34 +212,238 @@ class RecordParser:
             if group["ip"] and group["hostname"] and group["type"]:
                 return ARecord(
                     hostname=self._get_shortname(group["hostname"]),
-                    ip_address=group["ip"],
+                    ip_address=self._normalize_address(
+                        group["ip"], group["type"]
+                    ),
                 )
         raise RecordParserError()
 
+    def _normalize_address(
+        self,
+        ip_address: str,
+        record_type: str
+    ) -> str:
+        """
+        A (AAAA) レコードのアドレスを正規化する。IPv4 (IPv6) の
+        アドレスでなければ RecordParserError をだす
+        """
+        try:
+            version, _ = parse_address(ip_address)
+        except ValueError:
+            raise RecordParserError(
+                "{} is not an IP address".format(ip_address)
+            )
+        if version != ADDRESS_VERSIONS[record_type]:
+            raise RecordParserError(
+                "{} is not an IPv{} address".format(
+                    ip_address, ADDRESS_VERSIONS[record_type]
+                )
+            )
+        return normalize_address(ip_address)
+
     def parse_ptr_record(
         self,
         ptr_record: str,
-        network_address: str
+        network_context: PTRNetworkContext
     ):
         """
         PTR レコード文字列を解析する
 
+        network_context には PTRNetworkContext を渡す。
+        ネットワークアドレスの文字列を渡すこともできるが、
+        その場合は毎回 PTRNetworkContext を生成するので遅い
+
         >>> parser.parse_ptr_record(
         ...     "1 PTR host1.example.com.",
-        ...     "192.168.0.0/24"
+        ...     PTRNetworkContext("192.168.0.0/24")
         ... )
         """
         match = self.ptr_regex.search(ptr_record)
         if match:
-            group = match.groupdict()
-            if group["ip"] and group["hostname"] and group["type"]:
-                network = ipaddress.ip_network(network_address)
+            ip, type_, hostname = match.group("ip", "type", "hostname")
+            if ip and hostname and type_:
+                if not isinstance(network_context, PTRNetworkContext):
+                    network_context = PTRNetworkContext(network_context)
                 return PTRRecord(
-                    hostname=self._get_shortname(group["hostname"]),
-                    ip_address=str(network[int(group["ip"])])
+                    hostname=self._get_shortname(hostname),
+                    ip_address=network_context.get_ip_address_from_name(ip)
                 )
         raise RecordParserError()
 
+    def make_a_record(
+        self,
+        resource_record
+    ) -> ARecord:
+        """
+        ZoneReader が生成した A, AAAA のリソースレコードから ARecord を作る
+        """
+        if not resource_record.rdata:
+            raise RecordParserError("no address")
+        return ARecord(
+            hostname=self._get_shortname(resource_record.owner),
+            ip_address=self._normalize_address(
+                resource_record.rdata[0], resource_record.type
+            ),
+        )
+
+    def make_ptr_record(
+        self,
+        resource_record,
+        network_context: PTRNetworkContext
+    ) -> PTRRecord:
+        """
+        ZoneReader が生成した PTR のリソースレコードから PTRRecord を作る
+
+        オーナー名は "1.0.168.192.in-addr.arpa." のような絶対名か、
+        $ORIGIN がない場合の "1" や "1.0" のような相対名で、
+        RFC 2317 の "1.0/26.0.168.192.in-addr.arpa." も使える。
+        IPv6 のネットワークでは "1.0.0.0. ... .ip6.arpa." を使う
+        """
+        name = resource_record.owner
+        if not resource_record.rdata:
+            raise RecordParserError("no host name")
+        if name[-1] == ".":
+            suffix = network_context.suffix
+            if name[-len(suffix):].lower() != suffix:
+                raise RecordParserError(
+                    "{} is not in {}".format(name, suffix)
+                )
+            name = name[:-len(suffix)]
+        return PTRRecord(
+            hostname=self._get_shortname(resource_record.rdata[0]),
+            ip_address=network_context.get_ip_address_from_name(name)
+        )
+
+    def _iter_records(
+        self,
+        resource_records,
+        record_types: {str},
+        make_record,
+        *args
+    ):
+        """
+        リソースレコードのうちタイプが record_types にはいっているものを
+        make_record(resource_record, *args) でレコードにして順に生成する
+        """
+        parsed, rejected = 0, 0
+        try:
+            for resource_record in resource_records:
+                parsed += 1
+                if resource_record is None or \
+                        resource_record.type not in record_types:
+                    rejected += 1
+                    continue
+                try:
+                    yield make_record(resource_record, *args)
+                except RecordParserError:
+                    rejected += 1
+        finally:
+            instrument.count("lines parsed", parsed)
+            instrument.count("lines rejected", rejected)
+
+    def iter_a_records(
+        self,
+        lines,
+        origin: str=None,
+        include_dir: str="."
+    ):
+        """
+        行のイテレータをゾーンファイルとして解析して A, AAAA レコードを
+        順に生成する。AAAA レコードも ARecord になる
+
+        origin は最初の $ORIGIN、include_dir は $INCLUDE の相対パスの基準
+        """
+        return self._iter_records(
+            ZoneReader(origin).read_lines(lines, include_dir),
+            ADDRESS_VERSIONS.keys(),
+            self.make_a_record
+        )
+
+    def iter_ptr_records(
+        self,
+        lines,
+        network_context: PTRNetworkContext,
+        origin: str=None,
+        include_dir: str="."
+    ):
+        """
+        行のイテレータをゾーンファイルとして解析して PTR レコードを
+        順に生成する
+        """
+        return self._iter_records(
+            ZoneReader(origin).read_lines(lines, include_dir),
+            {"PTR"},
+            self.make_ptr_record,
+            network_context
+        )
+
+    def iter_a_record_file(
+        self,
+        filename: str
+    ):
+        """
+        ゾーンファイルを一行ずつ解析して A レコードを順に生成する
+
+        ファイル全体のレコードをリストとして持たないので、
+        大きなゾーンファイルでもメモリを使わない
+
+        >>> for a_record in parser.iter_a_record_file(
+        ...     "zones/example.com.zone",
+        ... ):
+        ...     network.add_record(a_record)
+        """
+        return self._iter_records(
+            ZoneReader().read_file(filename),
+            ADDRESS_VERSIONS.keys(),
+            self.make_a_record
+        )
+
+    def iter_ptr_record_file(
+        self,
+        filename: str,
+        network_address: str
+    ):
+        """
+        ゾーンファイルを一行ずつ解析して PTR レコードを順に生成する
+
+        >>> for ptr_record in parser.iter_ptr_record_file(
+        ...     "zones/192.168.0.rev",
+        ...     "192.168.0.0/24"
+        ... ):
+        ...     network.add_record(ptr_record)
+        """
+        return self._iter_records(
+            ZoneReader().read_file(filename),
+            {"PTR"},
+            self.make_ptr_record,
+            PTRNetworkContext(network_address)
+        )
+
+    def iter_a_record_files(
+        self,
+        filenames: [str]
+    ):
+        """
+        ファイルごとに A レコードのイテレータを順に生成する
+
+        ParallelRecordParser.parse_a_record_files と同じ形で結果を返す
+        """
+        return (self.iter_a_record_file(filename) for filename in filenames)
+
+    def iter_ptr_record_files(
+        self,
+        filename_networks: [(str, str)]
+    ):
+        """
+        ファイルごとに PTR レコードのイテレータを順に生成する
+
+        ParallelRecordParser.parse_ptr_record_files と同じ形で結果を返す
+        """
+        return (
+            self.iter_ptr_record_file(filename, network_address)
+            for filename, network_address in filename_networks
+        )
+
     def parse_a_record_file(
         self,
         filename: str
@@ -120,15 +455,7 @@ class RecordParser:
         ...     "zones/example.com.zone",
         ... )
         """
-        a_records = []
-        with open(filename) as f:
-            for record in f:
-                try:
-                    a_record = self.parse_a_record(record)
-                    a_records.append(a_record)
-                except RecordParserError:
-                    pass
-        return a_records
+        return list(self.iter_a_record_file(filename))
 
     def parse_ptr_record_file(
         self,
@@ -143,15 +470,7 @@ class RecordParser:
         ...     "192.168.0.0/24"
         ... )
         """
-        ptr_records = []
-        with open(filename) as f:
-            for record in f:
-                try:
-                    ptr_record = self.parse_ptr_record(record, network_address)
-                    ptr_records.append(ptr_record)
-                except RecordParserError:
-                    pass
-        return ptr_records
+        return list(self.iter_ptr_record_file(filename, network_address))
 
 
 class RecordInfoParserError(Exception):
@@ -169,7 +488,7 @@ class RecordInfoParser:
     def __init__(self):
         # A レコードの正規表現
         self.record_info_regex = re.compile(
-            r'^\s*(?P<ip>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})\s*\|'  # IP は必須
+            r'^\s*(?P<ip>[\dA-Fa-f.:]+)\s*\|'  # IP は必須
             r'\s*(?P<hostname>[^\s|]*)\s*\|'  # ホスト名
             r'(?P<classname>[^|]*)\|'  # クラス
             r'(?P<room>[^|]*)\|'  # 部屋
@@ -188,7 +507,12 @@ class RecordInfoParser:
         match = self.record_info_regex.search(record_info)
         if match:
             group = match.groupdict()
-            ip = group["ip"].strip()
+            try:
+                ip = normalize_address(group["ip"].strip())
+            except ValueError:
+                raise RecordInfoParserError(
+                    "{} is not an IP address".format(group["ip"])
+                )
             hostname = group["hostname"].strip()
             classname = group["classname"].strip()
             room = group["room"].strip()
@@ -209,19 +533,208 @@ class RecordInfoParser:
                 return True
         return False
 
-    def parse_file(self, filename: str):
-        record_infos = []
-        with open(filename) as f:
-            for line in [_.strip() for _ in f]:
+    def iter_record_infos(self, lines):
+        """
+        行のイテレータを解析してレコード情報を順に生成する
+        """
+        parsed, rejected = 0, 0
+        try:
+            for line in lines:
+                parsed += 1
+                line = line.strip()
                 if self.is_ignored_line(line):
                     continue
-                else:
-                    try:
-                        record_info = self.parse(line)
-                        record_infos.append(record_info)
-                    except RecordInfoParserError:
-                        pass
-        return record_infos
+                try:
+                    yield self.parse(line)
+                except RecordInfoParserError:
+                    rejected += 1
+        finally:
+            instrument.count("lines parsed", parsed)
+            instrument.count("lines rejected", rejected)
+
+    def iter_file(self, filename: str):
+        """
+        レコード情報ファイルを一行ずつ解析してレコード情報を順に生成する
+        """
+        with open(filename) as f:
+            yield from self.iter_record_infos(f)
+
+    def iter_files(self, filenames: [str]):
+        """
+        ファイルごとにレコード情報のイテレータを順に生成する
+
+        ParallelRecordParser.parse_record_info_files と同じ形で結果を返す
+        """
+        return (self.iter_file(filename) for filename in filenames)
+
+    def parse_file(self, filename: str):
+        return list(self.iter_file(filename))
+
+
+def split_file(
+    filename: str,
+    chunk_size: int
+) -> [(int, int)]:
+    """
+    ファイルを行の途中で切らないように chunk_size バイト程度ずつに分け、
+    各部分の (先頭, 末尾) のバイト位置のリストを返す
+
+    >>> split_file("zones/example.com.zone", 1 << 24)
+    [(0, 16777230), (16777230, 25165831)]
+    """
+    size = os.path.getsize(filename)
+    chunks = []
+    with open(filename, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            # 次の改行までを含める
+            f.readline()
+            end = min(f.tell(), size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def _read_chunk_lines(
+    filename: str,
+    start: int,
+    end: int
+):
+    """
+    ファイルの start から end までを open(filename) と同じように
+    行ごとに読む
+    """
+    with open(filename, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return io.TextIOWrapper(io.BytesIO(data))
+
+
+def _parse_chunk(parse, *args) -> (list, dict):
+    """
+    ワーカープロセスで parse(*args) のレコードをリストにし、
+    (レコードのリスト, instrument の計測結果) を返す
+    """
+    instrument.reset()
+    with instrument.stage("parse worker"):
+        records = list(parse(*args))
+    return records, instrument.get_report()
+
+
+def _parse_a_record_file(
+    filename: str
+) -> ([ARecord], dict):
+    return _parse_chunk(RecordParser().iter_a_record_file, filename)
+
+
+def _parse_ptr_record_file(
+    filename: str,
+    network_address: str
+) -> ([PTRRecord], dict):
+    return _parse_chunk(
+        RecordParser().iter_ptr_record_file,
+        filename,
+        network_address
+    )
+
+
+def _parse_record_info_chunk(
+    filename: str,
+    start: int,
+    end: int
+) -> ([RecordInfo], dict):
+    return _parse_chunk(
+        RecordInfoParser().iter_record_infos,
+        _read_chunk_lines(filename, start, end)
+    )
+
+
+class ParallelRecordParser:
+    """
+    複数のファイルをプロセスプールで並列に解析するクラス
+
+    ゾーンファイルは $ORIGIN や直前のオーナー名などの状態を持つので
+    ファイルごとに解析する。レコード情報ファイルは大きければ
+    行単位で chunk_size バイト程度ずつに分けて解析する。
+    結果はファイルの順、ファイルの中では行の順に並べて返すので、
+    RecordParser, RecordInfoParser で一つずつ解析した結果と一致する
+
+    >>> parser = ParallelRecordParser(jobs=4)
+    >>> parser.parse_a_record_files(["zones/example.com.zone"])
+    [[<record.ARecord object at ...>, ...]]
+    """
+    def __init__(
+        self,
+        jobs: int,
+        chunk_size: int=1 << 24
+    ):
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+
+    def _parse_files(
+        self,
+        function,
+        filename_args: [(str, tuple)],
+        split: bool=True
+    ) -> [list]:
+        """
+        各ファイルを分割して function(filename, *args, start, end) を
+        並列に実行し、ファイルごとに結果をつなげたリストを返す
+
+        split が False のときはファイルを分割せずに
+        function(filename, *args) を実行する
+        """
+        with ProcessPoolExecutor(
+                max_workers=self.jobs,
+                initializer=instrument.set_enabled,
+                initargs=(instrument.enabled,)
+        ) as executor:
+            futures = [
+                [executor.submit(function, filename, *args, start, end)
+                 for start, end in split_file(filename, self.chunk_size)]
+                if split else [executor.submit(function, filename, *args)]
+                for filename, args in filename_args
+            ]
+            results = []
+            for file_futures in futures:
+                records = []
+                for future in file_futures:
+                    chunk_records, report = future.result()
+                    records.extend(chunk_records)
+                    instrument.merge(report)
+                results.append(records)
+        return results
+
+    def parse_a_record_files(
+        self,
+        filenames: [str]
+    ) -> [[ARecord]]:
+        return self._parse_files(
+            _parse_a_record_file,
+            [(filename, ()) for filename in filenames],
+            split=False
+        )
+
+    def parse_ptr_record_files(
+        self,
+        filename_networks: [(str, str)]
+    ) -> [[PTRRecord]]:
+        return self._parse_files(
+            _parse_ptr_record_file,
+            [(filename, (network_address,))
+             for filename, network_address in filename_networks],
+            split=False
+        )
+
+    def parse_record_info_files(
+        self,
+        filenames: [str]
+    ) -> [[RecordInfo]]:
+        return self._parse_files(
+            _parse_record_info_chunk,
+            [(filename, ()) for filename in filenames]
+        )
 
 
 def test_a_record_parser():
@@ -250,6 +763,7 @@ def test_a_record_parser():
         ";host3 IN  A   192.168.0.4",
         "; host4    IN  A   192.168.0.5",
         "; 192.168.0.5",
+        "host5 A 192.168.0.256",
     ]
     for record in invalid_a_records:
         try:
@@ -272,9 +786,13 @@ def test_ptr_record_parser():
     ]
     for record, answer in valid_ptr_record_answers:
         assert parser.parse_ptr_record(record, network_address) == answer
+        assert parser.parse_ptr_record(
+            record, PTRNetworkContext(network_address)
+        ) == answer
     invalid_ptr_records = [
         ";; 2",
-        "$ORIGIn 0.168.192.in-addr.arpa."
+        "$ORIGIn 0.168.192.in-addr.arpa.",
+        "256 PTR host256.example.com.",
     ]
     for record in invalid_ptr_records:
         try:
@@ -284,6 +802,136 @@ def test_ptr_record_parser():
             pass
 
 
+def test_zone_file_parser():
+    parser = RecordParser()
+
+    # 一行ずつの場合と同じ結果になる
+    a_lines = [
+        "host1 A 192.168.0.2",
+        ";192.168.0.3 -- DISABLED",
+        "host2.example.com. IN A 192.168.0.3",
+        "A  192.168.0.3",
+        ";host3 IN  A   192.168.0.4",
+        "host5 A 192.168.0.256",
+    ]
+    assert list(parser.iter_a_records(a_lines)) == [
+        ARecord("host1", "192.168.0.2"),
+        ARecord("host2", "192.168.0.3"),
+    ]
+    assert list(parser.iter_ptr_records(
+        [";; 2", "1 PTR host1.example.com.", "256 PTR host256.example.com."],
+        PTRNetworkContext("192.168.0.0/24")
+    )) == [PTRRecord("host1", "192.168.0.1")]
+
+    # 一行ずつでは読めなかったレコード
+    a_lines = [
+        "$ORIGIN example.com.",
+        "@ IN SOA host1.example.com. root.localhost. (",
+        "        1 3600 900 604800 86400 )",
+        "host1 3600 IN A 192.168.0.2",
+        "      IN A 192.168.0.3",
+        "host2 IN A (",
+        "        192.168.0.4 )",
+    ]
+    assert list(parser.iter_a_records(a_lines)) == [
+        ARecord("host1", "192.168.0.2"),
+        ARecord("host1", "192.168.0.3"),
+        ARecord("host2", "192.168.0.4"),
+    ]
+    assert list(parser.iter_ptr_records(
+        ["$ORIGIN 0.168.192.in-addr.arpa.", "2 PTR chino", "  PTR rize"],
+        PTRNetworkContext("192.168.0.0/24")
+    )) == [PTRRecord("chino", "192.168.0.2"), PTRRecord("rize", "192.168.0.2")]
+
+
+def test_reverse_zone_parser():
+    parser = RecordParser()
+
+    # /16 の逆引きゾーン
+    context = PTRNetworkContext("192.168.0.0/16")
+    assert list(parser.iter_ptr_records(
+        [
+            "1.0 PTR host1.",
+            "2.3 PTR host2.",
+            "$ORIGIN 168.192.in-addr.arpa.",
+            "4.5 PTR host3.",
+            "6.7.168.192.in-addr.arpa. PTR host4.",
+            "8 PTR host5.",
+            "1.1.1.10.in-addr.arpa. PTR host6.",
+        ],
+        context
+    )) == [
+        PTRRecord("host1", "192.168.0.1"),
+        PTRRecord("host2", "192.168.3.2"),
+        PTRRecord("host3", "192.168.5.4"),
+        PTRRecord("host4", "192.168.7.6"),
+    ]
+
+    # RFC 2317 の委譲された /26
+    context = PTRNetworkContext("192.0.2.64/26")
+    assert list(parser.iter_ptr_records(
+        [
+            "$ORIGIN 64/26.2.0.192.in-addr.arpa.",
+            "65 PTR host65.",
+            "1 PTR host1.",
+            "$ORIGIN 2.0.192.in-addr.arpa.",
+            "66.64-127 PTR host66.",
+            "64-127 NS ns1.",
+        ],
+        context
+    )) == [
+        PTRRecord("host65", "192.0.2.65"),
+        PTRRecord("host66", "192.0.2.66"),
+    ]
+    assert context.get_ip_address_from_name("70") == "192.0.2.70"
+    for name in ["64/26", "256", "x", "1.1", "70.64/26.2.0"]:
+        try:
+            context.get_ip_address_from_name(name)
+            assert False
+        except RecordParserError:
+            pass
+
+
+def test_ipv6_parser():
+    parser = RecordParser()
+
+    assert list(parser.iter_a_records([
+        "host1 AAAA 2001:DB8:0:0::1",
+        "host2 A 192.168.0.2",
+        "host3 AAAA 192.168.0.3",
+        "host4 A 2001:db8::4",
+    ])) == [
+        ARecord("host1", "2001:db8::1"),
+        ARecord("host2", "192.168.0.2"),
+    ]
+    assert parser.parse_a_record("host1 AAAA 2001:db8::1") == \
+        ARecord("host1", "2001:db8::1")
+
+    context = PTRNetworkContext("2001:db8::/64")
+    host = ".".join("1" + "0" * 15)
+    assert list(parser.iter_ptr_records(
+        [
+            "{} PTR host1.".format(host),
+            "$ORIGIN 0.0.0.0.0.0.0.0.8.B.D.0.1.0.0.2.ip6.arpa.",
+            "f.f.0.0.0.0.0.0.0.0.0.0.0.0.0.0 PTR host2.",
+            "{}.8.b.d.0.1.0.0.2.ip6.arpa. PTR host3.".format(
+                ".".join("2" + "0" * 23)
+            ),
+            "1.0.0.0 PTR host4.",
+            "10.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0 PTR host5.",
+            "1.0.168.192.in-addr.arpa. PTR host6.",
+        ],
+        context
+    )) == [
+        PTRRecord("host1", "2001:db8::1"),
+        PTRRecord("host2", "2001:db8::ff"),
+        PTRRecord("host3", "2001:db8::2"),
+    ]
+
+    assert RecordInfoParser().parse("2001:db8::1|host1|||") == \
+        RecordInfo("2001:db8::1", "host1", None, None, None)
+
+
 def test_parse_file():
     valid_record_infos = [
         ("192.168.0.1|host1|HOST|100|テスト用",
@@ -344,3 +992,35 @@ def test_parse_file():
 
     for line in ignored_lines:
         assert parser.is_ignored_line(line)
+
+
+def test_parallel_record_parser():
+    import tempfile
+
+    a_lines = ["host{} A 192.168.{}.{}".format(i, i // 250, i % 250 + 1)
+               for i in range(1000)]
+    ptr_lines = ["{} PTR host{}.example.jp.".format(i, i)
+                 for i in range(1, 255)]
+    info_lines = ["192.168.0.{}|host{}|||コメント{}".format(i, i, i)
+                  for i in range(1, 255)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filenames = []
+        for name, lines in [("a.zone", a_lines),
+                            ("0.rev", ptr_lines),
+                            ("0.info", info_lines)]:
+            filename = os.path.join(tmpdir, name)
+            with open(filename, "w") as f:
+                f.write("; comment\n" + "\n".join(lines))
+            filenames.append(filename)
+        a_filename, ptr_filename, info_filename = filenames
+
+        parser = RecordParser()
+        parallel_parser = ParallelRecordParser(jobs=2, chunk_size=256)
+        assert len(split_file(info_filename, 256)) > 1
+        assert parallel_parser.parse_a_record_files([a_filename]) == \
+            [parser.parse_a_record_file(a_filename)]
+        assert parallel_parser.parse_ptr_record_files(
+            [(ptr_filename, "192.168.0.0/24")]
+        ) == [parser.parse_ptr_record_file(ptr_filename, "192.168.0.0/24")]
+        assert parallel_parser.parse_record_info_files([info_filename]) == \
+            [RecordInfoParser().parse_file(info_filename)]
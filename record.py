@@ -20,6 +20,9 @@ class DNSRecord:
     ...  "A"
     ... )
     """
+    # レコードは大量に生成されるので __dict__ を持たせない
+    __slots__ = ("hostname", "ip_address", "type", "used")
+
     def __init__(
         self,
         hostname: str,
@@ -44,6 +47,14 @@ class DNSRecord:
     def __hash__(self):
         return hash((self.hostname, self.ip_address, self.type, self.used))
 
+    def __reduce__(self):
+        # __slots__ を使ったクラスの既定の pickle は遅いので
+        # コンストラクタの引数だけを渡す
+        return (
+            self.__class__,
+            (self.hostname, self.ip_address, self.type, self.used)
+        )
+
     def __str__(self):
         print("{} {} {}".format(self.type, self.hostname, self.ip_address))
 
@@ -57,6 +68,8 @@ class ARecord(DNSRecord):
     ...  "192.168.0.1",
     ... )
     """
+    __slots__ = ()
+
     def __init__(
         self,
         hostname: str,
@@ -71,6 +84,9 @@ class ARecord(DNSRecord):
             used
         )
 
+    def __reduce__(self):
+        return (self.__class__, (self.hostname, self.ip_address, self.used))
+
 
 class PTRRecord(DNSRecord):
     """
@@ -81,6 +97,8 @@ class PTRRecord(DNSRecord):
     ...  "192.168.0.1",
     ... )
     """
+    __slots__ = ()
+
     def __init__(
         self,
         hostname: str,
@@ -95,8 +113,13 @@ class PTRRecord(DNSRecord):
             used
         )
 
+    def __reduce__(self):
+        return (self.__class__, (self.hostname, self.ip_address, self.used))
+
 
 class RecordInfo:
+    __slots__ = ("ip_address", "hostname", "classname", "room", "comment")
+
     def __init__(
         self,
         ip_address: str,
@@ -130,6 +153,16 @@ class RecordInfo:
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __reduce__(self):
+        return (
+            self.__class__,
+            (self.ip_address,
+             self.hostname,
+             self.classname,
+             self.room,
+             self.comment)
+        )
+
     def __hash__(self):
         return hash((
             self.ip_address,
@@ -0,0 +1,443 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+
+"""
+This module serves records of in-memory networks as JSON over HTTP.
+
+:copyright: (c) 2015 by the KUSM Admin Team
+:license: MIT, see LICENSE for more details.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from urllib.parse import parse_qs, unquote, urlsplit
+from address import normalize_address
+from checker import CheckResult
+from network import Network, NetworkRouter
+from watcher import ZoneWatcher
+
+
+logger = getLogger(__name__)
+
+
+def _records_to_dicts(records) -> [dict]:
+    # 重なっているネットワークには同じレコードがはいっているので重複を除く
+    return [
+        {"hostname": hostname, "ip_address": ip_address}
+        for hostname, ip_address in sorted(set(
+            (record.hostname, record.ip_address) for record in records
+        ))
+    ]
+
+
+def _record_info_to_dict(record_info) -> dict:
+    return {
+        "ip_address": record_info.ip_address,
+        "hostname": record_info.hostname,
+        "classname": record_info.classname,
+        "room": record_info.room,
+        "comment": record_info.comment,
+    }
+
+
+def summarize_result(result: CheckResult) -> dict:
+    """
+    CheckResult を JSON にできる辞書にする
+    """
+    return {
+        "a_duplicated": {
+            hostname: sorted(record.ip_address for record in records)
+            for hostname, records in result.a_duplicated.items()
+        },
+        "a_not_found": sorted(
+            [record.hostname, record.ip_address]
+            for record in result.a_not_found
+        ),
+        "a_cor_error": sorted(
+            [record.hostname, record.ip_address,
+             sorted(ptr_record.hostname for ptr_record in ptr_records)]
+            for record, ptr_records in result.a_cor_error.items()
+        ),
+        "ptr_duplicated": {
+            ip_address: sorted(record.hostname for record in records)
+            for ip_address, records in result.ptr_duplicated.items()
+        },
+        "ptr_not_found": sorted(
+            [record.ip_address, record.hostname]
+            for record in result.ptr_not_found
+        ),
+        "ptr_cor_error": sorted(
+            [record.ip_address, record.hostname,
+             sorted(a_record.ip_address for a_record in a_records)]
+            for record, a_records in result.ptr_cor_error.items()
+        ),
+    }
+
+
+class NetworkIndex:
+    """
+    ひとつの Network を引くための索引
+
+    Network は作ったあとに変更されないものとして、IP アドレスから
+    A レコードのホスト名、ホスト名から PTR レコードを引く辞書と
+    チェック結果の JSON を作っておく
+    """
+    def __init__(
+        self,
+        network_address: str,
+        network: Network,
+        result: CheckResult
+    ):
+        self.network_address = network_address
+        self.network = network
+        self.a_ip_hostname = network.get_a_hostnames()
+        self.ptr_by_hostname = {}
+        for records in network.ptr_record.values():
+            for record in records:
+                if record.hostname in self.ptr_by_hostname:
+                    self.ptr_by_hostname[record.hostname].append(record)
+                else:
+                    self.ptr_by_hostname[record.hostname] = [record]
+        self.result = summarize_result(result)
+        self.summary = {
+            "network": network_address,
+            "a_records": sum(
+                len(records) for records in network.a_record.values()
+            ),
+            "ptr_records": sum(
+                len(records) for records in network.ptr_record.values()
+            ),
+            "errors": {
+                name: len(values) for name, values in self.result.items()
+            },
+        }
+
+    def get_hostnames(self) -> {str}:
+        hostnames = set(self.network.a_record.keys())
+        hostnames.update(self.ptr_by_hostname)
+        return hostnames
+
+
+class QueryIndex:
+    """
+    全てのネットワークの NetworkIndex と、ホスト名からそれを含む
+    ネットワークを引く索引
+
+    update はバックグラウンドのスレッドから呼ばれるので、
+    新しい NetworkIndex はロックの外で作り、ロックの中では
+    辞書を入れかえるだけにする
+
+    >>> index = QueryIndex()
+    >>> index.update(watcher.ip_network, watcher.results)
+    >>> index.query_host("host1")
+    {'hostname': 'host1', 'a': [...], 'ptr': [...]}
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._networks = {}
+        # ホスト名をキー、そのホスト名のレコードがあるネットワークアドレスの
+        # 集合を値とする辞書
+        self._hostname_networks = {}
+        self._router = NetworkRouter([])
+        self._router_networks = {}
+
+    def update(
+        self,
+        ip_network: {str: Network},
+        results: {str: CheckResult},
+        network_addresses: {str}=None
+    ) -> None:
+        """
+        network_addresses のネットワーク (None なら全て) の索引を作りなおす
+        """
+        if network_addresses is None:
+            network_addresses = set(ip_network)
+        indexes = {
+            network_address: NetworkIndex(
+                network_address,
+                ip_network[network_address],
+                results[network_address]
+            )
+            for network_address in network_addresses
+        }
+        hostnames = {
+            network_address: index.get_hostnames()
+            for network_address, index in indexes.items()
+        }
+        if set(ip_network) != set(self._router_networks.values()):
+            router_networks = {
+                network: network_address
+                for network_address, network in ip_network.items()
+            }
+            router = NetworkRouter(ip_network.values())
+        else:
+            router_networks, router = self._router_networks, self._router
+
+        with self.lock:
+            for network_address, index in indexes.items():
+                old_index = self._networks.get(network_address)
+                if old_index is not None:
+                    for hostname in old_index.get_hostnames():
+                        self._hostname_networks[hostname].discard(
+                            network_address
+                        )
+                for hostname in hostnames[network_address]:
+                    self._hostname_networks.setdefault(
+                        hostname, set()
+                    ).add(network_address)
+                self._networks[network_address] = index
+            self._router_networks, self._router = router_networks, router
+
+    def query_host(self, hostname: str) -> dict:
+        """
+        ホスト名の A レコードと PTR レコードを返す
+        """
+        hostname = hostname.split(".")[0]
+        a_records = []
+        ptr_records = []
+        with self.lock:
+            for network_address in sorted(
+                    self._hostname_networks.get(hostname, ())
+            ):
+                index = self._networks[network_address]
+                a_records.extend(index.network.a_record.get(hostname, ()))
+                ptr_records.extend(index.ptr_by_hostname.get(hostname, ()))
+        return {
+            "hostname": hostname,
+            "a": _records_to_dicts(a_records),
+            "ptr": _records_to_dicts(ptr_records),
+        }
+
+    def query_ip(self, ip_address: str) -> dict:
+        """
+        IP アドレスを含むネットワークごとの Network.iter_rows() の行と
+        レコード情報を返す。IP アドレスでなければ ValueError をだす
+        """
+        ip_address = normalize_address(ip_address)
+        with self.lock:
+            indexes = [
+                self._networks[self._router_networks[network]]
+                for network in self._router.lookup(ip_address)
+            ]
+        return {
+            "ip_address": ip_address,
+            "networks": [
+                {
+                    "network": index.network_address,
+                    "rows": index.network.get_rows(
+                        ip_address, index.a_ip_hostname
+                    ),
+                    "record_infos": [
+                        _record_info_to_dict(record_info)
+                        for record_info in
+                        index.network.record_info.get(ip_address, ())
+                    ],
+                }
+                for index in indexes
+            ],
+        }
+
+    def query_networks(self) -> [dict]:
+        """
+        全てのネットワークのレコード数とチェック結果の件数を返す
+        """
+        with self.lock:
+            return [index.summary for index in self._networks.values()]
+
+    def query_network(self, network_address: str) -> dict:
+        """
+        ネットワークのチェック結果を返す。なければ KeyError をだす
+        """
+        with self.lock:
+            index = self._networks[network_address]
+        return dict(index.summary, result=index.result)
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    次の GET リクエストに JSON で答える
+
+        /host/<ホスト名>          A レコードと PTR レコード
+        /ip/<IP アドレス>         iter_rows() の行とレコード情報
+        /networks                 ネットワークごとの件数
+        /network?address=<ネットワークアドレス>  チェック結果
+    """
+    # keep-alive で一つの接続で複数のリクエストを受けられるようにする
+    protocol_version = "HTTP/1.1"
+    # ヘッダと本体を別々に送るので、Nagle アルゴリズムと遅延 ACK で
+    # 40 ミリ秒待たされないようにする
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/", 1)
+        index = self.server.index
+        try:
+            if parts[0] == "host" and len(parts) == 2:
+                body = index.query_host(unquote(parts[1]))
+            elif parts[0] == "ip" and len(parts) == 2:
+                body = index.query_ip(unquote(parts[1]))
+            elif parts == ["networks"]:
+                body = index.query_networks()
+            elif parts == ["network"]:
+                body = index.query_network(
+                    parse_qs(url.query).get("address", [""])[0]
+                )
+            else:
+                return self._send_json(404, {"error": "not found"})
+        except ValueError as error:
+            return self._send_json(400, {"error": str(error)})
+        except KeyError as error:
+            return self._send_json(
+                404, {"error": "{} is not found".format(error.args[0])}
+            )
+        self._send_json(200, body)
+
+    def _send_json(self, status: int, body) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    ZoneWatcher で読んだネットワークを引く HTTP サーバ
+
+    ファイルの監視はバックグラウンドのスレッドで行い、
+    変更されたネットワークの索引だけを作りなおす
+
+    >>> server = QueryServer(("127.0.0.1", 8053), watcher)
+    >>> server.start_watching(interval=1.0)
+    >>> server.serve_forever()
+    $ curl http://127.0.0.1:8053/ip/192.168.0.1
+    """
+    daemon_threads = True
+
+    def __init__(
+        self,
+        server_address: (str, int),
+        watcher: ZoneWatcher
+    ):
+        ThreadingHTTPServer.__init__(
+            self, server_address, QueryRequestHandler
+        )
+        self.watcher = watcher
+        self.index = QueryIndex()
+        if not watcher.ip_network:
+            watcher.load()
+        self.index.update(watcher.ip_network, watcher.results)
+
+    def start_watching(self, interval: float=1.0) -> threading.Thread:
+        """
+        interval 秒ごとにファイルを調べて索引を更新するスレッドを開始する
+        """
+        def watch():
+            while True:
+                try:
+                    for network_addresses in self.watcher.watch(interval):
+                        self.index.update(
+                            self.watcher.ip_network,
+                            self.watcher.results,
+                            network_addresses
+                        )
+                except Exception:
+                    # 読みこめなかったときは前の索引のまま答えつづける
+                    logger.exception("failed to reload zone files")
+
+        thread = threading.Thread(target=watch, daemon=True)
+        thread.start()
+        return thread
+
+
+def test_query_server():
+    import os
+    import tempfile
+    from urllib.error import HTTPError
+    from urllib.request import urlopen
+
+    def write(filename, lines, mtime_ns):
+        with open(filename, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.utime(filename, ns=(mtime_ns, mtime_ns))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        a_filename = os.path.join(tmpdir, "example.jp.zone")
+        ptr_filename = os.path.join(tmpdir, "192.168.0.rev")
+        info_filename = os.path.join(tmpdir, "192.168.0.info")
+        write(a_filename, ["chiya A 192.168.0.1", "rize A 192.168.0.4"], 1)
+        write(ptr_filename, ["2 PTR chino", "4 PTR rize"], 1)
+        write(info_filename, ["192.168.0.4|rize|||テデザリゼ"], 1)
+
+        watcher = ZoneWatcher(
+            [a_filename],
+            [(ptr_filename, "192.168.0.0/24"),
+             (ptr_filename, "192.168.0.0/25")],
+            [info_filename]
+        )
+        server = QueryServer(("127.0.0.1", 0), watcher)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def get(path):
+            with urlopen("http://127.0.0.1:{}{}".format(
+                    server.server_address[1], path
+            )) as response:
+                return json.loads(response.read().decode("utf-8"))
+
+        try:
+            assert get("/host/rize.example.jp") == {
+                "hostname": "rize",
+                "a": [{"hostname": "rize", "ip_address": "192.168.0.4"}],
+                "ptr": [{"hostname": "rize", "ip_address": "192.168.0.4"}],
+            }
+            body = get("/ip/192.168.0.4")
+            assert [network["network"] for network in body["networks"]] \
+                == ["192.168.0.0/24", "192.168.0.0/25"]
+            assert body["networks"][0]["rows"] == [
+                ["192.168.0.4", "rize", "rize",
+                 "rize", None, None, "テデザリゼ"]
+            ]
+            assert body["networks"][0]["record_infos"][0]["comment"] == \
+                "テデザリゼ"
+            assert get("/ip/192.168.0.200")["networks"] == [{
+                "network": "192.168.0.0/24",
+                "rows": [["192.168.0.200", None, None, None, None, None,
+                          None]],
+                "record_infos": [],
+            }]
+            summary = get("/networks")[0]
+            assert summary["a_records"] == 2
+            assert summary["errors"]["a_not_found"] == 1
+            assert get("/network?address=192.168.0.0/24")["result"][
+                "ptr_not_found"] == [["192.168.0.2", "chino"]]
+
+            for path, status in [("/ip/host1", 400),
+                                 ("/network?address=10.0.0.0/8", 404),
+                                 ("/unknown", 404)]:
+                try:
+                    get(path)
+                    assert False
+                except HTTPError as error:
+                    assert error.code == status
+
+            # 変更されたネットワークの索引だけを作りなおす
+            write(ptr_filename, ["2 PTR chino", "1 PTR chiya"], 2)
+            server.index.update(
+                watcher.ip_network, watcher.results, watcher.poll()
+            )
+            assert get("/host/rize")["ptr"] == []
+            assert get("/host/chiya")["ptr"] == [
+                {"hostname": "chiya", "ip_address": "192.168.0.1"}
+            ]
+        finally:
+            server.shutdown()
+            server.server_close()
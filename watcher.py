@@ -0,0 +1,380 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+
+"""
+This module watches zone files and keeps parsed networks in memory.
+
+:copyright: (c) 2015 by the KUSM Admin Team
+:license: MIT, see LICENSE for more details.
+"""
+
+import os
+import time
+from collections import Counter
+from logging import getLogger
+import instrument
+from checker import Checker, CheckResult, recheck
+from network import Network, NetworkRouter, make_network
+from parser import RecordParser, RecordInfoParser
+from record import RecordInfo
+from zonefile import find_includes
+
+
+logger = getLogger(__name__)
+
+
+def _get_stat(filename: str) -> (int, int):
+    """
+    ファイルの (サイズ, 更新時刻) を返す。ファイルがなければ None を返す
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ZoneWatcher:
+    """
+    ゾーンファイルとレコード情報ファイルを監視するクラス
+
+    解析したレコードをファイルごとにメモリにおいておき、サイズか
+    更新時刻 ($INCLUDE しているファイルも含む) が変わったファイルだけを
+    解析しなおす。前回から増減したレコードを含むネットワークだけを
+    メモリのレコードから作りなおし、増減したホスト名と IP アドレスに
+    関係するところだけをチェックしなおす。レコードはネットワークごとにも
+    持っておき、増減したレコードだけを振り分けなおすので、ファイルが
+    変わったときにかかる時間はサイト全体の大きさによらない
+
+    >>> watcher = ZoneWatcher(
+    ...     a_record_filenames,
+    ...     ptr_record_filename_networks,
+    ...     record_info_filenames
+    ... )
+    >>> watcher.load()
+    >>> for network_addresses in watcher.watch(interval=1.0):
+    ...     for network_address in network_addresses:
+    ...         print(watcher.results[network_address])
+    """
+    def __init__(
+        self,
+        a_record_filenames: [str],
+        ptr_record_filename_networks: [(str, str)],
+        record_info_filenames: [str],
+        network_class: type=Network,
+        cache=None
+    ):
+        """
+        network_class, cache は make_ip_network と同じ
+        """
+        self.network_class = network_class
+        self.cache = cache
+        parser = RecordParser()
+        # レコードの種類ごとの、ファイルのリストを解析する関数
+        self._parse_files = {
+            "A": parser.iter_a_record_files,
+            "PTR": parser.iter_ptr_record_files,
+            "INFO": RecordInfoParser().iter_files,
+        }
+
+        # 監視するファイルの (種類, ファイル名) のリストで、
+        # PTR レコードのファイル名は (ファイル名, ネットワークアドレス)
+        self.sources = [("A", filename) for filename in a_record_filenames]
+        self.sources.extend(
+            ("PTR", source) for source in ptr_record_filename_networks
+        )
+        self.sources.extend(
+            ("INFO", filename) for filename in record_info_filenames
+        )
+
+        # (種類, ファイル名) をキーとして、レコードのリスト、
+        # $INCLUDE しているファイルのリスト、解析する前の
+        # ファイルと $INCLUDE しているファイルの _get_stat の結果を持つ
+        self._records = {}
+        self._includes = {}
+        self._stats = {}
+
+        # ネットワークアドレスをキー、Network と CheckResult を値とする辞書
+        self.ip_network = {}
+        self.results = {}
+
+        # ネットワークアドレスをキー、そのネットワークにはいるレコードを
+        # 定義しているファイルの数の Counter を値とする辞書
+        self._network_records = {}
+        # レコードを振り分けるための、範囲だけを持つ空のネットワークと
+        # そのネットワークアドレス、NetworkRouter
+        self._ranges = {}
+        self._ranges_addresses = {}
+        self._router = None
+
+    def _get_filename(self, key: (str, object)) -> str:
+        _, source = key
+        return source if isinstance(source, str) else source[0]
+
+    def _get_stats(self, key: (str, object)) -> [(int, int)]:
+        return [
+            _get_stat(filename)
+            for filename in
+            [self._get_filename(key)] + self._includes.get(key, [])
+        ]
+
+    def _parse(self, key: (str, object)) -> None:
+        """
+        ファイルを解析してレコードを self._records[key] におく
+        """
+        kind, source = key
+        filename = self._get_filename(key)
+        # 解析している間に書きかえられても次に調べたときにわかるように、
+        # 状態は解析する前にとる
+        self._includes[key] = find_includes(filename)
+        self._stats[key] = self._get_stats(key)
+        if self._stats[key][0] is None:
+            logger.warning("{} is not found".format(filename))
+            self._records[key] = []
+        elif self.cache is not None:
+            self._records[key] = self.cache.parse_files(
+                kind, [source], self._parse_files[kind]
+            )[0]
+        else:
+            self._records[key] = list(
+                next(iter(self._parse_files[kind]([source])))
+            )
+
+    def _route(
+        self,
+        kind: str,
+        source,
+        records,
+        delta: int,
+        changed: {str: ({str}, {str})}=None
+    ) -> None:
+        """
+        records をそれがはいるネットワークのレコードの Counter に
+        delta (1 か -1) だけ加える
+
+        changed を渡すと、ネットワークアドレスをキーとして、増減した
+        A レコードのホスト名と PTR レコードの IP アドレスの集合の組を集める
+        """
+        for record in records:
+            if kind == "PTR":
+                # PTR レコードはそのファイルのネットワークにだけはいる
+                network_address = source[1]
+                if not self._ranges[network_address].contains_address(
+                        record.ip_address
+                ):
+                    continue
+                network_addresses = [network_address]
+            else:
+                network_addresses = [
+                    self._ranges_addresses[network]
+                    for network in self._router.lookup(record.ip_address)
+                ]
+            for network_address in network_addresses:
+                counter = self._network_records[network_address]
+                counter[record] += delta
+                if counter[record] <= 0:
+                    del counter[record]
+                if changed is None:
+                    continue
+                hostnames, ip_addresses = changed.setdefault(
+                    network_address, (set(), set())
+                )
+                if kind == "A":
+                    hostnames.add(record.hostname)
+                elif kind == "PTR":
+                    ip_addresses.add(record.ip_address)
+
+    def _make_network(self, network_address: str) -> Network:
+        """
+        メモリにおいているレコードからネットワークを作る
+        """
+        network = make_network(network_address, self.network_class)
+        for record in self._network_records[network_address]:
+            if isinstance(record, RecordInfo):
+                network.add_record_info(record, check_range=False)
+            else:
+                network.add_record(record, check_range=False)
+        return network
+
+    def load(self) -> {str: CheckResult}:
+        """
+        全てのファイルを解析し、全てのネットワークをチェックする
+
+        ネットワークアドレスをキー、CheckResult を値とする辞書を返す
+        """
+        with instrument.stage("parse"):
+            for key in self.sources:
+                self._parse(key)
+
+        self._ranges = {}
+        for kind, source in self.sources:
+            if kind == "PTR":
+                self._ranges[source[1]] = make_network(source[1], Network)
+        self._ranges_addresses = {
+            network: network_address
+            for network_address, network in self._ranges.items()
+        }
+        self._router = NetworkRouter(self._ranges.values())
+        self._network_records = {
+            network_address: Counter() for network_address in self._ranges
+        }
+        with instrument.stage("route"):
+            for (kind, source), records in self._records.items():
+                self._route(kind, source, set(records), 1)
+            self.ip_network = {
+                network_address: self._make_network(network_address)
+                for network_address in self._ranges
+            }
+        self.results = {
+            network_address: Checker(network).check()
+            for network_address, network in self.ip_network.items()
+        }
+        return self.results
+
+    def poll(self) -> {str}:
+        """
+        変更されたファイルを解析しなおし、増減したレコードだけを
+        それがはいるネットワークに振り分けなおして、それらの
+        ネットワークだけを作りなおしてチェックしなおす
+
+        チェックしなおしたネットワークアドレスの集合を返す
+        """
+        changed = [
+            key for key in self.sources
+            if self._stats[key] != self._get_stats(key)
+        ]
+        if not changed:
+            return set()
+
+        start = time.perf_counter()
+        # ネットワークアドレスごとの、増減した A レコードのホスト名と
+        # PTR レコードの IP アドレスの組。レコード情報だけが増減した
+        # ネットワークも、チェックには関係しないが作りなおす
+        changed_keys = {}
+        for key in changed:
+            kind, source = key
+            logger.debug("{} is changed".format(self._get_filename(key)))
+            with instrument.stage("parse"):
+                records = set(self._records[key])
+                self._parse(key)
+                new_records = set(self._records[key])
+            with instrument.stage("route"):
+                self._route(
+                    kind, source, records - new_records, -1, changed_keys
+                )
+                self._route(
+                    kind, source, new_records - records, 1, changed_keys
+                )
+
+        with instrument.stage("route"):
+            ip_network = {
+                network_address: self._make_network(network_address)
+                for network_address in changed_keys
+            }
+        for network_address, network in ip_network.items():
+            hostnames, ip_addresses = changed_keys[network_address]
+            self.ip_network[network_address] = network
+            self.results[network_address] = recheck(
+                network,
+                self.results[network_address],
+                hostnames,
+                ip_addresses
+            )
+        logger.info(
+            "{} files changed, {} networks rechecked in {:.3f} sec".format(
+                len(changed), len(ip_network), time.perf_counter() - start
+            )
+        )
+        return set(ip_network)
+
+    def watch(self, interval: float=1.0):
+        """
+        interval 秒ごとに poll を呼び、チェックしなおした
+        ネットワークアドレスの集合を生成する
+        """
+        while True:
+            time.sleep(interval)
+            network_addresses = self.poll()
+            if network_addresses:
+                yield network_addresses
+
+
+def test_zone_watcher():
+    import tempfile
+    from record import ARecord, PTRRecord
+
+    def write(filename, lines, mtime_ns):
+        with open(filename, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.utime(filename, ns=(mtime_ns, mtime_ns))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        a_filename = os.path.join(tmpdir, "example.jp.zone")
+        hosts_filename = os.path.join(tmpdir, "hosts.zone")
+        ptr_filename = os.path.join(tmpdir, "192.168.0.rev")
+        other_ptr_filename = os.path.join(tmpdir, "192.168.1.rev")
+        info_filename = os.path.join(tmpdir, "192.168.0.info")
+        write(a_filename, ["$INCLUDE hosts.zone", "rize A 192.168.1.1"], 1)
+        write(hosts_filename, ["chiya A 192.168.0.1"], 1)
+        write(ptr_filename, ["2 PTR chino"], 1)
+        write(other_ptr_filename, ["1 PTR rize"], 1)
+        write(info_filename, ["192.168.0.1|chiya|||"], 1)
+
+        watcher = ZoneWatcher(
+            [a_filename],
+            [(ptr_filename, "192.168.0.0/24"),
+             (other_ptr_filename, "192.168.1.0/24")],
+            [info_filename]
+        )
+        results = watcher.load()
+        assert results["192.168.0.0/24"].a_not_found == [
+            ARecord("chiya", "192.168.0.1")
+        ]
+        assert watcher.poll() == set()
+
+        # PTR レコードを追加したネットワークだけをチェックしなおす
+        write(ptr_filename, ["2 PTR chino", "1 PTR chiya"], 2)
+        other_network = watcher.ip_network["192.168.1.0/24"]
+        assert watcher.poll() == {"192.168.0.0/24"}
+        assert watcher.ip_network["192.168.1.0/24"] is other_network
+        assert watcher.results["192.168.0.0/24"].a_not_found == []
+        assert watcher.results["192.168.0.0/24"].ptr_not_found == [
+            PTRRecord("chino", "192.168.0.2")
+        ]
+
+        # $INCLUDE しているファイルの変更。増えたレコードだけを振り分ける
+        lookup = watcher._router.lookup
+        looked_up = []
+
+        def counting_lookup(ip_address):
+            looked_up.append(ip_address)
+            return lookup(ip_address)
+        watcher._router.lookup = counting_lookup
+        write(hosts_filename, ["chiya A 192.168.0.1", "chino A 192.168.0.2"],
+              2)
+        assert watcher.poll() == {"192.168.0.0/24"}
+        assert looked_up == ["192.168.0.2"]
+        assert watcher.results["192.168.0.0/24"].ptr_not_found == []
+
+        # レコード情報だけの変更
+        write(info_filename, ["192.168.0.1|chiya|||宇治抹茶"], 2)
+        assert watcher.poll() == {"192.168.0.0/24"}
+        assert watcher.ip_network["192.168.0.0/24"].record_info[
+            "192.168.0.1"
+        ] == {RecordInfo("192.168.0.1", "chiya", None, None, "宇治抹茶")}
+
+        # 内容が変わらなければチェックしなおさない
+        write(ptr_filename, ["2 PTR chino", "1 PTR chiya"], 3)
+        assert watcher.poll() == set()
+        assert watcher.poll() == set()
+
+        for network_address, network in watcher.ip_network.items():
+            full_result = Checker(network).check()
+            result = watcher.results[network_address]
+            for attr in ["a_duplicated", "a_cor_error",
+                         "ptr_duplicated", "ptr_cor_error"]:
+                assert getattr(result, attr) == getattr(full_result, attr)
+            for attr in ["a_not_found", "ptr_not_found"]:
+                assert set(getattr(result, attr)) == \
+                    set(getattr(full_result, attr))
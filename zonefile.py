@@ -0,0 +1,424 @@
+#! /usr/bin/env python
+# coding:utf-8
+
+
+"""
+This module reads zone files in the RFC 1035 master file format.
+
+:copyright: (c) 2015 by the KUSM Admin Team
+:license: MIT, see LICENSE for more details.
+"""
+
+import os
+import re
+from collections import namedtuple
+from logging import getLogger
+
+
+logger = getLogger(__name__)
+
+
+class ZoneFileError(Exception):
+    pass
+
+
+# ゾーンファイルのひとつのリソースレコード
+# owner は $ORIGIN がわかっていれば絶対名 ("host1.example.jp.")、
+# わからなければ書かれたままの相対名 ("host1")、
+# rdata はタイプより後ろのトークンのリスト
+ResourceRecord = namedtuple(
+    "ResourceRecord",
+    ["owner", "ttl", "rclass", "type", "rdata"]
+)
+
+CLASSES = {"IN", "CH", "HS", "CS"}
+
+# $TTL や TTL 欄の単位
+_TTL_UNITS = {"": 1, "S": 1, "M": 60, "H": 3600, "D": 86400, "W": 604800}
+_ttl_regex = re.compile(r'(\d+)([SMHDW]?)', re.IGNORECASE)
+
+_include_regex = re.compile(rb'^\$INCLUDE[ \t]+(\S+)', re.IGNORECASE | re.M)
+
+
+def parse_ttl(token: str) -> int:
+    """
+    "3600" や "1h30m" のような TTL を秒にする。TTL でなければ None を返す
+
+    >>> parse_ttl("1h30m")
+    5400
+    """
+    if not token[0].isdigit():
+        return None
+    ttl = 0
+    position = 0
+    for match in _ttl_regex.finditer(token):
+        if match.start() != position:
+            return None
+        ttl += int(match.group(1)) * _TTL_UNITS[match.group(2).upper()]
+        position = match.end()
+    if position != len(token):
+        return None
+    return ttl
+
+
+def _tokenize_quoted(line: str) -> [str]:
+    """
+    " を含む行をトークンに分ける
+
+    " で囲まれた部分は " をつけたままひとつのトークンにし、
+    その中の ; と括弧は特別扱いしない
+    """
+    tokens = []
+    token = []
+    quoted = False
+    escaped = False
+    for c in line:
+        if escaped:
+            token.append(c)
+            escaped = False
+        elif c == "\\":
+            token.append(c)
+            escaped = True
+        elif quoted:
+            token.append(c)
+            if c == '"':
+                quoted = False
+        elif c == '"':
+            token.append(c)
+            quoted = True
+        elif c == ";":
+            break
+        elif c in "()":
+            if token:
+                tokens.append("".join(token))
+                token = []
+            tokens.append(c)
+        elif c.isspace():
+            if token:
+                tokens.append("".join(token))
+                token = []
+        else:
+            token.append(c)
+    if token:
+        tokens.append("".join(token))
+    return tokens
+
+
+def iter_entries(lines):
+    """
+    行のイテレータをトークンに分け、括弧で複数行にまたがるものを
+    まとめて
+
+        (行頭が空白かどうか, トークンのリスト)
+
+    を順に生成する。コメントと空行はとばす
+
+    >>> list(iter_entries(["host1 A 192.168.0.1 ; comment",
+    ...                    "      A 192.168.0.2"]))
+    [(False, ['host1', 'A', '192.168.0.1']), (True, ['A', '192.168.0.2'])]
+    """
+    entry = None
+    blank_owner = False
+    depth = 0
+    for line in lines:
+        # ほとんどの行は " も括弧も含まないので str.split だけで分ける
+        if '"' in line:
+            tokens = _tokenize_quoted(line)
+        else:
+            if ";" in line:
+                line = line[:line.index(";")]
+            if "(" in line or ")" in line:
+                line = line.replace("(", " ( ").replace(")", " ) ")
+            tokens = line.split()
+
+        if entry is None:
+            if not tokens:
+                continue
+            blank_owner = line[0] in " \t"
+
+        if depth == 0 and "(" not in tokens and ")" not in tokens:
+            yield blank_owner, tokens
+            continue
+
+        if entry is None:
+            entry = []
+        for token in tokens:
+            if token == "(":
+                depth += 1
+            elif token == ")":
+                depth -= 1
+            else:
+                entry.append(token)
+        if depth <= 0:
+            yield blank_owner, entry
+            entry = None
+            depth = 0
+
+    # 閉じていない括弧はファイルの終わりで閉じる
+    if entry:
+        yield blank_owner, entry
+
+
+def find_includes(filename: str) -> [str]:
+    """
+    filename が $INCLUDE しているファイルを再帰的に探してパスのリストを返す
+
+    キャッシュが古くなったかを調べるためのもので、ファイルを
+    バイト列のまま正規表現で探すのでゾーンファイルを解析するより速い
+    """
+    includes = []
+    pending = [os.path.abspath(filename)]
+    while pending:
+        path = pending.pop()
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            continue
+        for match in _include_regex.finditer(data):
+            include = os.path.join(
+                os.path.dirname(path),
+                os.fsdecode(match.group(1))
+            )
+            if include not in includes:
+                includes.append(include)
+                pending.append(include)
+    return includes
+
+
+class ZoneReader:
+    """
+    RFC 1035 のマスターファイル形式のゾーンファイルを読むクラス
+
+    $ORIGIN, $TTL, $INCLUDE, 括弧による複数行のレコード、@ と相対名、
+    行頭が空白の行での直前のオーナー名の引き継ぎ、TTL とクラスの省略に
+    対応する。$INCLUDE の相対パスは $INCLUDE を書いたファイルの
+    ディレクトリからのパスとする。読んでいる途中のファイルを
+    $INCLUDE しているときは、循環しないようにそのファイルを読まない
+
+    >>> reader = ZoneReader()
+    >>> for record in reader.read_file("zones/example.jp.zone"):
+    ...     print(record.owner, record.type, record.rdata)
+    host1.example.jp. A ['192.168.0.1']
+    """
+    def __init__(
+        self,
+        origin: str=None,
+        ttl: int=None
+    ):
+        self.origin = self._make_origin(origin) if origin else None
+        self.ttl = ttl
+        # 直前のレコードのオーナー名、TTL、クラス
+        self.last_owner = None
+        self.last_ttl = ttl
+        self.last_rclass = "IN"
+        # 読んでいる途中のファイルの絶対パスのスタック
+        self.including = []
+
+    def _make_origin(self, name: str) -> str:
+        return name if name.endswith(".") else name + "."
+
+    def make_absolute(self, name: str) -> str:
+        """
+        name を $ORIGIN からの絶対名にする。$ORIGIN がわからなければ
+        name をそのまま返す
+        """
+        if name == "@":
+            if self.origin is None:
+                raise ZoneFileError("@ is used without $ORIGIN")
+            return self.origin
+        if name.endswith(".") or self.origin is None:
+            return name
+        if self.origin == ".":
+            return name + "."
+        return name + "." + self.origin
+
+    def read_file(self, filename: str):
+        """
+        ゾーンファイルのリソースレコードを順に生成する
+        """
+        path = os.path.abspath(filename)
+        with open(filename) as f:
+            self.including.append(path)
+            try:
+                yield from self.read_lines(f, os.path.dirname(filename))
+            finally:
+                self.including.pop()
+
+    def read_lines(
+        self,
+        lines,
+        include_dir: str="."
+    ):
+        """
+        行のイテレータをゾーンファイルとして解析し、
+        リソースレコードを順に生成する
+
+        解析できないエントリは ZoneFileError を生成するかわりに
+        None を生成する
+        """
+        for blank_owner, tokens in iter_entries(lines):
+            if not blank_owner and tokens[0][0] == "$":
+                yield from self._read_directive(tokens, include_dir)
+                continue
+            try:
+                yield self._make_record(blank_owner, tokens)
+            except ZoneFileError:
+                yield None
+
+    def _read_directive(
+        self,
+        tokens: [str],
+        include_dir: str
+    ):
+        directive = tokens[0].upper()
+        if directive == "$ORIGIN" and len(tokens) >= 2:
+            self.origin = self._make_origin(self.make_absolute(tokens[1]))
+        elif directive == "$TTL" and len(tokens) >= 2:
+            self.ttl = parse_ttl(tokens[1])
+        elif directive == "$INCLUDE" and len(tokens) >= 2:
+            filename = os.path.join(include_dir, tokens[1])
+            if os.path.abspath(filename) in self.including:
+                logger.warning("{} is included recursively".format(
+                    filename
+                ))
+                yield None
+                return
+            # $INCLUDE したファイルの中の $ORIGIN などは
+            # もとのファイルには影響しない
+            saved = (self.origin, self.last_owner)
+            if len(tokens) >= 3:
+                self.origin = self._make_origin(
+                    self.make_absolute(tokens[2])
+                )
+            try:
+                yield from self.read_file(filename)
+            except OSError:
+                yield None
+            self.origin, self.last_owner = saved
+        else:
+            yield None
+
+    def _make_record(
+        self,
+        blank_owner: bool,
+        tokens: [str]
+    ) -> ResourceRecord:
+        if blank_owner:
+            if self.last_owner is None:
+                raise ZoneFileError("no owner name")
+            owner = self.last_owner
+            i = 0
+        else:
+            owner = self.make_absolute(tokens[0])
+            i = 1
+
+        # TTL とクラスはどちらも省略でき、順番も自由
+        ttl = None
+        rclass = None
+        while i < len(tokens):
+            token = tokens[i]
+            if rclass is None and token.upper() in CLASSES:
+                rclass = token.upper()
+            elif ttl is None and token[0].isdigit():
+                ttl = parse_ttl(token)
+                if ttl is None:
+                    break
+            else:
+                break
+            i += 1
+        if i >= len(tokens):
+            raise ZoneFileError("no type")
+
+        if ttl is None:
+            ttl = self.last_ttl if self.ttl is None else self.ttl
+        if rclass is None:
+            rclass = self.last_rclass
+        self.last_owner = owner
+        self.last_ttl = ttl
+        self.last_rclass = rclass
+        return ResourceRecord(
+            owner, ttl, rclass, tokens[i].upper(), tokens[i + 1:]
+        )
+
+
+def test_zone_reader():
+    import tempfile
+
+    lines = [
+        "$ORIGIN example.jp.",
+        "$TTL 1h",
+        "@ IN SOA ns1 root.example.jp. (",
+        "      2015010101 ; serial",
+        "      3600 900 604800 86400 )",
+        "    NS ns1",
+        "host1 A 192.168.0.1",
+        "      A 192.168.0.2 ; 同じホストのもうひとつのアドレス",
+        "host2.example.jp. 300 IN A 192.168.0.3",
+        "host3 IN 1d A 192.168.0.4",
+        'txt TXT "a ; b (" "c"',
+        "$ORIGIN sub",
+        "host4 A 192.168.0.5",
+        "$INCLUDE other.zone",
+        "      A 192.168.0.6",
+    ]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "example.jp.zone")
+        with open(filename, "w") as f:
+            f.write("\n".join(lines))
+        with open(os.path.join(tmpdir, "other.zone"), "w") as f:
+            f.write("$ORIGIN other.jp.\nhost5 A 192.168.0.7\n")
+
+        records = list(ZoneReader().read_file(filename))
+        assert find_includes(filename) == [
+            os.path.join(tmpdir, "other.zone")
+        ]
+
+        # 自分自身や、互いに $INCLUDE しているファイルは一度だけ読む
+        self_filename = os.path.join(tmpdir, "self.zone")
+        with open(self_filename, "w") as f:
+            f.write("$INCLUDE self.zone\nhost6 A 192.168.0.8\n")
+        assert list(ZoneReader().read_file(self_filename)) == [
+            None, ResourceRecord("host6", None, "IN", "A", ["192.168.0.8"])
+        ]
+        with open(os.path.join(tmpdir, "a.zone"), "w") as f:
+            f.write("$INCLUDE b.zone\nhost7 A 192.168.0.9\n")
+        with open(os.path.join(tmpdir, "b.zone"), "w") as f:
+            f.write("$INCLUDE a.zone\nhost8 A 192.168.0.10\n")
+        assert [
+            record.owner for record in
+            ZoneReader().read_file(os.path.join(tmpdir, "a.zone"))
+            if record is not None
+        ] == ["host8", "host7"]
+
+    assert records[0] == ResourceRecord(
+        "example.jp.", 3600, "IN", "SOA",
+        ["ns1", "root.example.jp.", "2015010101",
+         "3600", "900", "604800", "86400"]
+    )
+    assert records[1] == ResourceRecord(
+        "example.jp.", 3600, "IN", "NS", ["ns1"]
+    )
+    assert [(record.owner, record.ttl, record.rdata)
+            for record in records if record.type == "A"] == [
+        ("host1.example.jp.", 3600, ["192.168.0.1"]),
+        ("host1.example.jp.", 3600, ["192.168.0.2"]),
+        ("host2.example.jp.", 300, ["192.168.0.3"]),
+        ("host3.example.jp.", 86400, ["192.168.0.4"]),
+        ("host4.sub.example.jp.", 3600, ["192.168.0.5"]),
+        ("host5.other.jp.", 3600, ["192.168.0.7"]),
+        # $INCLUDE のあとはもとの $ORIGIN とオーナー名にもどる
+        ("host4.sub.example.jp.", 3600, ["192.168.0.6"]),
+    ]
+    assert records[6] == ResourceRecord(
+        "txt.example.jp.", 3600, "IN", "TXT", ['"a ; b ("', '"c"']
+    )
+
+    # $ORIGIN がなければ相対名のまま
+    assert list(ZoneReader().read_lines(["2 PTR chino"])) == [
+        ResourceRecord("2", None, "IN", "PTR", ["chino"])
+    ]
+    # オーナー名のない行
+    assert list(ZoneReader().read_lines(["   A 192.168.0.3"])) == [None]
+    assert parse_ttl("1h30m") == 5400
+    assert parse_ttl("1x") is None